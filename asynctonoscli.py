@@ -0,0 +1,185 @@
+import asyncio
+import threading
+import weakref
+from concurrent.futures import ThreadPoolExecutor
+from tonoscliwrapper import TonosCli
+import tonoscache
+import procstream
+import time
+import retry
+import metrics
+import tracing
+
+
+class AsyncTonosCli(TonosCli):
+    '''
+    asyncio counterpart of TonosCli read methods, uses the same output parsers
+    '''
+    CONCURRENCY = 4
+
+    def __init__(self, program_path='tonos-cli', concurrency=CONCURRENCY, cache=None):
+        '''
+        :param concurrency: max number of tonos-cli processes running at the same time
+        :param cache: TonosCache shared with CachedTonosCli
+        '''
+        super().__init__(program_path)
+        self.concurrency = concurrency
+        self.cache = cache
+        # semaphore of every event loop using the client, loops of finished run_sync calls are dropped
+        self.semaphores = weakref.WeakKeyDictionary()
+        self.lock = threading.Lock()
+
+    def _semaphore(self):
+        loop = asyncio.get_event_loop()
+        with self.lock:
+            if loop not in self.semaphores:
+                self.semaphores[loop] = asyncio.Semaphore(self.concurrency)
+            return self.semaphores[loop]
+
+    @staticmethod
+    def _kill(process):
+        if process.returncode is None:
+            try:
+                process.kill()
+            except ProcessLookupError:
+                pass
+
+    async def _read(self, process, reader):
+        '''
+        Reads output until EOF or until reader has got the needed part
+        '''
+        while True:
+            chunk = await process.stdout.read(procstream.CHUNK)
+            if not chunk or reader.feed(chunk):
+                break
+        if reader.end is not None or reader.overflow:
+            self._kill(process)
+        await process.wait()
+
+    async def _evaluate_async(self, args, done=None):
+        '''
+        Run tonos-cli program, the process is killed if the coroutine is cancelled
+        :param args: args to tonos-cli
+        :param done: end of needed output for read only commands, see procstream.run
+        :return: return value and stdout of tonos-cli
+        '''
+        params = [self.program_path] + args
+        timeout = retry.timeout(self.TIMEOUT)
+        reader = procstream.OutputReader(done)
+        async with self._semaphore():
+            start = time.time()
+            try:
+                process = await asyncio.create_subprocess_exec(*params, stdout=asyncio.subprocess.PIPE)
+            except Exception as e:
+                metrics.external_call('tonos-cli', args, start, -1)
+                tracing.external_call('tonos-cli', args, start, -1)
+                return -1, 'Cmd: %s (TIMEOUT %d)\n' % (params, timeout) + str(e)
+            try:
+                await asyncio.wait_for(self._read(process, reader), timeout)
+                retcode, out, timed_out = reader.result(process.returncode)
+            except asyncio.TimeoutError:
+                self._kill(process)
+                await process.wait()
+                retcode, out, timed_out = reader.result(procstream.TIMEOUT, True)
+            except asyncio.CancelledError:
+                self._kill(process)
+                await process.wait()
+                raise
+        metrics.external_call('tonos-cli', args, start, retcode, timed_out)
+        tracing.external_call('tonos-cli', args, start, retcode)
+        if retcode != 0:
+            out = 'Cmd: %s (TIMEOUT %d)\n' % (params, timeout) + out
+        return retcode, out
+
+    async def _cached(self, key, args, parse, done=None):
+        if self.cache is not None:
+            found, value = self.cache.get(key)
+            if found:
+                return True, value
+        retcode, out = await self._evaluate_async(args, done)
+        res, out = parse(retcode, out)
+        if res and self.cache is not None:
+            self.cache.put(key, out)
+        return res, out
+
+    async def getconfig(self, index):
+        return await self._cached(tonoscache.config_key(index),
+                                  ['getconfig', str(index)],
+                                  lambda retcode, out: self._parse_config(index, retcode, out),
+                                  procstream.JsonAfter('Config p%d: ' % index))
+
+    async def account(self, addr):
+        return await self._cached(tonoscache.account_key(addr),
+                                  ['account', addr],
+                                  self._parse_account,
+                                  self._balance_line())
+
+    async def runget(self, addr, method, *params):
+        res, out = await self._cached(tonoscache.runget_key(addr, method, *params),
+                                      ['runget', addr, method] + list(params),
+                                      self._parse_result,
+                                      procstream.JsonAfter('Result: '))
+        if res and self.cache is not None:
+            tonoscache.update_election(self.cache, method, out)
+        return res, out
+
+    async def run(self, addr, method, abi, sign, *params):
+        retcode, out = await self._evaluate_async(self._abi_args('run', addr, method, abi, sign, params), procstream.JsonAfter('Result: '))
+        return self._parse_result(retcode, out, True)
+
+    async def getTransactions(self, addr, abi):
+        return await self._cached(tonoscache.run_key(addr, 'getTransactions'),
+                                  self._abi_args('run', addr, 'getTransactions', abi, None, ['{}']),
+                                  lambda retcode, out: self._parse_result(retcode, out, True),
+                                  procstream.JsonAfter('Result: '))
+
+    async def getCustodians(self, addr, abi):
+        return await self._cached(tonoscache.run_key(addr, 'getCustodians'),
+                                  self._abi_args('run', addr, 'getCustodians', abi, None, ['{}']),
+                                  lambda retcode, out: self._parse_result(retcode, out, True),
+                                  procstream.JsonAfter('Result: '))
+
+
+class ThreadedAsyncCli:
+    '''
+    Async interface for blocking read backends (GraphQL), methods are run in a thread pool
+    '''
+
+    def __init__(self, backend, concurrency=AsyncTonosCli.CONCURRENCY, cache=None):
+        self.backend = backend
+        self.cache = cache
+        self.executor = ThreadPoolExecutor(max_workers=concurrency)
+
+    def __getattr__(self, name):
+        method = getattr(self.backend, name)
+
+        async def run(*args):
+            # deadline is thread local, pool threads get the deadline of the calling run
+            deadline = retry.current_deadline()
+
+            def call():
+                with retry.deadline_scope(deadline):
+                    return method(*args)
+            return await asyncio.get_event_loop().run_in_executor(self.executor, call)
+        return run
+
+
+def async_for_backend(t, backend, program_path, concurrency, cache):
+    '''
+    :param t: TonosCli or CachedTonosCli over backend
+    :param backend: read backend, tonos-cli runs async processes, others run in threads
+    '''
+    if isinstance(backend, TonosCli):
+        return AsyncTonosCli(program_path, concurrency, cache)
+    return ThreadedAsyncCli(t, concurrency, cache)
+
+
+def run_sync(coroutine):
+    '''
+    Runs coroutine in a new event loop, safe to call from any thread
+    '''
+    loop = asyncio.new_event_loop()
+    try:
+        return loop.run_until_complete(coroutine)
+    finally:
+        loop.close()
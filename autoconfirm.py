@@ -1,21 +1,142 @@
 from tonoscliwrapper import TonosCli
+from tonoscache import cached_from_config
+from graphqlclient import backend_from_config
+from dispatcher import dispatcher_from_config
+from dedupe import dedupe_from_config
+from asynctonoscli import AsyncTonosCli
 import json
 import utils
+import retry
+import metrics
+import scheduler
 from datetime import datetime
 import time
 import sys
+import threading
+import argparse
 from version import VERSION
 
+# confirmations log from several threads
+_print_lock = threading.Lock()
+
 def printl(*args):
-    print(datetime.fromtimestamp(time.time()).strftime('%Y-%m-%d %H:%M:%S:'), *args, flush=True)
+    with _print_lock:
+        print(datetime.fromtimestamp(time.time()).strftime('%Y-%m-%d %H:%M:%S:'), *args, flush=True)
+
+def transaction_age(trans_id, now):
+    '''
+    Seconds since creation of multisig transaction, creation time is in high 32 bits of transaction id
+    '''
+    try:
+        return now - (int(trans_id, 0) >> 32)
+    except:
+        return None
+
+def custodian_wallets(config, user_conf):
+    '''
+    Wallets confirmed by this custodian: "wallets" list or "wallet" section, keyfile of "wallet" is the default
+    :return: list of (msig_addr, keyfile)
+    '''
+    wallets = config.get('wallets') or [user_conf]
+    return [(w['msig_addr'], w.get('keyfile', user_conf.get('keyfile'))) for w in wallets]
+
+def notify_results(results, notify_conf, email_conf):
+    '''
+    :param results: {msig_addr: (confirmed ids, unconfirmed ids)}
+    '''
+    for msig_addr, (confirmed, unconfirmed) in results.items():
+        if len(confirmed) > 0:
+            msg = 'Confirmed transactions of %s: %s' % (msig_addr, confirmed)
+            utils.notify_owner(msg, notify_conf, email_conf)
+
+        if len(unconfirmed) > 0:
+            msg = 'Cannot confirm transactions of %s: %s' % (msig_addr, unconfirmed)
+            utils.notify_owner(msg, notify_conf, email_conf, ('confirm_failed', msig_addr, None))
+
+def fetch_metadata(t):
+    '''
+    Elector address and elections timing for poll interval
+    :return: (elector address, active election id, config15, config34) or None
+    '''
+    elector_addr = utils.get_elector_address(t)
+    if elector_addr is None:
+        return None
+    res, out = t.runget(elector_addr, 'active_election_id')
+    if not res:
+        printl(out)
+        return None
+    res15, config15 = t.getconfig(15)
+    res34, config34 = t.getconfig(34)
+    if not res15 or not res34:
+        printl(config15 if not res15 else config34)
+        return None
+    return elector_addr, int(out[0], 0), config15, config34
+
+def watch(t, backend, path_conf, wallets, notify_conf, email_conf, watch_conf, workers=AsyncTonosCli.CONCURRENCY):
+    '''
+    Polls transactions of wallets and confirms new transactions to elector
+    :param t: tonos-cli for chain metadata, may be cached
+    :param backend: tonos-cli without cache for transactions
+    :param wallets: list of (msig_addr, keyfile)
+    :param workers: number of tonos-cli calls made at once
+    '''
+    fast_interval = watch_conf.get('fast_interval', 5)
+    slow_interval = watch_conf.get('slow_interval', 60)
+    metadata_interval = watch_conf.get('metadata_interval', 600)
+    # failed confirmations are tried again on the next poll
+    try_num = watch_conf.get('try_num', 3)
+    metadata = None
+    metadata_time = 0
+    interval = fast_interval
+    count, total, worst = 0, 0.0, 0.0
+    # confirmed transactions stay in the list until other custodians confirm them or they expire
+    done = set()
+    printl('Watching transactions of %s' % ', '.join(w[0] for w in wallets))
+    while True:
+        now = time.time()
+        try:
+            if metadata is None or now >= metadata_time:
+                metadata = fetch_metadata(t)
+                metadata_time = now + (metadata_interval if metadata is not None else fast_interval)
+            if metadata is not None:
+                elector_addr, active_election_id, config15, config34 = metadata
+                interval = scheduler.watch_interval(now, active_election_id, config15, config34, fast_interval, slow_interval)
+                with retry.deadline_scope(retry.run_deadline()):
+                    results = utils.confirm_wallets_to_elector(backend, wallets, path_conf['abi'], try_num, printl,
+                                                               elector_addr, done, workers)
+                confirmed = [(w, i) for w, r in results.items() for i in r[0]]
+                unconfirmed = [(w, i) for w, r in results.items() for i in r[1]]
+                done = set(d for d in done if (transaction_age(d[1], now) or 0) < 7200)
+                done.update(confirmed)
+                for w, i in confirmed:
+                    age = transaction_age(i, time.time())
+                    if age is not None:
+                        count, total, worst = count + 1, total + age, max(worst, age)
+                        printl('Confirmed %s of %s in %.1f s after creation' % (i, w, age))
+                if len(confirmed) > 0 and count > 0:
+                    printl('Time to confirm: avg %.1f s, max %.1f s over %d transactions' % (total / count, worst, count))
+                if len(confirmed) + len(unconfirmed) > 0:
+                    for w, r in results.items():
+                        if len(r[0]) + len(r[1]) > 0:
+                            printl('%s Confirmed: %s Unconfirmed: %s' % (w, str(r[0]), str(r[1])))
+                    notify_results(results, notify_conf, email_conf)
+                    # custodians may submit more transactions soon
+                    interval = fast_interval
+                metrics.run_finished('autoconfirm', len(unconfirmed))
+                metrics.flush()
+            utils.flush_digests(notify_conf, email_conf)
+        except Exception as e:
+            printl('Watch pass failed: %s' % str(e))
+        time.sleep(max(now + interval - time.time(), 0))
 
 if __name__ == '__main__':
     printl('TON Autoconfirm version %s started with args %s' % (VERSION, sys.argv))
 
-    if len(sys.argv) >= 2:
-        config_file = sys.argv[1]
-    else:
-        config_file = 'config.custodian.json'
+    parser = argparse.ArgumentParser(description='Confirmation of multisig transactions to elector')
+    parser.add_argument('config', nargs='?', default='config.custodian.json', help='config file')
+    parser.add_argument('--watch', action='store_true', help='keep running and confirm new transactions within seconds')
+    args = parser.parse_args()
+    config_file = args.config
 
     printl('Using %s' % config_file)
 
@@ -32,21 +153,41 @@ if __name__ == '__main__':
         printl('Cannot parse %s: %s' % (config_file, str(e)))
         exit(1)
 
+    if len(config.get('wallets', [])) > 0:
+        config.setdefault('wallet', {}).setdefault('msig_addr', config['wallets'][0]['msig_addr'])
     path_conf, user_conf, notify_conf, email_conf = utils.check_config(config, True)
     if path_conf is None:
         exit(1)
+    wallets = custodian_wallets(config, user_conf)
+    if any(keyfile is None for msig_addr, keyfile in wallets):
+        printl('Please specify keyfile for every wallet')
+        exit(1)
 
-    t = TonosCli(path_conf['tonos-cli'])
+    backend = backend_from_config(TonosCli(path_conf['tonos-cli']), config.get('backend', {}))
+    t, cache = cached_from_config(backend, config.get('cache', {}), path_conf['election_folder'])
 
-    confirmed, unconfirmed = utils.confirm_transactions_to_elector(t, user_conf['msig_addr'], user_conf['keyfile'], path_conf['abi'], 100, printl)
-    printl('Confirmed: %s Unconfirmed: %s' % (str(confirmed), str(unconfirmed)))
+    retry.configure(config.get('retry', {}))
+    metrics.configure(config.get('metrics', {}), path_conf['election_folder'])
+    workers = config.get('tonos-cli', {}).get('concurrency', AsyncTonosCli.CONCURRENCY)
+    utils.install_dispatcher(dispatcher_from_config(config.get('dispatcher', {}), path_conf['election_folder'],
+                                                    [(notify_conf, email_conf)]))
+    utils.install_dedupe(dedupe_from_config(config.get('dedupe', {}), path_conf['election_folder']))
 
-    if len(confirmed) > 0:
-        msg = 'Confirmed transactions: %s' % confirmed
-        utils.notify_owner(msg, notify_conf, email_conf)
+    if args.watch:
+        metrics.serve()
+        try:
+            watch(t, backend, path_conf, wallets, notify_conf, email_conf, config.get('watch', {}), workers)
+        except KeyboardInterrupt:
+            exit(0)
 
-    if len(unconfirmed) > 0:
-        msg = 'Cannot confirm transactions: %s' % unconfirmed
-        utils.notify_owner(msg, notify_conf, email_conf)
+    with retry.deadline_scope(retry.run_deadline()):
+        results = utils.confirm_wallets_to_elector(t, wallets, path_conf['abi'], 100, printl, workers=workers)
+    for msig_addr, (confirmed, unconfirmed) in results.items():
+        printl('%s Confirmed: %s Unconfirmed: %s' % (msig_addr, str(confirmed), str(unconfirmed)))
 
-    exit(len(unconfirmed))
+    notify_results(results, notify_conf, email_conf)
+    unconfirmed = sum(len(unconfirmed) for confirmed, unconfirmed in results.values())
+    metrics.run_finished('autoconfirm', unconfirmed)
+    metrics.flush()
+    utils.flush_digests(notify_conf, email_conf)
+    exit(unconfirmed)
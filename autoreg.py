@@ -1,75 +1,98 @@
-from tonoscliwrapper import TonosCli
-from vecwrapper import ValidatorEngineConsole
 import base64
 import json
-from fiftwrapper import Fift
 import os
 import utils
+import scheduler
+import retry
+import metrics
+import tracing
+import atexit
 from datetime import datetime
 import time
 import sys
+import argparse
 from version import VERSION
 
 
 def printl(*args):
     print(datetime.fromtimestamp(time.time()).strftime('%Y-%m-%d %H:%M:%S:'), *args, flush=True)
 
-if __name__ == '__main__':
-    printl('TON Autoreg version %s started with args %s' % (VERSION, sys.argv))
 
-    if len(sys.argv) >= 2:
-        config_file = sys.argv[1]
-    else:
-        config_file = 'config.json'
+# timing of the last idle run in election folder
+IDLE_FILE = 'idle.json'
 
-    printl('Using %s' % config_file)
 
+def idle_probe(election_folder, wallet, idle_conf, now):
+    '''
+    Fast path of cron runs: reads timing saved by the last idle run without any chain query
+    :param wallet: wallet address from config, None if it is not set there
+    :return: time until which there is nothing to do or None if a full run is needed
+    '''
+    full_check_interval = idle_conf.get('full_check_interval', 0)
+    if full_check_interval <= 0:
+        return None
     try:
-        with open(config_file, 'r') as f:
-            _config = f.read()
+        with open(os.path.join(election_folder, IDLE_FILE), 'r') as f:
+            idle = json.load(f)
+        if wallet is not None and idle['wallet'] != wallet:
+            return None
+        if now < idle['until'] and now < idle['checked'] + full_check_interval:
+            return idle['until']
     except:
-        printl('Cannot read %s' % config_file)
-        exit(1)
+        pass
+    return None
 
-    try:
-        config = json.loads(_config)
-    except Exception as e:
-        printl('Cannot parse %s: %s' % (config_file, str(e)))
-        exit(1)
-
-    path_conf, user_conf, notify_conf, email_conf = utils.check_config(config)
-    if path_conf is None:
-        exit(1)
-
-    try_num = 100
-
-    t = TonosCli(path_conf['tonos-cli'])
-
-    v = ValidatorEngineConsole(path_conf['validator-engine-console'],
-                               path_conf['client_key'],
-                               path_conf['server_pub_key'],
-                               path_conf['server_url'])
 
-    fift = Fift(path_conf['fift'], path_conf['fift_includes'])
-
-
-    printl('Checking for elector address')
-    elector_addr = utils.get_elector_address(t)
+def save_idle_timing(t, store, wallet, idle_file, printl=printl):
+    '''
+    Saves time of the next elections start or frozen stake return for the fast path of next runs
+    '''
+    now = time.time()
+    res, config15 = t.getconfig(15)
+    if not res:
+        printl(config15)
+        return
+    res, config34 = t.getconfig(34)
+    if not res:
+        printl(config34)
+        return
+    try:
+        until = scheduler.idle_until(now, config15, config34, store.elections(wallet))
+    except:
+        printl('Bad config15 or config34')
+        return
+    if utils.save_atomic(idle_file, json.dumps({'wallet': wallet, 'checked': now, 'until': until})):
+        printl('Nothing to do until %s' % datetime.fromtimestamp(until).strftime('%Y-%m-%d %H:%M:%S'))
+
+
+def register(t, at, v, payloads, store, path_conf, user_conf, notify_conf, email_conf, printl=printl, idle_file=None):
+    '''
+    One pass of reward recovery, registration in elections and custodians notification
+    :param at: AsyncTonosCli for concurrent start of run queries
+    :param printl: log function
+    :param idle_file: file to save timing of idle run to, None doesn't save it
+    :return: exit code
+    '''
+
+    tracing.phase('run_state')
+    printl('Checking for elector address, unconfirmed transactions, reward and active election')
+    state = utils.fetch_run_state(at, user_conf['msig_addr'], path_conf['abi'])
+    elector_addr = state['elector_addr']
     if elector_addr is None:
         printl('Cannot get elector address')
-        exit(1)
+        return 1
     else:
         printl('Got %s' % elector_addr)
 
+    tracing.phase('pending_transactions')
     # check for unconfirmed transactions
-    printl('Checking for unconfirmed transactions')
-    transactions = utils.get_awaiting_transactions(t, user_conf['msig_addr'], elector_addr, path_conf['abi'])
+    transactions = state['transactions']
     if transactions is None:
         printl('Cannot get transaction list for %s' % user_conf['msig_addr'])
-        exit(1)
+        return 1
     if len(transactions) > 0:
         printl('There are unconfirmed transactions from %s to elector: %s' % (user_conf['msig_addr'], str(transactions)))
-        exit(0)
+        return 0
     else:
         printl('No unconfirmed transactions')
 
@@ -77,18 +100,18 @@ if __name__ == '__main__':
     msig_addr_hex = '0x' + user_conf['msig_addr'][3:]
     msig_addr_int = int(msig_addr_hex, 0)
 
+    tracing.phase('reward_check')
     # some reward?
-    printl('Checking for reward')
-    res, out = t.runget(elector_addr, 'compute_returned_stake', msig_addr_hex)
+    res, out = state['returned_stake']
     if not res:
         printl(out)
         printl('Cannot get returned stake for %s' % msig_addr_hex)
-        exit(1)
+        return 1
     try:
         returned_stake = int(out[0], 0)
     except:
         printl('Bad compute_returned_stake answer')
-        exit(1)
+        return 1
 
     if returned_stake > 0:
         printl('Found stake to return: %d' % returned_stake)
@@ -99,398 +122,684 @@ if __name__ == '__main__':
         if not res:
             printl(out)
             printl('Cannot get account state for %s' % user_conf['msig_addr'])
-            exit(1)
+            return 1
         if not out['active']:
             printl('Wallet not active')
-            exit(0)
+            return 0
         if out['balance'] <= 1000000000:  # 1 ton, but fees???
             printl('Not enough tokens to take reward. Have %d, min needed %d' % (out['balance'], 1000000000))
 
             msg = 'Not enough tokens to take reward. Have %d, min needed %d' % (out['balance'], 1000000000)
-            utils.notify_owner(msg, notify_conf, email_conf)
+            utils.notify_owner(msg, notify_conf, email_conf, ('low_balance_reward', user_conf['msig_addr'], None))
 
-            exit(0)
+            return 0
 
+        tracing.phase('reward_request')
         printl('Requesting for reward')
-        trans_id = utils.request_reward(t, fift, path_conf['recover-stake'], user_conf['msig_addr'], elector_addr, path_conf['abi'], user_conf['keyfile'])
+        trans_id = utils.request_reward(t, payloads, user_conf['msig_addr'], elector_addr, path_conf['abi'], user_conf['keyfile'])
         if trans_id is None:
             printl('Cannot send request for reward for %s' % user_conf['msig_addr'])
-            exit(1)
+            return 1
         # check for unconfirmed transactions
         printl('Checking for unconfirmed transactions')
         transactions = utils.get_awaiting_transactions(t, user_conf['msig_addr'], elector_addr, path_conf['abi'])
         if transactions is None:
             printl('Cannot get transaction list for %s' % user_conf['msig_addr'])
-            exit(1)
+            return 1
         if len(transactions) > 0:
             printl('There are unconfirmed transactions from %s to elector: %s' % (user_conf['msig_addr'], str(transactions)))
 
+            tracing.phase('custodians_notify')
             # есть неподтверждённые транзакции, уведомим кастодианов
             custodians = utils.get_custodians(t, user_conf['msig_addr'], path_conf['abi'])
             if custodians is None:
                 printl('Cannot get custodians for %s' % user_conf['msig_addr'])
-                exit(1)
+                return 1
 
             msg = 'Need your confirmation for transactions: %s' % str(transactions)
 
-            utils.notify_custodians(custodians, msg, notify_conf, email_conf)
+            utils.notify_custodians(custodians, msg, notify_conf, email_conf, ('confirmation_needed', user_conf['msig_addr'], None, transactions))
 
             printl('Custodians notified for transactions: %s' % str(transactions))
-            exit(0)
+            return 0
     else:
         printl('No reward')
 
 
-    printl('Checking for active election')
-    res, out = t.runget(elector_addr, 'active_election_id')
+    tracing.phase('election_state')
+    res, out = state['active_election_id']
     if not res:
         printl(out)
         printl('Cannot get active election id')
-        exit(1)
+        return 1
     try:
         active_election_id = int(out[0], 0)
     except:
         printl('Bad active election id')
-        exit(1)
-
-    if active_election_id != 0:
-        printl('Current election %d' % active_election_id)
-
-    if active_election_id != 0:
-        election_file = path_conf['election_folder'] + '/' + str(active_election_id) + '.json'
+        return 1
 
-        try:
-            with open(election_file, 'r') as f:
-                election_obj = json.load(f)
-        except:
-            election_obj = None
-
-        if election_obj is None:
-            printl('No saved election info')
+    if active_election_id == 0:
+        # no elections
+        printl('No current elections')
+        if idle_file is not None and returned_stake == 0:
+            tracing.phase('idle_timing')
+            save_idle_timing(t, store, user_conf['msig_addr'], idle_file, printl)
+        return 0
+
+    printl('Current election %d' % active_election_id)
+    return Registration(t, v, payloads, store, path_conf, user_conf, notify_conf, email_conf, elector_addr, active_election_id, printl).run()
+
+
+class Registration:
+    '''
+    Registration in elections as a sequence of steps, every step saves its checkpoint as election state.
+    A run resumes after the last saved checkpoint and verifies it with one probe instead of repeating the sequence
+    '''
+    # checkpoint -> next step
+    STEPS = {
+        'keys_generated': 'configure_node',
+        'node_configured': 'build_payload',
+        'payload_built': 'submit',
+        'transaction_submitted': 'notify_custodians',
+    }
+    # states saved by previous versions
+    LEGACY_STATES = {'created': 'keys_generated', 'unconfirmed': 'transaction_submitted'}
+
+    def __init__(self, t, v, payloads, store, path_conf, user_conf, notify_conf, email_conf, elector_addr, election_id, printl=printl):
+        self.t = t
+        self.v = v
+        self.payloads = payloads
+        self.store = store
+        self.path_conf = path_conf
+        self.user_conf = user_conf
+        self.notify_conf = notify_conf
+        self.email_conf = email_conf
+        self.elector_addr = elector_addr
+        self.election_id = election_id
+        self.printl = printl
+        self.wallet = user_conf['msig_addr']
+        self.election_file = store.location(self.wallet, election_id)
+        self.election_obj = None
+
+    def run(self):
+        '''
+        :return: exit code
+        '''
+        self.election_obj = self.store.get(self.wallet, self.election_id)
+        if self.election_obj is None:
+            self.printl('No saved election info')
+            res = self.generate_keys()
+            if res is not None:
+                return res
         else:
-            printl('Loaded saved election info from %s' % election_file)
-
-        if election_obj is None:
-            # Election parameters
-            printl('Get config15')
-            res, out = t.getconfig(15)
-            if not res:
-                printl(out)
-                printl('Cannot get config15')
-                exit(1)
-
-            # {'elections_end_before': 8192, 'elections_start_before': 32768, 'stake_held_for': 32768, 'validators_elected_for': 65536}
-            try:
-                elections_start_tm = active_election_id - out['elections_start_before']
-                elections_end_tm = active_election_id - out['elections_end_before']
-                validator_since_tm = active_election_id
-                validator_until_tm = active_election_id + out['validators_elected_for']
-                stake_held_for_tm = validator_until_tm + out['stake_held_for']
-                expire = stake_held_for_tm + 1000
-            except:
-                printl('Bad config15')
-                exit(1)
-
-            # Validator stake parameters
-            printl('Get config17')
-            res, out = t.getconfig(17)
+            self.printl('Loaded saved election info from %s' % self.election_file)
+            state = self.LEGACY_STATES.get(self.election_obj['state'], self.election_obj['state'])
+            self.election_obj['state'] = state
+            if state == 'confirmed':
+                self.printl('Already registered in election %d' % self.election_id)
+                return 0
+            self.printl('Resuming registration after %s' % state)
+            tracing.annotate(resumed_from=state)
+            res = self.verify(state)
+            if res is not None:
+                return res
+
+        while True:
+            state = self.election_obj['state']
+            if state not in self.STEPS:
+                self.printl('Unknown election state %s in %s' % (state, self.election_file))
+                return 1
+            res = getattr(self, self.STEPS[state])()
+            if res is not None:
+                return res
+
+    def checkpoint(self, state, **changes):
+        '''
+        Saves completed step
+        :return: success
+        '''
+        if not self.store.transition(self.wallet, self.election_id, state, **changes):
+            self.printl('Cannot save %s' % self.election_file)
+            return False
+        self.election_obj.update(changes)
+        self.election_obj['state'] = state
+        return True
+
+    def verify(self, state):
+        '''
+        One probe of the saved checkpoint: node config for generated keys,
+        participant list for built payload and sent transaction
+        :return: exit code or None to continue
+        '''
+        if state == 'keys_generated':
+            tracing.phase('node_configuration')
+            res, config = self.v.getconfig()
             if not res:
-                printl(out)
-                printl('Cannot get config17')
-                exit(1)
-
-            try:
-                # {'max_stake': '10000000000000000', 'max_stake_factor': 196608, 'min_stake': '10000000000000', 'min_total_stake': '100000000000000'}
-                max_stake = int(out['max_stake'])
-                min_stake = int(out['min_stake'])
-                max_stake_factor = int(out['max_stake_factor']) / 65536.0
-            except:
-                printl('Bad config17')
-                exit(1)
-
-            min_stake += 1000000000
-
-            # check for wallet balance
-            printl('Checking for balance on %s' % user_conf['msig_addr'])
-            res, out = t.account(user_conf['msig_addr'])
-            if not res:
-                printl(out)
-                printl('Cannot get account state for %s' % user_conf['msig_addr'])
-                exit(1)
-            if not out['active']:
-                printl('Wallet not active')
-                exit(0)
-            if out['balance'] <= min_stake + 1000000000: # min stake + fees
-                printl('Not enough tokens for elections. Have %d, min needed %d' % (out['balance'], min_stake + 1000000000))
-
-                msg = 'Not enough tokens for elections. Have %d, min needed %d' % (out['balance'], min_stake + 1000000000)
-                utils.notify_owner(msg, notify_conf, email_conf)
-
-                exit(0)
-            our_balance = out['balance']
-            printl('Our balance is %d' % our_balance)
-
-            # stack and factor checks
-            our_stake_factor = min(max_stake_factor, user_conf['stake_factor'])
-            our_stake_factor = max(our_stake_factor, 1)
-
-            if user_conf['stake_value'] == 'all':
-                our_stake_value = our_balance - 1000000000 # 1 ton for fees
-            elif user_conf['stake_value'] == 'min':
-                our_stake_value = min_stake
-            else:
-                our_stake_value = user_conf['stake_value']
-
-            # ограничиваем сверху максимальной ставкой и нашим балансом
-            our_stake_value = min(max_stake, our_stake_value)
-            our_stake_value = min(our_balance - 1000000000, our_stake_value)
-            # ограничиваем снизу минимальной ставкой
-            our_stake_value = max(min_stake, our_stake_value)
-
-            printl('Election stake %d' % our_stake_value)
-
-            res, config = v.getconfig()
-            if not res:
-                printl(config)
-                printl('Cannot get validator node config')
-                exit(1)
-
-            # check if keys for election already installed and delete them
+                self.printl(config)
+                self.printl('Cannot get validator node config')
+                return 1
             try:
                 for el in config['validators']:
-                    if el['election_date'] == active_election_id:
-                        # deleting keys
-                        for i in el['adnl_addrs']:
-                            v.delvalidatoraddr(base64.b64decode(el['id']).hex(), base64.b64decode(i['id']).hex())
-                        for i in el['temp_keys']:
-                            v.deltempkey(base64.b64decode(el['id']).hex(), base64.b64decode(i['key']).hex())
-                        v.delpermkey(base64.b64decode(el['id']).hex())
+                    if el['election_date'] == self.election_id and base64.b64decode(el['id']).hex().upper() == self.election_obj['private_key']:
+                        self.printl('Validator keys already configured')
+                        return None if self.checkpoint('node_configured') else 1
             except:
                 pass
+            return None
+        if state == 'node_configured':
+            return None
+        # payload_built, transaction_submitted, custodians_notified
+        stake = self.check_participant_list()
+        if stake is None:
+            return 1
+        if stake > 0:
+            return self.confirm(stake)
+        if state == 'payload_built':
+            return None
+        # no pending transactions were found before, so the sent one has expired or was rejected
+        self.printl('Transactions %s are neither pending nor registered, sending again' % str(self.election_obj['transIds']))
+        return None if self.checkpoint('payload_built') else 1
+
+    def generate_keys(self):
+        '''
+        Calculates stake and makes validator keys of the election
+        :return: exit code or None to continue
+        '''
+        t = self.t
+        v = self.v
+        user_conf = self.user_conf
+        active_election_id = self.election_id
+
+        # Election parameters
+        tracing.phase('config_fetch')
+        self.printl('Get config15')
+        res, out = t.getconfig(15)
+        if not res:
+            self.printl(out)
+            self.printl('Cannot get config15')
+            return 1
 
-            res, private_key = v.newkey()
-            if not res:
-                printl(private_key)
-                printl('Cannot generate key')
-                exit(1)
-            res, public_key = v.exportpub(private_key)
-            if not res:
-                printl(public_key)
-                printl('Cannot export pubkey')
-                exit(1)
-            res, adnl_key = v.newkey()
-            if not res:
-                printl(adnl_key)
-                printl('Cannot generate key')
-                exit(1)
+        # {'elections_end_before': 8192, 'elections_start_before': 32768, 'stake_held_for': 32768, 'validators_elected_for': 65536}
+        try:
+            elections_start_tm = active_election_id - out['elections_start_before']
+            elections_end_tm = active_election_id - out['elections_end_before']
+            validator_since_tm = active_election_id
+            validator_until_tm = active_election_id + out['validators_elected_for']
+            stake_held_for_tm = validator_until_tm + out['stake_held_for']
+            expire = stake_held_for_tm + 1000
+        except:
+            self.printl('Bad config15')
+            return 1
 
-            fn = fift.get_tempfile_name('validator-to-sign.bin')
-            res, out = fift.run(path_conf['validator-elect-req'], user_conf['msig_addr'], str(active_election_id), str(our_stake_factor), adnl_key, fn)
-            if not res:
-                printl(out)
-                printl('Cannot generate transaction')
-                exit(1)
-            try:
-                with open(fn, 'rb') as f:
-                    validator_request = f.read().hex().upper()
-                os.remove(fn)
-            except:
-                printl('Cannot generate transaction')
-                exit(1)
+        # Validator stake parameters
+        self.printl('Get config17')
+        res, out = t.getconfig(17)
+        if not res:
+            self.printl(out)
+            self.printl('Cannot get config17')
+            return 1
 
-            res, sign = v.sign(private_key, validator_request)
-            if not res:
-                printl(sign)
-                printl('Cannot sign transaction')
-                exit(1)
+        try:
+            # {'max_stake': '10000000000000000', 'max_stake_factor': 196608, 'min_stake': '10000000000000', 'min_total_stake': '100000000000000'}
+            max_stake = int(out['max_stake'])
+            min_stake = int(out['min_stake'])
+            max_stake_factor = int(out['max_stake_factor']) / 65536.0
+        except:
+            self.printl('Bad config17')
+            return 1
+        config17 = out
 
-            fn = fift.get_tempfile_name('validator-query.boc')
-            res, out = fift.run(path_conf['validator-elect-signed'], user_conf['msig_addr'], str(active_election_id), str(our_stake_factor), adnl_key, public_key,  sign, fn)
-            if not res:
-                printl(out)
-                printl('Cannot generate query')
-                exit(1)
-            try:
-                with open(fn, 'rb') as f:
-                    validator_query = f.read()
-                os.remove(fn)
-            except:
-                printl('Cannot generate query')
-                exit(1)
-
-            election_obj = {
-                'election_id': active_election_id,
-                'state': 'created',
-                'elections_start': datetime.utcfromtimestamp(elections_start_tm).strftime('%Y-%m-%d %H:%M:%S UTC'),
-                'elections_start_tm': elections_start_tm,
-                'elections_end': datetime.utcfromtimestamp(elections_end_tm).strftime('%Y-%m-%d %H:%M:%S UTC'),
-                'elections_end_tm': elections_end_tm,
-                'validator_since': datetime.utcfromtimestamp(validator_since_tm).strftime('%Y-%m-%d %H:%M:%S UTC'),
-                'validator_since_tm': validator_since_tm,
-                'validator_until': datetime.utcfromtimestamp(validator_until_tm).strftime('%Y-%m-%d %H:%M:%S UTC'),
-                'validator_until_tm': validator_until_tm,
-                'stake_held_for': datetime.utcfromtimestamp(stake_held_for_tm).strftime('%Y-%m-%d %H:%M:%S UTC'),
-                'stake_held_for_tm': stake_held_for_tm,
-                'expire': expire,
-                'max_stake': max_stake,
-                'min_stake': min_stake,
-                'max_stake_factor': max_stake_factor,
-                'our_stake_value': our_stake_value,
-                'our_stake_factor': our_stake_factor,
-                'elector_addr': elector_addr,
-                'private_key': private_key,
-                'public_key': public_key,
-                'public_key_hex': base64.b64decode(public_key).hex().upper()[8:],
-                'adnl_key': adnl_key,
-                'validator_query_hex': validator_query.hex().upper(),
-                'validator_query_base64': base64.b64encode(validator_query).decode("utf-8"),
-                'transIds': []
-            }
-            res = utils.save_atomic(election_file, json.dumps(election_obj, indent=4))
-            if not res:
-                printl('Cannot save %s' % election_file)
-                exit(1)
+        min_stake += 1000000000
+
+        tracing.phase('balance_check')
+        # check for wallet balance
+        self.printl('Checking for balance on %s' % user_conf['msig_addr'])
+        res, out = t.account(user_conf['msig_addr'])
+        if not res:
+            self.printl(out)
+            self.printl('Cannot get account state for %s' % user_conf['msig_addr'])
+            return 1
+        if not out['active']:
+            self.printl('Wallet not active')
+            return 0
+        if out['balance'] <= min_stake + 1000000000: # min stake + fees
+            self.printl('Not enough tokens for elections. Have %d, min needed %d' % (out['balance'], min_stake + 1000000000))
+
+            msg = 'Not enough tokens for elections. Have %d, min needed %d' % (out['balance'], min_stake + 1000000000)
+            utils.notify_owner(msg, self.notify_conf, self.email_conf, ('low_balance_elections', user_conf['msig_addr'], active_election_id))
+            metrics.registration(user_conf['msig_addr'], 'low_balance')
+
+            return 0
+        our_balance = out['balance']
+        self.printl('Our balance is %d' % our_balance)
+
+        # stack and factor checks
+        our_stake_factor = min(max_stake_factor, user_conf['stake_factor'])
+        our_stake_factor = max(our_stake_factor, 1)
+
+        if user_conf['stake_value'] == 'optimal':
+            tracing.phase('stake_planning')
+            plan = self.plan_stake(config17, min_stake, our_balance - 1000000000, our_stake_factor)
+            if plan is not None:
+                our_stake_value = plan['stake']
+                our_stake_factor = plan['factor']
             else:
-                printl('Saved election info to %s' % election_file)
+                our_stake_value = our_balance - 1000000000
+        elif user_conf['stake_value'] == 'all':
+            our_stake_value = our_balance - 1000000000 # 1 ton for fees
+        elif user_conf['stake_value'] == 'min':
+            our_stake_value = min_stake
+        else:
+            our_stake_value = user_conf['stake_value']
 
-        if election_obj['state'] == 'confirmed':
-            printl('Already registered in election %d' % active_election_id)
-            exit(0)
+        # ограничиваем сверху максимальной ставкой и нашим балансом
+        our_stake_value = min(max_stake, our_stake_value)
+        our_stake_value = min(our_balance - 1000000000, our_stake_value)
+        # ограничиваем снизу минимальной ставкой
+        our_stake_value = max(min_stake, our_stake_value)
 
-        # проверим, сконфигурирована ли нода на эти выборы
+        self.printl('Election stake %d' % our_stake_value)
 
-        # Get validator keys
+        tracing.phase('key_generation')
         res, config = v.getconfig()
         if not res:
-            printl(config)
-            printl('Cannot get validator node config')
-            exit(1)
+            self.printl(config)
+            self.printl('Cannot get validator node config')
+            return 1
 
-        # search for key
-        validator_configured = False
+        # check if keys for election already installed and delete them
         try:
             for el in config['validators']:
-                if el['election_date'] == active_election_id and base64.b64decode(el['id']).hex().upper() == election_obj['private_key']:
-                    validator_configured = True
-                    break
+                if el['election_date'] == active_election_id:
+                    # deleting keys
+                    v.delete_validator(base64.b64decode(el['id']).hex(),
+                                       [base64.b64decode(i['key']).hex() for i in el['temp_keys']],
+                                       [base64.b64decode(i['id']).hex() for i in el['adnl_addrs']])
         except:
             pass
 
-        if not validator_configured:
-            # Configuring node from zero
-            res = v.addpermkey(election_obj['private_key'], election_obj['election_id'], election_obj['expire'])
-            if not res:
-                printl('Cannot addpermkey')
-                exit(1)
-            res = v.addtempkey(election_obj['private_key'], election_obj['private_key'], election_obj['expire'])
-            if not res:
-                printl('Cannot addtempkey')
-                exit(1)
-            res = v.addadnl(election_obj['adnl_key'])
-            if not res:
-                printl('Cannot addadnl')
-                exit(1)
-            res = v.addvalidatoraddr(election_obj['private_key'], election_obj['adnl_key'], election_obj['expire'])
-            if not res:
-                printl('Cannot addvalidatoraddr')
-                exit(1)
+        res, private_key = v.newkey()
+        if not res:
+            self.printl(private_key)
+            self.printl('Cannot generate key')
+            return 1
+        res, public_key = v.exportpub(private_key)
+        if not res:
+            self.printl(public_key)
+            self.printl('Cannot export pubkey')
+            return 1
+        res, adnl_key = v.newkey()
+        if not res:
+            self.printl(adnl_key)
+            self.printl('Cannot generate key')
+            return 1
+
+        self.election_obj = {
+            'election_id': active_election_id,
+            'state': 'keys_generated',
+            'elections_start': datetime.utcfromtimestamp(elections_start_tm).strftime('%Y-%m-%d %H:%M:%S UTC'),
+            'elections_start_tm': elections_start_tm,
+            'elections_end': datetime.utcfromtimestamp(elections_end_tm).strftime('%Y-%m-%d %H:%M:%S UTC'),
+            'elections_end_tm': elections_end_tm,
+            'validator_since': datetime.utcfromtimestamp(validator_since_tm).strftime('%Y-%m-%d %H:%M:%S UTC'),
+            'validator_since_tm': validator_since_tm,
+            'validator_until': datetime.utcfromtimestamp(validator_until_tm).strftime('%Y-%m-%d %H:%M:%S UTC'),
+            'validator_until_tm': validator_until_tm,
+            'stake_held_for': datetime.utcfromtimestamp(stake_held_for_tm).strftime('%Y-%m-%d %H:%M:%S UTC'),
+            'stake_held_for_tm': stake_held_for_tm,
+            'expire': expire,
+            'max_stake': max_stake,
+            'min_stake': min_stake,
+            'max_stake_factor': max_stake_factor,
+            'our_stake_value': our_stake_value,
+            'our_stake_factor': our_stake_factor,
+            'elector_addr': self.elector_addr,
+            'private_key': private_key,
+            'public_key': public_key,
+            'public_key_hex': base64.b64decode(public_key).hex().upper()[8:],
+            'adnl_key': adnl_key,
+            'transIds': []
+        }
+        res = self.store.create(user_conf['msig_addr'], self.election_obj)
+        if not res:
+            self.printl('Cannot save %s' % self.election_file)
+            return 1
+        else:
+            self.printl('Saved election info to %s' % self.election_file)
+        return None
+
+    def plan_stake(self, config17, min_stake, max_stake, max_factor):
+        '''
+        Stake and factor of the largest effective stake against current participants of elections, see stakeplanner
+        :param max_stake: stake limit by our balance
+        :return: plan or None to stake as "all"
+        '''
+        try:
+            import stakeplanner
+            import participants
+        except ImportError as e:
+            self.printl('Cannot plan stake: %s' % str(e))
+            return None
+
+        self.printl('Get config16')
+        res, config16 = self.t.getconfig(16)
+        if not res:
+            self.printl(config16)
+            self.printl('Cannot get config16')
+            return None
 
-        # сначала посмотрим, есть ли мы в списке участников
-        validator_public_key_int = int(election_obj['public_key_hex'], 16)
+        res, out = self.t.runget_raw(self.elector_addr, 'participant_list_extended')
+        if not res:
+            self.printl(out)
+            self.printl('Cannot get participant list')
+            return None
 
-        printl('Checking our public key %s in participant list' % (election_obj['public_key_hex']))
-        stake = utils.check_participant_list(t, election_obj['elector_addr'], validator_public_key_int)
-        if stake is None:
-            printl('Cannot get participant list')
-            exit(1)
-        if stake > 0:
-            printl('Found our public key %s in participant list with stake = %d' % (election_obj['public_key_hex'], stake))
+        try:
+            others = participants.extended_participants(participants.loads_lists(out))
+            planner = stakeplanner.StakePlanner(list(others.values()), config16, config17)
+            plan = planner.plan(min_stake, max_stake, max_factor)
+        except Exception as e:
+            self.printl('Cannot plan stake: %s' % str(e))
+            return None
+        if plan is None:
+            self.printl('No stake up to %d is elected with %d current participants' % (max_stake, len(others)))
+            return None
+
+        self.printl('Planned stake %d with factor %.2f: effective stake %d, %d validators, min elected stake %d' %
+                    (plan['stake'], plan['factor'], plan['effective'], plan['validators'], plan['min_elected']))
+        return plan
+
+    def configure_node(self):
+        tracing.phase('node_configuration')
+        election_obj = self.election_obj
+        res = self.v.configure_validator(election_obj['private_key'], election_obj['adnl_key'], election_obj['election_id'], election_obj['expire'])
+        if not res:
+            self.printl('Cannot configure validator keys')
+            return 1
+        return None if self.checkpoint('node_configured') else 1
+
+    def build_payload(self):
+        election_obj = self.election_obj
+        if 'validator_query_base64' in election_obj:
+            # made by previous versions together with keys
+            return None if self.checkpoint('payload_built') else 1
+
+        tracing.phase('payload_build', payload='election_request')
+        res, validator_request = self.payloads.election_request(self.wallet, self.election_id, election_obj['our_stake_factor'], election_obj['adnl_key'])
+        if not res:
+            self.printl(validator_request)
+            self.printl('Cannot generate transaction')
+            return 1
 
-            election_obj['state'] = 'confirmed'
-            res = utils.save_atomic(election_file, json.dumps(election_obj, indent=4))
-            if not res:
-                printl('Cannot save %s' % election_file)
-                exit(1)
+        tracing.phase('signing')
+        res, sign = self.v.sign(election_obj['private_key'], validator_request)
+        if not res:
+            self.printl(sign)
+            self.printl('Cannot sign transaction')
+            return 1
 
-            msg = 'Successfully registered in elections %d with stake %d' % (election_obj['election_id'], election_obj['our_stake_value']/1000000000)
-            utils.notify_owner(msg, notify_conf, email_conf)
+        tracing.phase('payload_build', payload='election_query')
+        res, validator_query = self.payloads.election_query(self.wallet, self.election_id, election_obj['our_stake_factor'], election_obj['adnl_key'], election_obj['public_key'], sign)
+        if not res:
+            self.printl(validator_query)
+            self.printl('Cannot generate query')
+            return 1
 
-            exit(0)
-        else:
-            printl('Not found our public key %s in participant list' % (election_obj['public_key_hex']))
+        return None if self.checkpoint('payload_built', validator_query_base64=base64.b64encode(validator_query).decode("utf-8")) else 1
+
+    def submit(self):
+        tracing.phase('transfer')
+        election_obj = self.election_obj
+        user_conf = self.user_conf
+        try_num = 100
 
         # сформируем транзакцию к контракту электора!
-        sended = False
-        for i in range(try_num):
-            printl('TRY %d Sending transaction from %s to %s with stake %d and payload %s' % (i+1, user_conf['msig_addr'], election_obj['elector_addr'], election_obj['our_stake_value'], election_obj['validator_query_base64']))
-            res, out = t.transfer(user_conf['msig_addr'], election_obj['elector_addr'], election_obj['our_stake_value'], False, False, election_obj['validator_query_base64'], path_conf['abi'], user_conf['keyfile'])
+        def send(n):
+            self.printl('TRY %d Sending transaction from %s to %s with stake %d and payload %s' % (n+1, user_conf['msig_addr'], election_obj['elector_addr'], election_obj['our_stake_value'], election_obj['validator_query_base64']))
+            with tracing.span('transfer_attempt', attempt=n+1):
+                res, out = self.t.transfer(user_conf['msig_addr'], election_obj['elector_addr'], election_obj['our_stake_value'], False, False, election_obj['validator_query_base64'], self.path_conf['abi'], user_conf['keyfile'])
             if not res or 'transId' not in out:
-                printl('Failed')
-                continue
+                self.printl('Failed')
+                self.printl(out)
             else:
-                sended = True
-                printl('Sended')
-                break
+                self.printl('Sended')
+            return res, out
 
+        sended, out = retry.policy(try_num).run(send, lambda res, out: res and 'transId' in out, self.printl)
         if not sended:
             msg = 'Cannot send transaction for elections participation'
-            utils.notify_owner(msg, notify_conf, email_conf)
-            exit(1)
+            utils.notify_owner(msg, self.notify_conf, self.email_conf, ('send_failed', self.wallet, self.election_id))
+            metrics.registration(self.wallet, 'send_failed')
+            return 1
 
-        election_obj['transIds'].append(out['transId'])
-        election_obj['state'] = 'unconfirmed'
-        res = utils.save_atomic(election_file, json.dumps(election_obj, indent=4))
-        if not res:
-            printl('Cannot save %s' % election_file)
-            exit(1)
+        metrics.registration(self.wallet, 'submitted')
+        return None if self.checkpoint('transaction_submitted', transIds=election_obj['transIds'] + [out['transId']]) else 1
 
+    def notify_custodians(self):
+        tracing.phase('pending_transactions')
+        user_conf = self.user_conf
         # проверим, есть ли транзакции к электору в ожидании подтверждения
-        printl('Checking for unconfirmed transactions')
-        transactions = utils.get_awaiting_transactions(t, user_conf['msig_addr'], election_obj['elector_addr'], path_conf['abi'])
+        self.printl('Checking for unconfirmed transactions')
+        transactions = utils.get_awaiting_transactions(self.t, user_conf['msig_addr'], self.election_obj['elector_addr'], self.path_conf['abi'])
         if transactions is None:
-            printl('Cannot get transaction list for %s' % user_conf['msig_addr'])
-            exit(1)
+            self.printl('Cannot get transaction list for %s' % user_conf['msig_addr'])
+            return 1
 
-        if len(transactions) > 0:
-            printl('There are unconfirmed transactions from %s to elector: %s' % (user_conf['msig_addr'], str(transactions)))
+        if len(transactions) == 0:
+            # транзакция уже прошла, проверим, попали ли мы в списки участников
+            stake = self.check_participant_list()
+            if stake is None:
+                return 1
+            if stake > 0:
+                return self.confirm(stake)
+            return 1
 
-            # да, есть неподтверждённые транзакции, уведомим кастодианов
-            custodians = utils.get_custodians(t, user_conf['msig_addr'], path_conf['abi'])
-            if custodians is None:
-                printl('Cannot get custodians for %s' % user_conf['msig_addr'])
-                exit(1)
+        self.printl('There are unconfirmed transactions from %s to elector: %s' % (user_conf['msig_addr'], str(transactions)))
 
-            msg = 'Need your confirmation for transactions: %s' % str(transactions)
+        tracing.phase('custodians_notify')
+        # да, есть неподтверждённые транзакции, уведомим кастодианов
+        custodians = utils.get_custodians(self.t, user_conf['msig_addr'], self.path_conf['abi'])
+        if custodians is None:
+            self.printl('Cannot get custodians for %s' % user_conf['msig_addr'])
+            return 1
 
-            utils.notify_custodians(custodians, msg, notify_conf, email_conf)
+        msg = 'Need your confirmation for transactions: %s' % str(transactions)
 
-            printl('Custodians notified for transactions: %s' % str(transactions))
-            exit(0)
+        utils.notify_custodians(custodians, msg, self.notify_conf, self.email_conf, ('confirmation_needed', user_conf['msig_addr'], self.election_id, transactions))
+
+        self.printl('Custodians notified for transactions: %s' % str(transactions))
+        return 0 if self.checkpoint('custodians_notified') else 1
+
+    def check_participant_list(self):
+        '''
+        :return: our stake in participant list, 0 if not found, None on error
+        '''
+        tracing.phase('participant_check')
+        election_obj = self.election_obj
+        self.printl('Checking our public key %s in participant list' % (election_obj['public_key_hex']))
+        stake = utils.check_participant_list(self.t, election_obj['elector_addr'], int(election_obj['public_key_hex'], 16), election_obj['election_id'], self.path_conf['election_folder'])
+        if stake is None:
+            self.printl('Cannot get participant list')
+        elif stake > 0:
+            self.printl('Found our public key %s in participant list with stake = %d' % (election_obj['public_key_hex'], stake))
         else:
-            # транзакция уже прошла, проверим, попали ли мы в списки участников
-            printl('Checking our public key %s in participant list' % (election_obj['public_key_hex']))
-            stake = utils.check_participant_list(t, election_obj['elector_addr'], validator_public_key_int)
-            if stake is None:
-                printl('Cannot get participant list')
-                exit(1)
-            if stake > 0:
-                printl('Found our public key %s in participant list with stake = %d' % (election_obj['public_key_hex'], stake))
+            self.printl('Not found our public key %s in participant list' % (election_obj['public_key_hex']))
+        return stake
 
-                election_obj['state'] = 'confirmed'
-                res = utils.save_atomic(election_file, json.dumps(election_obj, indent=4))
-                if not res:
-                    printl('Cannot save %s' % election_file)
-                    exit(1)
+    def confirm(self, stake):
+        if not self.checkpoint('confirmed'):
+            return 1
 
-                msg = 'Successfully registered in elections %d with stake %d' % (election_obj['election_id'], election_obj['our_stake_value']/1000000000)
-                utils.notify_owner(msg, notify_conf, email_conf)
+        msg = 'Successfully registered in elections %d with stake %d' % (self.election_id, self.election_obj['our_stake_value']/1000000000)
+        utils.notify_owner(msg, self.notify_conf, self.email_conf, ('registered', self.wallet, self.election_id))
+        metrics.registration(self.wallet, 'registered', self.election_obj)
 
-                exit(0)
-            else:
-                printl('Not found our public key %s in participant list' % (election_obj['public_key_hex']))
-                exit(1)
+        return 0
 
-    else:
-        # no elections
-        printl('No current elections')
-        exit(0)
+
+def wait_next_event(t, timers, store, wallet, daemon_conf):
+    '''
+    Plans next wake ups from elections timing and sleeps until the earliest one
+    '''
+    now = time.time()
+    poll_interval = daemon_conf.get('poll_interval', 30)
+    idle_interval = daemon_conf.get('idle_interval', 3600)
+    timers.clear()
+    timers.push(now + poll_interval, 'retry')
+    try:
+        elector_addr = utils.get_elector_address(t)
+        if elector_addr is None:
+            raise ValueError('no elector address')
+        res, out = t.runget(elector_addr, 'active_election_id')
+        if not res:
+            raise ValueError('no active election id')
+        active_election_id = int(out[0], 0)
+        res, config15 = t.getconfig(15)
+        if not res:
+            raise ValueError('no config15')
+        res, config34 = t.getconfig(34)
+        if not res:
+            raise ValueError('no config34')
+
+        registered = False
+        if active_election_id != 0:
+            election_obj = store.get(wallet, active_election_id)
+            registered = election_obj is not None and election_obj['state'] == 'confirmed'
+
+        timers.clear()
+        for when, name in scheduler.plan_wakeups(now, active_election_id, config15, config34, registered, poll_interval, idle_interval):
+            timers.push(when, name)
+        for when, name in scheduler.plan_stake_recovery(now, store.elections(wallet), poll_interval):
+            timers.push(when, name)
+    except Exception as e:
+        printl('Cannot plan next wake up: %s' % str(e))
+
+    printl('Sleeping until %s' % datetime.fromtimestamp(timers.next_time()).strftime('%Y-%m-%d %H:%M:%S'))
+    when, names = timers.pop()
+    printl('Woke up for %s' % ', '.join(names))
+
+
+def run_daemon(t, at, v, payloads, store, path_conf, user_conf, notify_conf, email_conf, daemon_conf, cache=None):
+    timers = scheduler.TimerHeap()
+    while True:
+        try:
+            with retry.deadline_scope(retry.run_deadline()), tracing.span('register', wallet=user_conf['msig_addr']):
+                res = register(t, at, v, payloads, store, path_conf, user_conf, notify_conf, email_conf)
+                tracing.annotate(exit_code=res)
+            printl('Registration pass finished with code %d' % res)
+            metrics.run_finished('autoreg', res)
+            metrics.flush()
+            tracing.flush()
+            utils.flush_digests(notify_conf, email_conf)
+            if cache is not None:
+                printl('Cache stats: %s' % cache.stats())
+        except Exception as e:
+            printl('Registration pass failed: %s' % str(e))
+        wait_next_event(t, timers, store, user_conf['msig_addr'], daemon_conf)
+
+
+if __name__ == '__main__':
+    printl('TON Autoreg version %s started with args %s' % (VERSION, sys.argv))
+
+    parser = argparse.ArgumentParser(description='Automatic registration in TON validator elections')
+    parser.add_argument('config', nargs='?', default='config.json', help='config file')
+    parser.add_argument('--daemon', action='store_true', help='keep running and wake up on elections events')
+    parser.add_argument('--trace', help='append spans of run phases and external calls to JSON lines file')
+    parser.add_argument('--chrome-trace', help='write spans to file in Chrome trace event format')
+    parser.add_argument('--profile', help='write cProfile stats of the run to file')
+    args = parser.parse_args()
+    config_file = args.config
+
+    if args.trace or args.chrome_trace:
+        tracing.configure(args.trace, args.chrome_trace)
+    if args.profile:
+        import cProfile
+        profiler = cProfile.Profile()
+
+        def dump_profile():
+            profiler.disable()
+            profiler.dump_stats(args.profile)
+            printl('Profile saved to %s, view it with python3 -m pstats %s' % (args.profile, args.profile))
+
+        # stats are written on every exit
+        atexit.register(dump_profile)
+        profiler.enable()
+
+    printl('Using %s' % config_file)
+
+    try:
+        with open(config_file, 'r') as f:
+            _config = f.read()
+    except:
+        printl('Cannot read %s' % config_file)
+        exit(1)
+
+    try:
+        config = json.loads(_config)
+    except Exception as e:
+        printl('Cannot parse %s: %s' % (config_file, str(e)))
+        exit(1)
+
+    # idle cron tick ends here, before config checks and loading of wrappers
+    election_folder = config.get('path', {}).get('election_folder', './')
+    idle_conf = config.get('idle', {})
+    if not args.daemon:
+        until = idle_probe(election_folder, config.get('wallet', {}).get('msig_addr'), idle_conf, time.time())
+        if until is not None:
+            printl('Nothing to do until %s' % datetime.fromtimestamp(until).strftime('%Y-%m-%d %H:%M:%S'))
+            metrics.configure(config.get('metrics', {}), election_folder)
+            metrics.run_finished('autoreg', 0)
+            metrics.flush()
+            exit(0)
+
+    from tonoscliwrapper import TonosCli
+    from tonoscache import cached_from_config
+    from asynctonoscli import AsyncTonosCli, async_for_backend
+    from graphqlclient import backend_from_config
+    from vecwrapper import ValidatorEngineConsole
+    from fiftwrapper import fift_from_config
+    from payloads import payloads_from_config
+    from electionstore import store_from_config
+    from dispatcher import dispatcher_from_config
+    from dedupe import dedupe_from_config
+
+    # full runs use most of the paths, they are checked at once like in the other scripts
+    path_conf, user_conf, notify_conf, email_conf = utils.check_config(config)
+    if path_conf is None:
+        exit(1)
+
+    retry.configure(config.get('retry', {}))
+    metrics.configure(config.get('metrics', {}), path_conf['election_folder'])
+    utils.install_dispatcher(dispatcher_from_config(config.get('dispatcher', {}), path_conf['election_folder'],
+                                                    [(notify_conf, email_conf)]))
+    utils.install_dedupe(dedupe_from_config(config.get('dedupe', {}), path_conf['election_folder']))
+
+    backend = backend_from_config(TonosCli(path_conf['tonos-cli']), config.get('backend', {}))
+    t, cache = cached_from_config(backend, config.get('cache', {}), path_conf['election_folder'])
+
+    at = async_for_backend(t, backend, path_conf['tonos-cli'], config.get('tonos-cli', {}).get('concurrency', AsyncTonosCli.CONCURRENCY), cache)
+
+    v = ValidatorEngineConsole(path_conf['validator-engine-console'],
+                               path_conf['client_key'],
+                               path_conf['server_pub_key'],
+                               path_conf['server_url'],
+                               config.get('console', {}).get('sessions', 0))
+
+    payload_conf = config.get('payload', {})
+    store = store_from_config(config.get('store', {}), path_conf['election_folder'])
+    payloads = payloads_from_config(fift_from_config(path_conf, payload_conf), path_conf, payload_conf)
+
+    if args.daemon:
+        metrics.serve()
+        run_daemon(t, at, v, payloads, store, path_conf, user_conf, notify_conf, email_conf, config.get('daemon', {}), cache)
+
+    idle_file = os.path.join(path_conf['election_folder'], IDLE_FILE) if idle_conf.get('full_check_interval', 0) > 0 else None
+    with retry.deadline_scope(retry.run_deadline()), tracing.span('register', wallet=user_conf['msig_addr']):
+        res = register(t, at, v, payloads, store, path_conf, user_conf, notify_conf, email_conf, idle_file=idle_file)
+        tracing.annotate(exit_code=res)
+    metrics.run_finished('autoreg', res)
+    metrics.flush()
+    utils.flush_digests(notify_conf, email_conf)
+    if cache is not None:
+        printl('Cache stats: %s' % cache.stats())
+    exit(res)
@@ -0,0 +1,87 @@
+import sys
+import os
+import json
+import time
+import tempfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from vecwrapper import ValidatorEngineConsole
+
+STUBS = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'stubs')
+PERMKEY = 'AB' * 32
+ADNL = 'CD' * 32
+
+problems = []
+
+
+def check(ok, problem):
+    if not ok:
+        print('FAILED: %s' % problem)
+        problems.append(problem)
+
+
+def console(sessions, errors):
+    os.environ['STUB_STATE'] = json.dumps({'console_errors': errors})
+    return ValidatorEngineConsole(os.path.join(STUBS, 'validator-engine-console'), 'client', 'server.pub', '127.0.0.1:3030', sessions)
+
+
+def failed_command(sessions):
+    '''
+    Failed query of the console ends the command at once in both modes
+    '''
+    mode = 'session' if sessions else 'one-shot'
+    v = console(sessions, {'addpermkey': '[Error : 651 : key exists]'})
+    start = time.time()
+    results = v.run_batch(['addpermkey %s 1 2' % PERMKEY])
+    elapsed = time.time() - start
+    v.close()
+    print('%s: failed addpermkey in %.3f s: %s' % (mode, elapsed, results))
+    check(len(results) == 1 and results[0][0] is False, '%s: failure is not detected: %s' % (mode, results))
+    check(elapsed < 5, '%s: failure is detected after %.1f s' % (mode, elapsed))
+
+
+def split_output():
+    '''
+    Output after a failure belongs to no command, commands without result are unknown
+    '''
+    v = console(0, {})
+    commands = ['addpermkey %s 1 2' % PERMKEY, 'addtempkey %s %s 2' % (PERMKEY, PERMKEY), 'addadnl %s 0' % ADNL,
+                'addvalidatoraddr %s %s 2' % (PERMKEY, ADNL)]
+    out = 'conn ready\nFailed addpermkey query: [Error : 651 : key exists]\nsuccess\nsuccess\nsuccess\n'
+    results = [r for r, o in v._split_output(commands, 0, out)]
+    check(results == [1, None, None, None], 'output after failure is split to commands: %s' % results)
+    results = [r for r, o in v._split_output(commands, 0, 'conn ready\nsuccess\n')]
+    check(results == [0, None, None, None], 'short output is not unknown: %s' % results)
+
+
+def configure_failure(sessions, failing):
+    '''
+    Failed configure batch: no command is run twice, everything that may have been applied is deleted
+    '''
+    mode = 'session' if sessions else 'one-shot'
+    folder = tempfile.mkdtemp()
+    os.environ['STUB_DIR'] = folder
+    v = console(sessions, {failing: '[Error : 651 : failed]'})
+    res = v.configure_validator(PERMKEY, ADNL, 1, 2)
+    v.close()
+    del os.environ['STUB_DIR']
+    with open(os.path.join(folder, 'console_commands'), 'r') as f:
+        run = [l.split(' ', 1) for l in f.read().splitlines()]
+    adds = [c for status, c in run if c.startswith('add')]
+    applied = set(c.split(' ')[0][3:] for status, c in run if status == 'ok' and c.startswith('add'))
+    deleted = set(c.split(' ')[0][3:] for status, c in run if c.startswith('del'))
+    print('%s: %s fails, console ran %s' % (mode, failing, ', '.join('%s %s' % (status, c.split(' ')[0]) for status, c in run)))
+    check(not res, '%s: configure succeeded with failed %s' % (mode, failing))
+    check(len(adds) == len(set(adds)), '%s: command run twice with failed %s' % (mode, failing))
+    check(applied <= deleted, '%s: %s applied and not deleted with failed %s' % (mode, ', '.join(applied - deleted), failing))
+
+
+if __name__ == '__main__':
+    for sessions in (0, 1):
+        failed_command(sessions)
+    split_output()
+    for sessions in (0, 1):
+        for failing in ('addpermkey', 'addtempkey', 'addadnl', 'addvalidatoraddr'):
+            configure_failure(sessions, failing)
+    if problems:
+        exit(1)
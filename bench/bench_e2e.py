@@ -0,0 +1,243 @@
+import sys
+import os
+import json
+import time
+import shutil
+import argparse
+import platform
+import subprocess
+import tempfile
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+STUBS = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'stubs')
+sys.path.insert(0, ROOT)
+from version import VERSION
+
+WALLET = '-1:' + '1' * 64
+ELECTOR = '-1:' + '3' * 64
+
+# tonos-cli commands which send messages
+TRANSACTIONS = ('submitTransaction', 'confirmTransaction', 'sendTransaction')
+
+
+def scenarios(now):
+    '''
+    :return: {name: (script, chain state)}
+    '''
+    return {
+        'no_election': ('autoreg.py', {'election_id': 0}),
+        'reward_claim': ('autoreg.py', {'election_id': 0, 'returned': 10 ** 13}),
+        'registration': ('autoreg.py', {'election_id': now + 20000}),
+        'confirmation': ('autoconfirm.py', {'transactions': [{'id': hex((now - i) << 32), 'dest': ELECTOR} for i in range(3)]}),
+        'fleet_traced': ('fleet.py', {'election_id': now + 20000}),
+    }
+
+
+def make_fleet(folder, config, wallets=2):
+    '''
+    Fleet config with wallets of the same node, every wallet has its own election folder
+    :return: fleet config file name
+    '''
+    with open(config, 'r') as f:
+        base = json.load(f)
+    configs = []
+    for i in range(wallets):
+        wallet = json.loads(json.dumps(base))
+        wallet['name'] = 'wallet%d' % i
+        wallet['wallet']['msig_addr'] = '-1:%064x' % (i + 1)
+        wallet['path']['election_folder'] = os.path.join(folder, 'status%d' % i)
+        os.makedirs(wallet['path']['election_folder'])
+        configs.append(wallet)
+    fn = os.path.join(folder, 'config.fleet.json')
+    with open(fn, 'w') as f:
+        json.dump({'workers': wallets, 'configs': configs}, f, indent=4)
+    return fn
+
+
+def check_fleet_trace(trace, wallets=2):
+    '''
+    :return: list of problems of fleet trace, every wallet must have its register span
+    '''
+    try:
+        with open(trace, 'r') as f:
+            spans = [json.loads(line) for line in f if line.strip()]
+    except Exception as e:
+        return ['no trace: %s' % str(e)]
+    registered = set(s['attrs'].get('config') for s in spans if s['name'] == 'register' and 'error' not in s['attrs'])
+    missing = ['wallet%d' % i for i in range(wallets) if 'wallet%d' % i not in registered]
+    return ['no register span of %s' % ', '.join(missing)] if missing else []
+
+
+def make_env(folder, payload):
+    '''
+    Keys, repo and election folders with config for stubs
+    :return: config file name
+    '''
+    for d in ['keys', 'repo', 'status']:
+        os.makedirs(os.path.join(folder, d))
+    for fn in ['client', 'server.pub', 'msig.keys.json']:
+        open(os.path.join(folder, 'keys', fn), 'w').close()
+    with open(os.path.join(folder, 'abi.json'), 'w') as f:
+        f.write('{}')
+    config = {
+        'wallet': {'msig_addr': WALLET, 'keyfile': os.path.join(folder, 'keys', 'msig.keys.json'),
+                   'stake_value': 'all', 'stake_factor': 3},
+        'path': {'keysdir': os.path.join(folder, 'keys'), 'repo': os.path.join(folder, 'repo'),
+                 'election_folder': os.path.join(folder, 'status'), 'abi': os.path.join(folder, 'abi.json'),
+                 'tonos-cli': os.path.join(STUBS, 'tonos-cli'),
+                 'validator-engine-console': os.path.join(STUBS, 'validator-engine-console'),
+                 'fift': os.path.join(STUBS, 'fift')},
+        'payload': {'builder': 'native' if payload == 'native' else 'fift', 'fift_server': payload == 'fift_server'},
+        'notifications': {},
+        'email': {}
+    }
+    fn = os.path.join(folder, 'config.json')
+    with open(fn, 'w') as f:
+        json.dump(config, f, indent=4)
+    return fn
+
+
+def phase(call):
+    if call['tool'] == 'validator-engine-console':
+        return 'console'
+    if call['tool'] == 'fift':
+        return 'payload'
+    if call['command'] in TRANSACTIONS:
+        return 'transactions'
+    return 'chain_queries'
+
+
+def union(intervals):
+    '''
+    Length of union of (start, end) intervals, calls made in parallel are counted once
+    '''
+    total = 0.0
+    last = None
+    for s, e in sorted(intervals):
+        if last is not None and s < last:
+            s = last
+        if e > s:
+            total += e - s
+        last = e if last is None else max(last, e)
+    return total
+
+
+def run_scenario(script, state, args):
+    folder = tempfile.mkdtemp(prefix='bench-e2e-')
+    try:
+        config = make_env(folder, args.payload)
+        log = os.path.join(folder, 'calls.log')
+        trace = os.path.join(folder, 'trace.jsonl')
+        params = [sys.executable, os.path.join(ROOT, script), config]
+        if script == 'fleet.py':
+            params = [sys.executable, os.path.join(ROOT, script), make_fleet(folder, config), '--trace', trace]
+        env = dict(os.environ, STUB_STATE=json.dumps(state), STUB_LOG=log, STUB_DIR=folder, STUB_LATENCY=str(args.latency),
+                   STUB_FAIL_RATE=str(args.fail_rate), STUB_OUTPUT_SIZE=str(args.output_size))
+        start = time.time()
+        p = subprocess.Popen(params, cwd=ROOT, env=env,
+                             stdin=subprocess.DEVNULL, stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+        out = p.stdout.read()
+        p.stdout.close()
+        # ru_maxrss of the script and its waited children
+        pid, status, rusage = os.wait4(p.pid, 0)
+        # reaped by wait4
+        p.returncode = 0
+        wall = time.time() - start
+        calls = []
+        if os.path.exists(log):
+            with open(log, 'r') as f:
+                calls = [json.loads(line) for line in f if line.strip()]
+        problems = check_fleet_trace(trace) if script == 'fleet.py' else []
+        if args.verbose:
+            print(out.decode(errors='replace'))
+    finally:
+        shutil.rmtree(folder, ignore_errors=True)
+
+    phases = {}
+    spawns = {}
+    for c in calls:
+        phases.setdefault(phase(c), []).append((c['start'], c['end']))
+        key = '%s %s' % (c['tool'], c['command'])
+        spawns[key] = spawns.get(key, 0) + 1
+    result = {
+        'exit_code': os.waitstatus_to_exitcode(status) if hasattr(os, 'waitstatus_to_exitcode') else status >> 8,
+        'wall': wall,
+        'startup': (min(c['start'] for c in calls) - start) if calls else wall,
+        'phases': {k: union(v) for k, v in phases.items()},
+        'subprocess': union([(c['start'], c['end']) for c in calls]),
+        'spawns': len(calls),
+        'spawns_by_command': spawns,
+        'failed_calls': sum(1 for c in calls if c['code'] != 0),
+        'peak_rss_kb': rusage.ru_maxrss,
+        'problems': problems,
+    }
+    result['python'] = result['wall'] - result['subprocess']
+    return result
+
+
+def median(values):
+    values = sorted(values)
+    n = len(values)
+    return values[n // 2] if n % 2 else (values[n // 2 - 1] + values[n // 2]) / 2
+
+
+def summary(runs):
+    s = {k: median([r[k] for r in runs]) for k in ['wall', 'startup', 'subprocess', 'python', 'spawns', 'peak_rss_kb']}
+    s['phases'] = {p: median([r['phases'].get(p, 0.0) for r in runs]) for p in set(p for r in runs for p in r['phases'])}
+    s['exit_codes'] = sorted(set(r['exit_code'] for r in runs))
+    s['problems'] = sorted(set(p for r in runs for p in r.get('problems', [])))
+    return s
+
+
+def print_summary(name, s, base=None):
+    line = '%-14s wall %7.3f s  startup %6.3f s  python %6.3f s  spawns %4d  rss %7d KB  exit %s' % (
+        name, s['wall'], s['startup'], s['python'], s['spawns'], s['peak_rss_kb'], s['exit_codes'])
+    if base is not None:
+        line += '  (wall %+.1f%%, spawns %+d)' % ((s['wall'] / base['wall'] - 1) * 100, s['spawns'] - base['spawns'])
+    print(line)
+    print('%-14s %s' % ('', '  '.join('%s %.3f s' % (p, t) for p, t in sorted(s['phases'].items()))))
+    for problem in s['problems']:
+        print('%-14s FAILED: %s' % ('', problem))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='End-to-end benchmark of autoreg.py and autoconfirm.py with stub binaries')
+    parser.add_argument('-s', '--scenario', action='append', help='scenario to run, all by default')
+    parser.add_argument('-n', '--repeat', type=int, default=3, help='runs of every scenario')
+    parser.add_argument('--latency', type=float, default=0.05, help='seconds every stub call takes')
+    parser.add_argument('--fail-rate', type=float, default=0.0, help='probability of transient failure of stub call')
+    parser.add_argument('--output-size', type=int, default=0, help='bytes of log noise printed by every stub call')
+    parser.add_argument('--payload', choices=['fift', 'fift_server', 'native'], default='fift', help='payload builder')
+    parser.add_argument('-o', '--output', help='JSON file for results')
+    parser.add_argument('--compare', help='JSON results of previous version to compare with')
+    parser.add_argument('-v', '--verbose', action='store_true', help='print output of scripts')
+    args = parser.parse_args()
+
+    base = None
+    if args.compare:
+        with open(args.compare, 'r') as f:
+            base = json.load(f)['scenarios']
+
+    all_scenarios = scenarios(int(time.time()))
+    names = args.scenario or list(all_scenarios)
+    results = {
+        'version': VERSION,
+        'python': platform.python_version(),
+        'time': int(time.time()),
+        'settings': {'repeat': args.repeat, 'latency': args.latency, 'fail_rate': args.fail_rate,
+                     'output_size': args.output_size, 'payload': args.payload},
+        'scenarios': {}
+    }
+    for name in names:
+        script, state = all_scenarios[name]
+        runs = [run_scenario(script, state, args) for i in range(args.repeat)]
+        results['scenarios'][name] = {'script': script, 'summary': summary(runs), 'runs': runs}
+        print_summary(name, results['scenarios'][name]['summary'],
+                      base[name]['summary'] if base is not None and name in base else None)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+        print('Results saved to %s' % args.output)
+    if any(s['summary']['problems'] for s in results['scenarios'].values()):
+        exit(1)
@@ -0,0 +1,52 @@
+import sys
+import os
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from fiftwrapper import Fift, FiftServer
+from payloads import FiftPayloads
+
+WALLET = '-1:' + '3' * 64
+ELECTION_ID = 1600000000
+MAX_FACTOR = '2.7'
+ADNL = 'AB' * 32
+SCRIPTS = {
+    'validator-elect-req': 'validator-elect-req.fif',
+    'validator-elect-signed': 'validator-elect-signed.fif',
+    'recover-stake': 'recover-stake.fif'
+}
+
+
+def measure(fn, repeat=5):
+    best = None
+    for i in range(repeat):
+        t = time.perf_counter()
+        res, out = fn()
+        d = time.perf_counter() - t
+        if not res:
+            print(out)
+        best = d if best is None else min(best, d)
+    return best * 1000
+
+
+if __name__ == '__main__':
+    if len(sys.argv) < 3:
+        print('Usage: %s <fift path> <fift includes>' % sys.argv[0])
+        exit(1)
+
+    server = FiftServer(sys.argv[1], sys.argv[2])
+    t = time.perf_counter()
+    res, out = server.start()
+    if res != 0:
+        print(out)
+        exit(1)
+    print('Server start with preloaded libraries %.2f ms' % ((time.perf_counter() - t) * 1000))
+
+    fift = FiftPayloads(Fift(sys.argv[1], sys.argv[2]), SCRIPTS)
+    served = FiftPayloads(server, SCRIPTS)
+    print('%24s %12s %12s' % ('', 'fift ms', 'server ms'))
+    print('%24s %12.2f %12.2f' % ('election_request',
+                                  measure(lambda: fift.election_request(WALLET, ELECTION_ID, MAX_FACTOR, ADNL)),
+                                  measure(lambda: served.election_request(WALLET, ELECTION_ID, MAX_FACTOR, ADNL))))
+    print('%24s %12.2f %12.2f' % ('recover_query', measure(lambda: fift.recover_query()), measure(lambda: served.recover_query())))
+    server.stop()
@@ -0,0 +1,84 @@
+import sys
+import os
+import json
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'stubs'))
+import graphqlserver
+from graphqlclient import GraphQLTonosCli
+from tonoscliwrapper import TonosCli
+
+STUBS = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'stubs')
+CONFIG_PARAMS = [1, 15, 16, 17, 34]
+
+problems = []
+
+
+def check(ok, problem):
+    if not ok:
+        print('FAILED: %s' % problem)
+        problems.append(problem)
+
+
+def same_config(index, graphql, tonos_cli):
+    '''
+    Fields asked by GraphQL backend must have the same values as in tonos-cli output, tonos-cli may print more fields
+    '''
+    if not isinstance(graphql, dict):
+        return graphql == tonos_cli
+    return isinstance(tonos_cli, dict) and all(k in tonos_cli and tonos_cli[k] == v for k, v in graphql.items())
+
+
+def parity(g, fixture):
+    '''
+    Compares results of GraphQL backend with parsing of tonos-cli output of the same chain state
+    '''
+    t = TonosCli()
+    for index in CONFIG_PARAMS:
+        res, obj = g.getconfig(index)
+        cli_res, cli_obj = t._parse_config(index, 0, fixture['tonos-cli']['getconfig %d' % index])
+        check(res and cli_res, 'getconfig %d failed: %s %s' % (index, obj, cli_obj))
+        if res and cli_res:
+            check(same_config(index, obj, cli_obj), 'getconfig %d: graphql %s, tonos-cli %s' % (index, obj, cli_obj))
+        if index == 17 and res:
+            # autoreg.py parses stakes with int()
+            check(all(str(obj.get(k)).isdigit() for k in ['min_stake', 'max_stake', 'min_total_stake']),
+                  'config 17 stakes are not decimal: %s' % obj)
+    for command, text in sorted(fixture['tonos-cli'].items()):
+        if not command.startswith('account '):
+            continue
+        addr = command.split(' ', 1)[1]
+        res, obj = g.account(addr)
+        cli = t._parse_account(0, text)
+        check(res and cli[0] and obj == cli[1], 'account %s: graphql %s, tonos-cli %s' % (addr, obj, cli[1]))
+
+
+def measure(fn, repeat=20):
+    t = time.perf_counter()
+    for i in range(repeat):
+        fn()
+    return (time.perf_counter() - t) / repeat * 1000
+
+
+if __name__ == '__main__':
+    with open(graphqlserver.FIXTURE, 'r') as f:
+        fixture = json.load(f)
+    server, url = graphqlserver.serve(fixture['graphql'])
+    fallback = TonosCli(os.path.join(STUBS, 'tonos-cli'))
+    g = GraphQLTonosCli(url, fallback)
+
+    parity(g, fixture)
+    print('parity of getconfig %s and %d accounts with tonos-cli: %s' % (
+        ' '.join(str(i) for i in CONFIG_PARAMS), sum(1 for c in fixture['tonos-cli'] if c.startswith('account ')),
+        'FAILED' if problems else 'ok'))
+
+    res, out = g.runget('-1:' + '3' * 64, 'active_election_id')
+    check(res, 'get-method is not passed to tonos-cli: %s' % out)
+
+    graphql_ms = measure(lambda: g.getconfig(15))
+    cli_ms = measure(lambda: fallback.getconfig(15))
+    print('getconfig 15: graphql %.2f ms, tonos-cli stand-in %.2f ms, %d queries served' % (graphql_ms, cli_ms, server.queries))
+    server.shutdown()
+    if problems:
+        exit(1)
@@ -0,0 +1,227 @@
+import sys
+import os
+import json
+import time
+import tempfile
+import threading
+import socketserver
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import utils
+from dispatcher import Dispatcher
+import telegramnotifier
+
+# delay of stand-in servers for every request, seconds
+DELAY = float(os.environ.get('DELAY', '0.5'))
+MESSAGES = 5
+
+received = {'telegram': 0, 'smtp': 0, 'smtp_sessions': 0}
+failing = {'telegram': False, 'smtp': False}
+# extra delay of telegram stand-in, seconds
+slow = {'telegram': 0}
+problems = []
+
+
+class TelegramHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers['Content-Length']))
+        time.sleep(DELAY + slow['telegram'])
+        if failing['telegram']:
+            self.send_response(502)
+            body = b'{"ok":false}'
+        else:
+            received['telegram'] += 1
+            self.send_response(200)
+            body = b'{"ok":true}'
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class SmtpHandler(socketserver.StreamRequestHandler):
+    '''
+    SMTP without STARTTLS, accepts any AUTH PLAIN
+    '''
+
+    def reply(self, line):
+        self.wfile.write((line + '\r\n').encode())
+
+    def handle(self):
+        received['smtp_sessions'] += 1
+        self.reply('220 stand-in')
+        while True:
+            line = self.rfile.readline()
+            if not line:
+                return
+            cmd = line.decode().strip().upper()
+            if cmd.startswith('EHLO'):
+                self.wfile.write(b'250-stand-in\r\n250 AUTH PLAIN\r\n')
+            elif cmd.startswith('AUTH'):
+                self.reply('235 ok')
+            elif cmd.startswith('DATA'):
+                self.reply('354 go')
+                while self.rfile.readline() not in (b'.\r\n', b''):
+                    pass
+                time.sleep(DELAY)
+                if failing['smtp']:
+                    self.reply('451 try again later')
+                else:
+                    received['smtp'] += 1
+                    self.reply('250 queued')
+            elif cmd.startswith('QUIT'):
+                self.reply('221 bye')
+                return
+            else:
+                self.reply('250 ok')
+
+
+def serve(server):
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server.server_address[1]
+
+
+def check(ok, problem):
+    if not ok:
+        print('FAILED: %s' % problem)
+        problems.append(problem)
+
+
+def wait_for(condition, timeout):
+    deadline = time.time() + timeout
+    while not condition() and time.time() < deadline:
+        time.sleep(0.1)
+    return condition()
+
+
+def spooled(spool):
+    items = []
+    for fn in os.listdir(spool):
+        with open(os.path.join(spool, fn), 'r') as f:
+            items.append(f.read())
+    return items
+
+
+def notify_all(notify_conf, email_conf):
+    t = time.perf_counter()
+    for i in range(MESSAGES):
+        utils.notify_owner('message %d' % i, notify_conf, email_conf)
+        utils.notify_custodians(['0x1'], 'custodian message %d' % i, notify_conf, email_conf)
+    return (time.perf_counter() - t) * 1000
+
+
+if __name__ == '__main__':
+    socketserver.ThreadingTCPServer.allow_reuse_address = True
+    http_port = serve(ThreadingHTTPServer(('127.0.0.1', 0), TelegramHandler))
+    smtp_port = serve(socketserver.ThreadingTCPServer(('127.0.0.1', 0), SmtpHandler))
+    telegramnotifier.TelegramNotifier.URL = 'http://127.0.0.1:%d' % http_port
+    email_conf = {'login': 'bench@localhost', 'password': 'x', 'smtp': '127.0.0.1', 'port': smtp_port, 'starttls': False}
+    notify_conf = {
+        'owner': {'type': 'telegram', 'params': {'token': '1:x', 'chat_ids': ['1', '2']}},
+        '0x1': {'type': 'email', 'params': {'address': 'custodian@localhost'}}
+    }
+
+    def reset():
+        for k in received:
+            received[k] = 0
+
+    print('%d owner and %d custodian messages, server delay %.2f s' % (MESSAGES, MESSAGES, DELAY))
+    reset()
+    utils.install_dispatcher(None)
+    ms = notify_all(notify_conf, email_conf)
+    print('direct:     caller waited %9.2f ms, delivered %s' % (ms, received))
+
+    reset()
+    spool = tempfile.mkdtemp()
+    d = Dispatcher(spool, timeout=5, batch_delay=0.2, retry_interval=1, telegram_url=telegramnotifier.TelegramNotifier.URL)
+    utils.install_dispatcher(d)
+    ms = notify_all(notify_conf, email_conf)
+    t = time.perf_counter()
+    d.drain(60)
+    print('dispatcher: caller waited %9.2f ms, drained in %.2f ms, delivered %s' % (ms, (time.perf_counter() - t) * 1000, received))
+
+    check(received['telegram'] > 0 and received['smtp'] > 0, 'dispatcher delivered %s' % received)
+
+    reset()
+    failing['telegram'] = True
+    notify_all(notify_conf, email_conf)
+    d.drain(60)
+    print('telegram failing: spooled %d files' % len(os.listdir(spool)))
+    check(len(os.listdir(spool)) > 0, 'nothing spooled while telegram fails')
+    failing['telegram'] = False
+    wait_for(lambda: len(os.listdir(spool)) == 0, 5 + DELAY * 8)
+    print('telegram back: spooled %d files, delivered %s' % (len(os.listdir(spool)), received))
+    check(len(os.listdir(spool)) == 0 and received['telegram'] > 0, 'spool not retried by the same dispatcher')
+    d.close()
+
+    # spooled by one process, delivered by the next one before it submits anything
+    reset()
+    spool = tempfile.mkdtemp()
+    failing['telegram'] = True
+    failing['smtp'] = True
+    d = Dispatcher(spool, timeout=5, batch_delay=0.2, retry_interval=60, telegram_url=telegramnotifier.TelegramNotifier.URL)
+    utils.install_dispatcher(d)
+    notify_all(notify_conf, email_conf)
+    d.drain(60)
+    d.close()
+    items = spooled(spool)
+    print('both failing: spooled %d files' % len(items))
+    check(any('"telegram"' in i for i in items) and any('"email"' in i for i in items), 'telegram and email not spooled')
+    check(not any(notify_conf['owner']['params']['token'] in i or email_conf['password'] in i for i in items),
+          'secrets written to spool')
+    check(all(json.loads(i)['attempts'] == 1 for i in items), 'spooled deliveries retried before restart')
+
+    reset()
+    failing['telegram'] = False
+    failing['smtp'] = False
+    d = Dispatcher(spool, timeout=5, batch_delay=0.2, retry_interval=60, telegram_url=telegramnotifier.TelegramNotifier.URL,
+                   credentials=[(notify_conf, email_conf)])
+    wait_for(lambda: len(os.listdir(spool)) == 0, 5 + DELAY * 8)
+    print('after restart: spooled %d files, delivered %s' % (len(os.listdir(spool)), received))
+    check(len(os.listdir(spool)) == 0 and received['telegram'] > 0 and received['smtp'] > 0,
+          'spool not delivered after restart, delivered %s' % received)
+    d.close()
+
+    # autoreg and autoconfirm retry the same spool at the same time, every file is sent once
+    failing['telegram'] = True
+    failing['smtp'] = True
+    d = Dispatcher(spool, timeout=5, batch_delay=0.2, retry_interval=60, telegram_url=telegramnotifier.TelegramNotifier.URL)
+    utils.install_dispatcher(d)
+    notify_all(notify_conf, email_conf)
+    d.drain(60)
+    d.close()
+    items = [json.loads(i)['channel']['type'] for i in spooled(spool)]
+    reset()
+    failing['telegram'] = False
+    failing['smtp'] = False
+    shared = [Dispatcher(spool, timeout=5, batch_delay=0.2, retry_interval=60, telegram_url=telegramnotifier.TelegramNotifier.URL,
+                         credentials=[(notify_conf, email_conf)]) for i in range(2)]
+    wait_for(lambda: len(os.listdir(spool)) == 0, 5 + DELAY * 16)
+    print('shared spool: %d files, delivered %s' % (len(items), received))
+    check(received['telegram'] == items.count('telegram') and received['smtp'] == items.count('email'),
+          'shared spool of %d telegram and %d email files delivered %s' % (items.count('telegram'), items.count('email'), received))
+    check(all(i.thread.is_alive() for i in shared), 'dispatcher thread died on shared spool')
+    for i in shared:
+        i.close()
+
+    # exit while the worker is still busy: queued messages go to spool
+    spool = tempfile.mkdtemp()
+    slow['telegram'] = 3
+    d = Dispatcher(spool, timeout=10, batch_delay=0, retry_interval=60, telegram_url=telegramnotifier.TelegramNotifier.URL)
+    utils.install_dispatcher(d)
+    utils.notify_owner('first message', notify_conf, email_conf)
+    time.sleep(0.5)
+    for i in range(MESSAGES):
+        utils.notify_owner('message %d' % i, notify_conf, email_conf)
+    d.close(0.5)
+    saved = sum(len(json.loads(i)['messages']) for i in spooled(spool))
+    print('close timed out: spooled %d of %d queued messages' % (saved, MESSAGES * 2))
+    check(saved == MESSAGES * 2, 'close spooled %d of %d queued messages' % (saved, MESSAGES * 2))
+    slow['telegram'] = 0
+    if problems:
+        exit(1)
@@ -0,0 +1,58 @@
+import sys
+import os
+import json
+import time
+import random
+import tempfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import participants
+
+
+def synthetic_list(n):
+    '''
+    participant_list result text with n participants, as printed by tonos-cli runget
+    '''
+    text = 'null'
+    for i in range(n):
+        text = '[["0x%064x","0x%x"],%s]' % (random.getrandbits(256), random.randint(10**13, 10**16), text)
+    return '[%s]' % text
+
+
+def measure(fn, repeat=5):
+    best = None
+    for i in range(repeat):
+        t = time.perf_counter()
+        fn()
+        d = time.perf_counter() - t
+        best = d if best is None else min(best, d)
+    return best * 1000
+
+
+def old_parser(text):
+    obj = json.loads(text)
+    node = obj[0]
+    index = {}
+    while node is not None:
+        index[int(node[0][0], 0)] = int(node[0][1], 0)
+        node = node[1]
+    return index
+
+
+if __name__ == '__main__':
+    sizes = [int(i) for i in sys.argv[1:]] or [100, 1000, 5000, 20000]
+    folder = tempfile.mkdtemp()
+    print('%8s %12s %12s %12s %12s' % ('size', 'json ms', 'iter ms', 'disk ms', 'memory ms'))
+    for n in sizes:
+        text = synthetic_list(n)
+        try:
+            json_ms = '%12.2f' % measure(lambda: old_parser(text))
+        except RecursionError:
+            json_ms = '%12s' % 'recursion'
+        iter_ms = measure(lambda: participants.participant_index(participants.loads_lists(text)))
+        participants.ParticipantSnapshots(folder).index(n, text)
+        disk_ms = measure(lambda: participants.ParticipantSnapshots(folder).index(n, text))
+        snapshots = participants.ParticipantSnapshots(folder)
+        snapshots.index(n, text)
+        memory_ms = measure(lambda: snapshots.index(n, text))
+        print('%8d %s %12.2f %12.2f %12.2f' % (n, json_ms, iter_ms, disk_ms, memory_ms))
@@ -0,0 +1,137 @@
+import sys
+import os
+import time
+import json
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import boc
+from fiftwrapper import Fift
+from payloads import FiftPayloads, NativePayloads
+
+FIXTURE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures', 'payloads.json')
+with open(FIXTURE, 'r') as f:
+    fixture = json.load(f)
+WALLET = fixture['inputs']['wallet_addr']
+ELECTION_ID = fixture['inputs']['election_id']
+MAX_FACTOR = fixture['inputs']['max_factor']
+ADNL = fixture['inputs']['adnl_addr']
+PUBLIC_KEY = fixture['inputs']['public_key']
+SIGNATURE = fixture['inputs']['signature']
+
+problems = []
+
+
+def measure(fn, repeat=5):
+    best = None
+    for i in range(repeat):
+        t = time.perf_counter()
+        fn()
+        d = time.perf_counter() - t
+        best = d if best is None else min(best, d)
+    return best * 1000
+
+
+def query_id(data):
+    '''
+    query_id of the root cell of a BOC serialized with crc and 1 byte refs/offsets
+    '''
+    return int.from_bytes(data[17:25], 'big')
+
+
+def record(fift):
+    '''
+    Write fift outputs of fixture inputs to the fixture
+    '''
+    for name, fn in (('validator-elect-req', lambda: fift.election_request(WALLET, ELECTION_ID, MAX_FACTOR, ADNL)),
+                     ('validator-elect-signed', lambda: fift.election_query(WALLET, ELECTION_ID, MAX_FACTOR, ADNL, PUBLIC_KEY, SIGNATURE)),
+                     ('recover-stake', lambda: fift.recover_query())):
+        res, data = fn()
+        if not res:
+            print('%s: fift failed: %s' % (name, data))
+            exit(1)
+        fixture[name] = data.hex()
+    for max_factor in fixture['max-factor']:
+        res, data = fift.election_request(WALLET, ELECTION_ID, max_factor, ADNL)
+        if not res:
+            print('max factor %s: fift failed: %s' % (max_factor, data))
+            exit(1)
+        # ZlPt tag and expire_at come before max_factor in validator-elect-req.fif output
+        fixture['max-factor'][max_factor] = int.from_bytes(data[8:12], 'big')
+    with open(FIXTURE, 'w') as f:
+        f.write(json.dumps(fixture, indent=2) + '\n')
+    print('Recorded %s' % FIXTURE)
+
+
+def check(name, res, fift_data, native_fn):
+    if not res:
+        print('%s: fift failed: %s' % (name, fift_data))
+        problems.append(name)
+        return
+    native_data = native_fn(fift_data)
+    print('%s: %s' % (name, 'identical' if native_data == fift_data else 'DIFFERENT\n  fift   %s\n  native %s' % (fift_data.hex(), native_data.hex())))
+    if native_data != fift_data:
+        problems.append(name)
+
+
+def check_fixture():
+    '''
+    Native payloads must reproduce fift outputs of fixture inputs byte by byte, crc32c included
+    '''
+    check('crc32c check value', True, (0xE3069283).to_bytes(4, 'big'), lambda data: boc.crc32c(b'123456789').to_bytes(4, 'big'))
+    check('fixture validator-elect-req', True, bytes.fromhex(fixture['validator-elect-req']),
+          lambda data: boc.validator_elect_req(WALLET, ELECTION_ID, MAX_FACTOR, ADNL))
+    check('fixture validator-elect-signed', True, bytes.fromhex(fixture['validator-elect-signed']),
+          lambda data: boc.validator_elect_signed(WALLET, ELECTION_ID, MAX_FACTOR, ADNL, PUBLIC_KEY, SIGNATURE, query_id(data)))
+    check('fixture recover-stake', True, bytes.fromhex(fixture['recover-stake']), lambda data: boc.recover_stake(query_id(data)))
+    for max_factor, value in fixture['max-factor'].items():
+        check('fixture max factor %s' % max_factor, True, value.to_bytes(4, 'big'),
+              lambda data: boc.parse_max_factor(max_factor).to_bytes(4, 'big'))
+    # fift aborts with "Ed25519 signature is invalid" on a signature of other request
+    res, out = NativePayloads().election_query(WALLET, ELECTION_ID + 1, MAX_FACTOR, ADNL, PUBLIC_KEY, SIGNATURE)
+    print('signature of other request: %s' % ('accepted' if res else out))
+    if res:
+        problems.append('signature of other request')
+
+
+if __name__ == '__main__':
+    recording = '--record' in sys.argv
+    if recording:
+        sys.argv.remove('--record')
+    if not recording:
+        check_fixture()
+    native = NativePayloads()
+    print('%24s %12s' % ('native', 'ms'))
+    print('%24s %12.4f' % ('election_request', measure(lambda: native.election_request(WALLET, ELECTION_ID, MAX_FACTOR, ADNL))))
+    print('%24s %12.4f' % ('election_query', measure(lambda: native.election_query(WALLET, ELECTION_ID, MAX_FACTOR, ADNL, PUBLIC_KEY, SIGNATURE))))
+    print('%24s %12.4f' % ('recover_query', measure(lambda: native.recover_query())))
+
+    if len(sys.argv) < 3:
+        print('Pass fift path and includes to compare with fift scripts')
+        exit(1 if problems or recording else 0)
+
+    fift = FiftPayloads(Fift(sys.argv[1], sys.argv[2]), {
+        'validator-elect-req': 'validator-elect-req.fif',
+        'validator-elect-signed': 'validator-elect-signed.fif',
+        'recover-stake': 'recover-stake.fif'
+    })
+    if recording:
+        record(fift)
+        exit(0)
+    print('%24s %12s' % ('fift', 'ms'))
+    print('%24s %12.4f' % ('election_request', measure(lambda: fift.election_request(WALLET, ELECTION_ID, MAX_FACTOR, ADNL))))
+    print('%24s %12.4f' % ('recover_query', measure(lambda: fift.recover_query())))
+
+    # fixture key pair is used unless another public key and signature are given
+    res, data = fift.election_request(WALLET, ELECTION_ID, MAX_FACTOR, ADNL)
+    check('election_request', res, data, lambda data: boc.validator_elect_req(WALLET, ELECTION_ID, MAX_FACTOR, ADNL))
+    res, data = fift.recover_query()
+    check('recover_query', res, data, lambda data: boc.recover_stake(query_id(data)))
+    if len(sys.argv) >= 5:
+        public_key, signature = sys.argv[3], sys.argv[4]
+        res, data = fift.election_query(WALLET, ELECTION_ID, MAX_FACTOR, ADNL, public_key, signature)
+        check('election_query', res, data, lambda data: boc.validator_elect_signed(WALLET, ELECTION_ID, MAX_FACTOR, ADNL, public_key, signature, query_id(data)))
+    else:
+        res, data = fift.election_query(WALLET, ELECTION_ID, MAX_FACTOR, ADNL, PUBLIC_KEY, SIGNATURE)
+        check('election_query', res, data, lambda data: boc.validator_elect_signed(WALLET, ELECTION_ID, MAX_FACTOR, ADNL, PUBLIC_KEY, SIGNATURE, query_id(data)))
+    if problems:
+        exit(1)
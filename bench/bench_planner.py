@@ -0,0 +1,74 @@
+import sys
+import os
+import time
+import random
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import stakeplanner
+
+CONFIG16 = {'max_validators': 1000, 'max_main_validators': 100, 'min_validators': 13}
+CONFIG17 = {'max_stake': '10000000000000000', 'max_stake_factor': 196608, 'min_stake': '10000000000000', 'min_total_stake': '100000000000000'}
+
+
+def synthetic_participants(n):
+    '''
+    (stake, max_factor) of n participants, stakes around 500k tokens
+    '''
+    return [(int(random.lognormvariate(0, 0.6) * 5 * 10 ** 14) + 10 ** 13, random.choice([65536, 98304, 131072, 196608]))
+            for i in range(n)]
+
+
+def reference_elect(stakes, factors, max_validators, min_validators, min_total_stake):
+    '''
+    try_elect of elector code as it is, O(n^2)
+    '''
+    n = min(len(stakes), max_validators)
+    best, m = 0, 0
+    for i in range(max(min_validators, 1), n + 1):
+        tot = sum(min(stakes[j], int(factors[j] * 65536) * stakes[i - 1] >> 16) for j in range(i))
+        if tot > best:
+            best, m = tot, i
+    if m == 0 or best < min_total_stake:
+        return 0, 0, 0
+    return m, stakes[m - 1], best
+
+
+def check(n):
+    '''
+    :return: number of participant lists where elect differs from reference_elect
+    '''
+    errors = 0
+    for attempt in range(20):
+        planner = stakeplanner.StakePlanner(synthetic_participants(n), CONFIG16, CONFIG17)
+        stakes = [int(s) for s in planner.stakes]
+        expected = reference_elect(stakes, list(planner.factors), CONFIG16['max_validators'],
+                                   CONFIG16['min_validators'], int(CONFIG17['min_total_stake']))
+        got = stakeplanner.elect(planner.stakes, planner.factors, CONFIG16['max_validators'],
+                                 CONFIG16['min_validators'], int(CONFIG17['min_total_stake']))
+        if got[0] != expected[0] or abs(got[2] - expected[2]) > expected[2] * 1e-9 + got[0]:
+            errors += 1
+    return errors
+
+
+def measure(fn, repeat=5):
+    best = None
+    for i in range(repeat):
+        t = time.perf_counter()
+        fn()
+        d = time.perf_counter() - t
+        best = d if best is None else min(best, d)
+    return best * 1000
+
+
+if __name__ == '__main__':
+    sizes = [int(i) for i in sys.argv[1:]] or [100, 1000, 5000, 20000]
+    random.seed(1)
+    for n in (20, 300, 1500):
+        print('reference check, 20 lists of %d participants: %d mismatches' % (n, check(n)))
+    print('%8s %14s %12s %s' % ('size', 'evaluate ms', 'plan ms', 'plan'))
+    for n in sizes:
+        planner = stakeplanner.StakePlanner(synthetic_participants(n), CONFIG16, CONFIG17)
+        evaluate_ms = measure(lambda: planner.evaluate(5 * 10 ** 14, 3.0))
+        plan = planner.plan(10 ** 13 + 10 ** 9, 10 ** 15, 3.0)
+        plan_ms = measure(lambda: planner.plan(10 ** 13 + 10 ** 9, 10 ** 15, 3.0), 3)
+        print('%8d %14.3f %12.1f %s' % (n, evaluate_ms, plan_ms, plan))
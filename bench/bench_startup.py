@@ -0,0 +1,101 @@
+import sys
+import os
+import json
+import time
+import shutil
+import argparse
+import platform
+import subprocess
+import tempfile
+from bench_e2e import ROOT, STUBS, make_env, median
+
+sys.path.insert(0, ROOT)
+from version import VERSION
+
+MODULES = ['retry', 'metrics', 'tracing', 'utils', 'tonoscliwrapper', 'tonoscache', 'asynctonoscli', 'graphqlclient',
+           'vecwrapper', 'fiftwrapper', 'payloads', 'electionstore', 'dispatcher', 'dedupe', 'autoreg', 'autoconfirm']
+
+# modules which should not be loaded by idle runs
+HEAVY = ['requests', 'smtplib', 'email.mime.text', 'asyncio', 'sqlite3', 'http.server', 'concurrent.futures', 'subprocess']
+
+
+def import_time(module):
+    '''
+    :return: (cumulative import time in seconds, heavy modules loaded by the import)
+    '''
+    p = subprocess.run([sys.executable, '-X', 'importtime', '-c',
+                        'import sys, json, %s; print(json.dumps([m for m in %r if m in sys.modules]))' % (module, HEAVY)],
+                       cwd=ROOT, stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True)
+    us = 0
+    for line in p.stderr.splitlines():
+        parts = line.split('|')
+        if len(parts) == 3 and parts[2].strip() == module and not parts[2].startswith('  '):
+            us = int(parts[1])
+    return us / 1000000.0, json.loads(p.stdout)
+
+
+def cold_start(args, env):
+    '''
+    :return: wall time of a process in seconds
+    '''
+    start = time.time()
+    subprocess.run(args, cwd=ROOT, env=env, stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    return time.time() - start
+
+
+def cold_starts(n):
+    '''
+    Bare interpreter, idle run of autoreg.py by saved timing and full run without elections
+    :return: {name: median seconds}
+    '''
+    folder = tempfile.mkdtemp(prefix='bench-startup-')
+    try:
+        full_config = make_env(folder, 'fift')
+        with open(full_config, 'r') as f:
+            conf = json.load(f)
+        conf['idle'] = {'full_check_interval': 3600}
+        config = os.path.join(folder, 'config.idle.json')
+        with open(config, 'w') as f:
+            json.dump(conf, f)
+        env = dict(os.environ, STUB_STATE=json.dumps({'election_id': 0}))
+        script = os.path.join(ROOT, 'autoreg.py')
+        # the first run saves timing for idle runs
+        cold_start([sys.executable, script, config], env)
+        if not os.path.exists(os.path.join(folder, 'status', 'idle.json')):
+            print('autoreg.py did not save idle timing')
+        return {
+            'python': median([cold_start([sys.executable, '-c', 'pass'], env) for i in range(n)]),
+            'idle_run': median([cold_start([sys.executable, script, config], env) for i in range(n)]),
+            'full_run': median([cold_start([sys.executable, script, full_config], env) for i in range(n)]),
+        }
+    finally:
+        shutil.rmtree(folder, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Import time of modules and cold start time of autoreg.py')
+    parser.add_argument('-n', '--repeat', type=int, default=5, help='runs of every measurement')
+    parser.add_argument('-m', '--module', action='append', help='module to import, all by default')
+    parser.add_argument('-o', '--output', help='JSON file for results')
+    args = parser.parse_args()
+
+    results = {
+        'version': VERSION,
+        'python': platform.python_version(),
+        'time': int(time.time()),
+        'imports': {},
+        'cold_start': {}
+    }
+    for module in args.module or MODULES:
+        runs = [import_time(module) for i in range(args.repeat)]
+        results['imports'][module] = {'seconds': median([r[0] for r in runs]), 'heavy': runs[-1][1]}
+        print('import %-16s %7.1f ms  %s' % (module, results['imports'][module]['seconds'] * 1000, ' '.join(runs[-1][1])))
+
+    results['cold_start'] = cold_starts(args.repeat)
+    for name, seconds in sorted(results['cold_start'].items()):
+        print('start  %-16s %7.1f ms' % (name, seconds * 1000))
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+        print('Results saved to %s' % args.output)
@@ -0,0 +1,89 @@
+'''
+Stand-in of DApp server GraphQL endpoint. Answers the queries of GraphQLTonosCli from chain state
+in the format of the server: BigInt fields are hex strings unless "(format: DEC)" is asked for the field.
+Run as a script to serve bench/fixtures/graphql.json: graphqlserver.py [port]
+'''
+import json
+import os
+import re
+import sys
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+FIXTURE = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'fixtures', 'graphql.json')
+
+CONFIG_PARAM = re.compile(r'config\s*\{\s*p(\d+)\s*(?:\{([^{}]*)\})?\s*\}')
+ACCOUNTS = re.compile(r'accounts\s*\([^)]*\)\s*\{([^{}]*)\}')
+FIELD = re.compile(r'(\w+)\s*(\(\s*format:\s*DEC\s*\))?')
+
+
+def _value(value, dec):
+    if dec and isinstance(value, str) and value.startswith('0x'):
+        return str(int(value, 16))
+    return value
+
+
+def _select(obj, selection):
+    '''
+    Fields of obj asked by selection set, missing fields are null
+    '''
+    return {name: _value(obj.get(name), bool(dec)) for name, dec in FIELD.findall(selection)}
+
+
+def answer(state, query, variables):
+    '''
+    :return: response object of the query
+    '''
+    m = CONFIG_PARAM.search(query)
+    if 'blocks' in query and m is not None:
+        value = state['config'].get('p' + m.group(1))
+        if m.group(2) is not None and value is not None:
+            value = _select(value, m.group(2))
+        return {'data': {'blocks': [{'master': {'config': {'p' + m.group(1): value}}}]}}
+    m = ACCOUNTS.search(query)
+    if m is not None:
+        acc = state['accounts'].get(variables.get('addr'))
+        return {'data': {'accounts': [] if acc is None else [_select(acc, m.group(1))]}}
+    return {'errors': [{'message': 'Query is not supported by stand-in: %s' % query}]}
+
+
+def serve(state, port=0):
+    '''
+    Starts the server in a background thread
+    :return: (server, url)
+    '''
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+        # headers and body in one segment, no delayed ack of kept-alive connection
+        wbufsize = 65536
+        disable_nagle_algorithm = True
+
+        def do_POST(self):
+            request = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+            self.server.queries += 1
+            body = json.dumps(answer(state, request['query'], request.get('variables') or {})).encode('utf-8')
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(('127.0.0.1', port), Handler)
+    server.daemon_threads = True
+    server.queries = 0
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, 'http://127.0.0.1:%d/graphql' % server.server_address[1]
+
+
+if __name__ == '__main__':
+    with open(FIXTURE, 'r') as f:
+        fixture = json.load(f)
+    server, url = serve(fixture['graphql'], int(sys.argv[1]) if len(sys.argv) > 1 else 0)
+    print('Serving %s' % url)
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
@@ -0,0 +1,144 @@
+'''
+Common part of stand-in executables used by benchmarks.
+Behaviour is set by environment variables:
+STUB_STATE        chain state as JSON or @file with JSON
+STUB_LATENCY      seconds every call sleeps, "latency" of state overrides it by command: {"confirmTransaction": 2}
+STUB_FAIL_RATE    probability of transient failure of a call, "fail_rate" of state overrides it by command
+STUB_OUTPUT_SIZE  bytes of log noise printed by every call
+STUB_LOG          file to append one JSON line per call: tool, command, pid, start, end, exit code
+STUB_DIR          folder shared by calls of one run, with it validator key is fixed and
+                  submitted election request shows up in participant list
+'''
+import atexit
+import hashlib
+import json
+import os
+import random
+import sys
+import time
+
+_call = {}
+
+# validator key when STUB_DIR is set, PUBKEY is the public key of SECRET
+SECRET = '5b1f2b3c' * 8
+PUBKEY = 'a3dd2ce10625bf910f4b10e7bec431842cc8074fda11f5f6f92e1200333afb1c'
+
+
+def load_state():
+    state = os.environ.get('STUB_STATE', '{}')
+    if state.startswith('@'):
+        with open(state[1:], 'r') as f:
+            state = f.read()
+    return json.loads(state)
+
+
+STATE = load_state()
+
+
+def _by_command(key, env, command, default):
+    value = STATE.get(key, {})
+    if isinstance(value, dict):
+        if command in value:
+            return float(value[command])
+        if '*' in value:
+            return float(value['*'])
+    else:
+        return float(value)
+    return float(os.environ.get(env, default))
+
+
+def _log():
+    log = os.environ.get('STUB_LOG')
+    if log:
+        _call['end'] = time.time()
+        line = json.dumps(_call) + '\n'
+        # one write with O_APPEND keeps lines of concurrent calls whole
+        fd = os.open(log, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        try:
+            os.write(fd, line.encode())
+        finally:
+            os.close(fd)
+
+
+def log_now():
+    '''
+    Logs the call before its result is printed, callers stop one-shot commands as soon as the result arrives
+    '''
+    atexit.unregister(_log)
+    _log()
+
+
+def _exit_code(code):
+    _call['code'] = code
+    return code
+
+
+def start(tool, command):
+    '''
+    Registers the call, sleeps configured latency and prints log noise
+    :return: False if the call must fail
+    '''
+    _call.update({'tool': tool, 'command': command, 'pid': os.getpid(), 'start': time.time(), 'code': 0})
+    atexit.register(_log)
+    latency = _by_command('latency', 'STUB_LATENCY', command, 0)
+    if latency > 0:
+        time.sleep(latency)
+    noise(int(os.environ.get('STUB_OUTPUT_SIZE', '0')))
+    return random.random() >= _by_command('fail_rate', 'STUB_FAIL_RATE', command, 0)
+
+
+def noise(size):
+    line = '[ 3][t 1][%s][stub] verbose log line of a stand-in executable\n' % time.strftime('%Y-%m-%d %H:%M:%S')
+    while size > 0:
+        sys.stdout.write(line[:size])
+        size -= len(line)
+    sys.stdout.flush()
+
+
+def fail(message):
+    sys.stdout.write(message + '\n')
+    sys.stdout.flush()
+    sys.exit(_exit_code(1))
+
+
+def shared(name):
+    '''
+    :return: file name in STUB_DIR or None
+    '''
+    folder = os.environ.get('STUB_DIR')
+    return os.path.join(folder, name) if folder else None
+
+
+def _expand(key_hash):
+    '''
+    Ed25519 secret scalar and nonce prefix of a validator key, keys are derived from key hash
+    '''
+    secret = bytes.fromhex(SECRET) if shared('submitted') else hashlib.sha256(key_hash.encode()).digest()
+    h = hashlib.sha512(secret).digest()
+    a = (int.from_bytes(h[:32], 'little') & ((1 << 254) - 8)) | (1 << 254)
+    return a, h[32:]
+
+
+def _boc():
+    sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..'))
+    import boc
+    return boc
+
+
+def public_key(key_hash):
+    boc = _boc()
+    a, prefix = _expand(key_hash)
+    return boc._point_compress(boc._point_mul(a, boc.ED25519_BASE))
+
+
+def sign(key_hash, data):
+    '''
+    Ed25519 signature of RFC 8032, native payload builder checks it
+    '''
+    boc = _boc()
+    a, prefix = _expand(key_hash)
+    pub = public_key(key_hash)
+    r = int.from_bytes(hashlib.sha512(prefix + data).digest(), 'little') % boc.ED25519_L
+    big_r = boc._point_compress(boc._point_mul(r, boc.ED25519_BASE))
+    k = int.from_bytes(hashlib.sha512(big_r + pub + data).digest(), 'little') % boc.ED25519_L
+    return big_r + ((r + k * a) % boc.ED25519_L).to_bytes(32, 'little')
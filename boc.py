@@ -0,0 +1,298 @@
+import hashlib
+import time
+from fractions import Fraction
+
+BOC_MAGIC = 0xb5ee9c72
+ED25519_PUBKEY_MAGIC = 0xc6b41348
+
+
+# Ed25519 curve of RFC 8032, points are in extended coordinates (X, Y, Z, T)
+ED25519_P = 2 ** 255 - 19
+ED25519_L = 2 ** 252 + 27742317777372353535851937790883648493
+ED25519_D = -121665 * pow(121666, ED25519_P - 2, ED25519_P) % ED25519_P
+ED25519_SQRT_M1 = pow(2, (ED25519_P - 1) // 4, ED25519_P)
+
+
+def _crc32c_table():
+    table = []
+    for i in range(256):
+        c = i
+        for k in range(8):
+            c = (c >> 1) ^ 0x82F63B78 if c & 1 else c >> 1
+        table.append(c)
+    return table
+
+
+CRC32C_TABLE = _crc32c_table()
+
+
+def crc32c(data):
+    crc = 0xFFFFFFFF
+    for b in data:
+        crc = CRC32C_TABLE[(crc ^ b) & 0xFF] ^ (crc >> 8)
+    return crc ^ 0xFFFFFFFF
+
+
+def _point_add(a, b):
+    p = ED25519_P
+    x = (a[1] - a[0]) * (b[1] - b[0]) % p
+    y = (a[1] + a[0]) * (b[1] + b[0]) % p
+    t = 2 * a[3] * b[3] * ED25519_D % p
+    z = 2 * a[2] * b[2] % p
+    e, f, g, h = y - x, z - t, z + t, y + x
+    return e * f % p, g * h % p, f * g % p, e * h % p
+
+
+def _point_mul(s, point):
+    q = (0, 1, 1, 0)
+    while s > 0:
+        if s & 1:
+            q = _point_add(q, point)
+        point = _point_add(point, point)
+        s >>= 1
+    return q
+
+
+def _point_equal(a, b):
+    p = ED25519_P
+    return (a[0] * b[2] - b[0] * a[2]) % p == 0 and (a[1] * b[2] - b[1] * a[2]) % p == 0
+
+
+def _point_compress(point):
+    p = ED25519_P
+    zinv = pow(point[2], p - 2, p)
+    x = point[0] * zinv % p
+    y = point[1] * zinv % p
+    return (y | ((x & 1) << 255)).to_bytes(32, 'little')
+
+
+def _point_decompress(data):
+    '''
+    :return: point or None if data is not a point of the curve
+    '''
+    p = ED25519_P
+    y = int.from_bytes(data, 'little')
+    sign = y >> 255
+    y &= (1 << 255) - 1
+    if y >= p:
+        return None
+    x2 = (y * y - 1) * pow(ED25519_D * y * y + 1, p - 2, p) % p
+    if x2 == 0:
+        if sign:
+            return None
+        x = 0
+    else:
+        x = pow(x2, (p + 3) // 8, p)
+        if (x * x - x2) % p != 0:
+            x = x * ED25519_SQRT_M1 % p
+        if (x * x - x2) % p != 0:
+            return None
+        if x & 1 != sign:
+            x = p - x
+    return x, y, 1, x * y % p
+
+
+ED25519_BASE = _point_decompress((4 * pow(5, ED25519_P - 2, ED25519_P) % ED25519_P).to_bytes(32, 'little'))
+
+
+def ed25519_chksign(data, signature, public_key):
+    '''
+    Checks Ed25519 signature like fift ed25519_chksign
+    :param public_key: 32 bytes
+    :param signature: 64 bytes
+    :return: True if signature of data is valid
+    '''
+    if len(public_key) != 32 or len(signature) != 64:
+        return False
+    a = _point_decompress(public_key)
+    r = _point_decompress(signature[:32])
+    s = int.from_bytes(signature[32:], 'little')
+    if a is None or r is None or s >= ED25519_L:
+        return False
+    h = int.from_bytes(hashlib.sha512(signature[:32] + public_key + data).digest(), 'little') % ED25519_L
+    return _point_equal(_point_mul(s, ED25519_BASE), _point_add(r, _point_mul(h, a)))
+
+
+class Cell:
+    '''
+    Ordinary cell: up to 1023 data bits and up to 4 references
+    '''
+
+    def __init__(self, value, bits, refs):
+        self.value = value
+        self.bits = bits
+        self.refs = tuple(refs)
+        self.depth = max([r.depth + 1 for r in self.refs] or [0])
+        self.hash = hashlib.sha256(self.descriptors() + self.data() +
+                                   b''.join(r.depth.to_bytes(2, 'big') for r in self.refs) +
+                                   b''.join(r.hash for r in self.refs)).digest()
+
+    def descriptors(self):
+        return bytes([len(self.refs), (self.bits + 7) // 8 + self.bits // 8])
+
+    def data(self):
+        '''
+        Data bytes with completion tag if data is not byte aligned
+        '''
+        pad = -self.bits % 8
+        value = self.value << pad
+        if pad:
+            value |= 1 << (pad - 1)
+        return value.to_bytes((self.bits + 7) // 8, 'big')
+
+
+class Builder:
+    def __init__(self):
+        self.value = 0
+        self.bits = 0
+        self.refs = []
+
+    def store_uint(self, value, bits):
+        if value < 0 or value >= 1 << bits:
+            raise ValueError('%d does not fit in %d bits' % (value, bits))
+        if self.bits + bits > 1023:
+            raise ValueError('Cell overflow')
+        self.value = (self.value << bits) | value
+        self.bits += bits
+        return self
+
+    def store_bytes(self, data):
+        return self.store_uint(int.from_bytes(data, 'big'), len(data) * 8)
+
+    def store_ref(self, cell):
+        if len(self.refs) == 4:
+            raise ValueError('Cell refs overflow')
+        self.refs.append(cell)
+        return self
+
+    def end_cell(self):
+        return Cell(self.value, self.bits, self.refs)
+
+
+def _order_cells(root):
+    '''
+    Cell order of fift BagOfCells: root first, references always point forward
+    '''
+    cells = {}
+    state = {}
+    allocated = []
+
+    def visit(cell):
+        # same as BagOfCells::revisit with force=1, then force=2 for children
+        if state.get(cell.hash) is not None:
+            return
+        state[cell.hash] = 'visited'
+        for r in reversed(cell.refs):
+            visit(r)
+        for r in reversed(cell.refs):
+            allocate(r)
+
+    def allocate(cell):
+        if state.get(cell.hash) == 'allocated':
+            return
+        state[cell.hash] = 'allocated'
+        cells[cell.hash] = cell
+        allocated.append(cell)
+
+    visit(root)
+    allocate(root)
+    allocated.reverse()
+    return allocated
+
+
+def serialize_boc(root, crc=True):
+    '''
+    Serializes bag of cells with one root like fift "boc+>B" with mode 2 (crc) or 0
+    '''
+    cells = _order_cells(root)
+    index = {c.hash: n for n, c in enumerate(cells)}
+    ref_size = 1
+    while len(cells) >= 1 << (ref_size * 8):
+        ref_size += 1
+
+    data = b''
+    for c in cells:
+        data += c.descriptors() + c.data() + b''.join(index[r.hash].to_bytes(ref_size, 'big') for r in c.refs)
+    offset_size = 1
+    while len(data) >= 1 << (offset_size * 8):
+        offset_size += 1
+
+    flags = ref_size | (0x40 if crc else 0)
+    boc = BOC_MAGIC.to_bytes(4, 'big') + bytes([flags, offset_size]) + \
+        len(cells).to_bytes(ref_size, 'big') + (1).to_bytes(ref_size, 'big') + (0).to_bytes(ref_size, 'big') + \
+        len(data).to_bytes(offset_size, 'big') + (0).to_bytes(ref_size, 'big') + data
+    if crc:
+        boc += crc32c(boc).to_bytes(4, 'little')
+    return boc
+
+
+def parse_masterchain_address(addr):
+    '''
+    Parses raw "-1:<hex>" address like fift parse-load-address
+    :return: 256 bit address
+    '''
+    wc, hex_addr = addr.split(':')
+    if int(wc) != -1:
+        raise ValueError('only masterchain smartcontracts may participate in validator elections')
+    if len(hex_addr) != 64:
+        raise ValueError('Bad address %s' % addr)
+    return int(hex_addr, 16)
+
+
+def parse_max_factor(max_factor):
+    '''
+    Converts max factor string to fixed point with 16 fraction bits like fift "16 <</r"
+    '''
+    f = Fraction(str(max_factor))
+    value = (f.numerator * 65536 * 2 + f.denominator) // (2 * f.denominator)
+    if value < 65536 or value > 6553600:
+        raise ValueError('<max-factor> must be a real number 1..100')
+    return value
+
+
+def parse_adnl_address(adnl_addr):
+    if len(adnl_addr) != 64:
+        raise ValueError('Bad ADNL address %s' % adnl_addr)
+    return int(adnl_addr, 16)
+
+
+def validator_elect_req(wallet_addr, elect_time, max_factor, adnl_addr):
+    '''
+    Same bytes as validator-elect-req.fif saves to validator-to-sign.bin
+    '''
+    return bytes.fromhex('654c5074') + int(elect_time).to_bytes(4, 'big') + \
+        parse_max_factor(max_factor).to_bytes(4, 'big') + \
+        parse_masterchain_address(wallet_addr).to_bytes(32, 'big') + \
+        parse_adnl_address(adnl_addr).to_bytes(32, 'big')
+
+
+def validator_elect_signed(wallet_addr, elect_time, max_factor, adnl_addr, public_key, signature, query_id=None):
+    '''
+    Same BOC as validator-elect-signed.fif saves to validator-query.boc, the signature is checked like fift does
+    :param public_key: base64 exported by validator-engine-console, 36 bytes with Ed25519 magic
+    :param signature: base64 signature, 64 bytes
+    :param query_id: fift uses current time
+    '''
+    import base64
+    pubkey = base64.b64decode(public_key)
+    if len(pubkey) != 36 or int.from_bytes(pubkey[:4], 'big') != ED25519_PUBKEY_MAGIC:
+        raise ValueError('Bad validator public key')
+    sign = base64.b64decode(signature)
+    if len(sign) != 64:
+        raise ValueError('validator Ed25519 signature must be exactly 64 bytes long')
+    if not ed25519_chksign(validator_elect_req(wallet_addr, elect_time, max_factor, adnl_addr), sign, pubkey[4:]):
+        raise ValueError('Ed25519 signature is invalid')
+    signature_cell = Builder().store_bytes(sign).end_cell()
+    root = Builder().store_uint(0x4e73744b, 32).store_uint(int(time.time()) if query_id is None else query_id, 64) \
+        .store_bytes(pubkey[4:]).store_uint(int(elect_time), 32).store_uint(parse_max_factor(max_factor), 32) \
+        .store_uint(parse_adnl_address(adnl_addr), 256).store_ref(signature_cell).end_cell()
+    return serialize_boc(root)
+
+
+def recover_stake(query_id=None):
+    '''
+    Same BOC as recover-stake.fif saves to recover-query.boc
+    :param query_id: fift uses current time
+    '''
+    root = Builder().store_uint(0x47657424, 32).store_uint(int(time.time()) if query_id is None else query_id, 64).end_cell()
+    return serialize_boc(root)
@@ -0,0 +1,138 @@
+import fcntl
+import hashlib
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+import utils
+
+
+class NotificationDedupe:
+    '''
+    Persistent index of sent notifications keyed by message class, wallet, election id, transaction ids and channel.
+    The same event is sent again only after its ttl. With digest window events of a channel
+    are collected and sent as one message when the window is over.
+    Digests refer to their channel by a hash of its config entry, tokens are not written to the index
+    '''
+    # re-notify ttl by message class, seconds
+    TTL = {
+        'low_balance_reward': 86400,
+        'low_balance_elections': 21600,
+        'confirmation_needed': 3600,
+        'send_failed': 3600,
+        'confirm_failed': 3600,
+        'registered': 86400 * 30,
+    }
+    DEFAULT_TTL = 21600
+
+    def __init__(self, filename=None, ttl=None, digest_window=0):
+        '''
+        :param filename: json file shared by autoreg and autoconfirm, None keeps index in memory
+        :param ttl: overrides of TTL by message class
+        :param digest_window: seconds to collect events into one message, 0 sends them at once
+        '''
+        self.filename = filename
+        self.ttl = dict(self.TTL)
+        self.ttl.update(ttl or {})
+        self.digest_window = digest_window
+        self.lock = threading.Lock()
+        self.memory = {'sent': {}, 'digests': {}}
+
+    @contextmanager
+    def _index(self):
+        '''
+        Index loaded under file lock and saved back
+        '''
+        with self.lock:
+            if self.filename is None:
+                yield self.memory
+                return
+            with open(self.filename + '.lock', 'a') as lock:
+                fcntl.flock(lock, fcntl.LOCK_EX)
+                try:
+                    with open(self.filename, 'r') as f:
+                        index = json.load(f)
+                except:
+                    index = {'sent': {}, 'digests': {}}
+                yield index
+                utils.save_atomic(self.filename, json.dumps(index))
+
+    def _prune(self, index, now):
+        max_ttl = max(list(self.ttl.values()) + [self.DEFAULT_TTL])
+        index['sent'] = {k: v for k, v in index['sent'].items() if v + max_ttl > now}
+
+    @staticmethod
+    def _digest(messages):
+        if len(messages) == 1:
+            return messages[0]
+        return 'Digest of %d notifications:\n' % len(messages) + '\n'.join('- ' + m for m in messages)
+
+    @staticmethod
+    def _channel_key(nn):
+        return hashlib.sha256(json.dumps(nn, sort_keys=True).encode("utf-8")).hexdigest()[:16]
+
+    def filter(self, nn, event, msg):
+        '''
+        :param nn: "notifications" config entry of the recipient
+        :param event: (message class, wallet, election id) or (message class, wallet, election id, transaction ids)
+                      or None to send every time. New transactions are a new event
+        :return: messages to send now
+        '''
+        now = time.time()
+        recipient = self._channel_key(nn)
+        with self._index() as index:
+            if event is not None:
+                kind = event[0]
+                key = '%s|%s|%s|%s' % (kind, event[1], event[2], recipient)
+                if len(event) > 3:
+                    key += '|' + ','.join(sorted(str(i) for i in event[3]))
+                sent = index['sent'].get(key)
+                if sent is not None and sent + self.ttl.get(kind, self.DEFAULT_TTL) > now:
+                    return []
+                index['sent'][key] = now
+                self._prune(index, now)
+            if self.digest_window <= 0:
+                return [msg]
+            digest = index['digests'].setdefault(recipient, {'start': now, 'messages': []})
+            digest['messages'].append(msg)
+            if digest['start'] + self.digest_window > now:
+                return []
+            del index['digests'][recipient]
+            return [self._digest(digest['messages'])]
+
+    def flush(self, notify_conf, force=False):
+        '''
+        Takes digests with finished window of recipients of the config,
+        digests of recipients of other configs sharing the index are left for their runs
+        :param notify_conf: "notifications" config section
+        :param force: take all digests of the config
+        :return: list of ("notifications" config entry, message)
+        '''
+        channels = {}
+        for nn in notify_conf.values():
+            if isinstance(nn, dict) and 'type' in nn:
+                channels[self._channel_key(nn)] = nn
+        now = time.time()
+        result = []
+        with self._index() as index:
+            for recipient, digest in list(index['digests'].items()):
+                nn = channels.get(recipient)
+                if nn is None:
+                    continue
+                if force or digest['start'] + self.digest_window <= now:
+                    result.append((nn, self._digest(digest['messages'])))
+                    del index['digests'][recipient]
+        return result
+
+
+def dedupe_from_config(dedupe_conf, election_folder):
+    '''
+    NotificationDedupe configured by "dedupe" config section
+    :return: NotificationDedupe or None if disabled
+    '''
+    if not dedupe_conf.get('enabled', True):
+        return None
+    return NotificationDedupe(dedupe_conf.get('file', os.path.join(election_folder, 'notifications.json')),
+                              dedupe_conf.get('ttl'),
+                              dedupe_conf.get('digest_window', 0))
@@ -0,0 +1,346 @@
+import atexit
+import glob
+import hashlib
+import json
+import os
+import queue
+import threading
+import time
+import utils
+
+
+class Dispatcher:
+    '''
+    Delivers notifications from a background thread over kept connections.
+    Messages queued for the same channel are sent as one message,
+    failed deliveries are saved to spool folder and retried.
+    Channels refer to bot tokens and email configs by keys, so secrets are never written to spool
+    '''
+    TELEGRAM_MAX_LENGTH = 4096
+
+    def __init__(self, spool=None, queue_size=1000, timeout=10, batch_delay=1.0, retry_interval=300,
+                 max_attempts=20, telegram_url=None, credentials=()):
+        '''
+        :param spool: folder for failed deliveries, None drops them
+        :param timeout: timeout of one delivery in seconds
+        :param batch_delay: time to collect messages for the same channel
+        :param retry_interval: seconds between retries of spooled deliveries
+        :param credentials: list of ("notifications", "email") config sections, spooled deliveries of
+                            previous runs are sent with them before anything is submitted
+        '''
+        self.spool = spool
+        self.timeout = timeout
+        self.batch_delay = batch_delay
+        self.retry_interval = retry_interval
+        self.max_attempts = max_attempts
+        self.telegram_url = telegram_url
+        self.queue = queue.Queue(queue_size)
+        # made on first telegram delivery, requests is not imported by runs without notifications
+        self.session = None
+        self.tokens = {}
+        self.email_confs = {}
+        for notify_conf, email_conf in credentials:
+            self.add_credentials(notify_conf, email_conf)
+        self.smtp = {}
+        self.counter = 0
+        self.pending = 0
+        self.idle = threading.Condition()
+        self.closed = False
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+        atexit.register(self.close)
+
+    @staticmethod
+    def _email_key(email_conf):
+        return '%s@%s:%s' % (email_conf['login'], email_conf['smtp'], email_conf['port'])
+
+    def _bot_key(self, token):
+        key = hashlib.sha256(token.encode("utf-8")).hexdigest()[:16]
+        self.tokens[key] = token
+        return key
+
+    def add_credentials(self, notify_conf, email_conf):
+        '''
+        Makes bot tokens and email config of the config sections known to resolve spooled channels
+        '''
+        for nn in notify_conf.values():
+            try:
+                if nn['type'] == 'telegram':
+                    self._bot_key(nn['params']['token'])
+            except:
+                continue
+        try:
+            self.email_confs[self._email_key(email_conf)] = email_conf
+        except:
+            pass
+
+    def _channels(self, nn, email_conf):
+        '''
+        Splits "notifications" config entry to channels with one recipient, secrets are not kept in channel
+        '''
+        if nn['type'] == 'telegram':
+            bot = self._bot_key(nn['params']['token'])
+            return [{'type': 'telegram', 'bot': bot, 'chat_id': cid} for cid in nn['params']['chat_ids']]
+        elif nn['type'] == 'email':
+            key = self._email_key(email_conf)
+            self.email_confs[key] = email_conf
+            return [{'type': 'email', 'email': key, 'address': nn['params']['address']}]
+        return []
+
+    def _done(self, n):
+        with self.idle:
+            self.pending -= n
+            self.idle.notify_all()
+
+    def submit(self, nn, msg, email_conf):
+        '''
+        Queues message without waiting, message goes to spool if the queue is full
+        :param nn: "notifications" config entry
+        '''
+        try:
+            channels = self._channels(nn, email_conf)
+        except:
+            return
+        for channel in channels:
+            with self.idle:
+                self.pending += 1
+            try:
+                self.queue.put_nowait((channel, msg))
+            except queue.Full:
+                self._spool_save(channel, [msg], 0)
+                self._done(1)
+
+    def _session(self):
+        if self.session is None:
+            import requests
+            from requests.adapters import HTTPAdapter
+            self.session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=1, pool_maxsize=1)
+            self.session.mount('http://', adapter)
+            self.session.mount('https://', adapter)
+        return self.session
+
+    def _send(self, channel, messages):
+        '''
+        :return: success
+        '''
+        try:
+            if channel['type'] == 'telegram':
+                if channel['bot'] not in self.tokens:
+                    print('Notification to %s failed: no bot token in config' % channel['chat_id'])
+                    return False
+                from telegramnotifier import TelegramNotifier
+                notifier = TelegramNotifier(self.tokens[channel['bot']], [channel['chat_id']], self._session(), self.timeout,
+                                            self.telegram_url)
+                text = ''
+                for msg in messages:
+                    if len(text) > 0 and len(text) + len(msg) + 2 > self.TELEGRAM_MAX_LENGTH:
+                        notifier.send(text)
+                        text = ''
+                    text = msg if len(text) == 0 else text + '\n\n' + msg
+                notifier.send(text)
+            elif channel['type'] == 'email':
+                key = channel['email']
+                if key not in self.email_confs:
+                    print('Notification to %s failed: no email config %s' % (channel['address'], key))
+                    return False
+                if key not in self.smtp:
+                    from emailnotifier import EmailNotifier
+                    email_conf = self.email_confs[key]
+                    self.smtp[key] = EmailNotifier(email_conf['login'], email_conf['password'], email_conf['smtp'],
+                                                   email_conf['port'], self.timeout, email_conf.get('starttls', True), True)
+                self.smtp[key].send(channel['address'], '\n\n'.join(messages))
+            return True
+        except Exception as e:
+            print('Notification to %s failed: %s' % (channel.get('chat_id', channel.get('address')), str(e)))
+            return False
+
+    def _spool_save(self, channel, messages, attempts, fn=None):
+        if self.spool is None:
+            return
+        if fn is None:
+            self.counter += 1
+            fn = os.path.join(self.spool, '%.6f_%d_%d.json' % (time.time(), os.getpid(), self.counter))
+        utils.save_atomic(fn, json.dumps({'channel': channel, 'messages': messages, 'attempts': attempts}))
+
+    @staticmethod
+    def _remove(fn):
+        try:
+            os.remove(fn)
+        except OSError:
+            pass
+
+    def _claim(self, fn):
+        '''
+        Takes spool file for this process, autoreg and autoconfirm share the spool
+        :return: name of claimed file or None if another process has taken it
+        '''
+        claimed = '%s.claimed.%d' % (fn, os.getpid())
+        try:
+            os.rename(fn, claimed)
+        except OSError:
+            return None
+        return claimed
+
+    def _release_stale(self):
+        '''
+        Returns files claimed by processes which exited before delivery to spool
+        '''
+        for claimed in glob.glob(os.path.join(self.spool, '*.json.claimed.*')):
+            fn, pid = claimed.rsplit('.claimed.', 1)
+            try:
+                os.kill(int(pid), 0)
+                continue
+            except ProcessLookupError:
+                pass
+            except:
+                continue
+            try:
+                os.rename(claimed, fn)
+            except OSError:
+                pass
+
+    def _retry_spool(self):
+        if self.spool is None:
+            return
+        self._release_stale()
+        for fn in sorted(glob.glob(os.path.join(self.spool, '*.json'))):
+            claimed = self._claim(fn)
+            if claimed is None:
+                continue
+            try:
+                with open(claimed, 'r') as f:
+                    item = json.load(f)
+            except:
+                try:
+                    os.rename(claimed, fn)
+                except OSError:
+                    pass
+                continue
+            if self._send(item['channel'], item['messages']):
+                self._remove(claimed)
+            elif item['attempts'] + 1 >= self.max_attempts:
+                print('Dropping notification after %d attempts: %s' % (item['attempts'] + 1, fn))
+                self._remove(claimed)
+            else:
+                self._spool_save(item['channel'], item['messages'], item['attempts'] + 1, fn)
+                self._remove(claimed)
+
+    def _deliver(self, batch):
+        channels = {}
+        for channel, msg in batch:
+            key = json.dumps(channel, sort_keys=True)
+            channels.setdefault(key, (channel, []))[1].append(msg)
+        for channel, messages in channels.values():
+            if not self._send(channel, messages):
+                self._spool_save(channel, messages, 1)
+
+    def _run(self):
+        next_retry = time.time()
+        stop = False
+        while not stop:
+            if time.time() >= next_retry:
+                self._retry_spool()
+                next_retry = time.time() + self.retry_interval
+            try:
+                item = self.queue.get(timeout=max(min(next_retry - time.time(), 1.0), 0.01))
+            except queue.Empty:
+                continue
+            if item is None:
+                break
+            batch = [item]
+            batch_end = time.time() + self.batch_delay
+            while not self.closed:
+                try:
+                    item = self.queue.get(timeout=max(batch_end - time.time(), 0))
+                except queue.Empty:
+                    break
+                if item is None:
+                    stop = True
+                    break
+                batch.append(item)
+            # no waiting for more messages when closing
+            while True:
+                try:
+                    item = self.queue.get_nowait()
+                except queue.Empty:
+                    break
+                if item is None:
+                    stop = True
+                else:
+                    batch.append(item)
+            self._deliver(batch)
+            self._done(len(batch))
+        for notifier in self.smtp.values():
+            notifier.close()
+
+    def drain(self, timeout):
+        '''
+        Waits until all queued messages are delivered or spooled
+        :return: True if the queue is empty
+        '''
+        deadline = time.time() + timeout
+        with self.idle:
+            while self.pending > 0:
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    return False
+                self.idle.wait(remaining)
+        return True
+
+    def _spool_queued(self):
+        '''
+        Saves messages still queued to spool, the next run delivers them
+        '''
+        dropped = 0
+        while True:
+            try:
+                item = self.queue.get_nowait()
+            except queue.Empty:
+                break
+            if item is None:
+                continue
+            if self.spool is None:
+                dropped += 1
+            self._spool_save(item[0], [item[1]], 0)
+            self._done(1)
+        if dropped > 0:
+            print('Dropping %d queued notifications, no spool folder' % dropped)
+
+    def close(self, timeout=30):
+        '''
+        Delivers queued messages and stops the worker, messages not delivered in time are spooled
+        '''
+        if self.closed:
+            return
+        self.closed = True
+        try:
+            self.queue.put(None, timeout=timeout)
+            self.thread.join(timeout)
+        except queue.Full:
+            pass
+        if self.thread.is_alive():
+            self._spool_queued()
+
+
+def dispatcher_from_config(dispatcher_conf, election_folder, credentials=()):
+    '''
+    Dispatcher configured by "dispatcher" config section
+    :param credentials: list of ("notifications", "email") config sections to deliver spooled messages
+    :return: Dispatcher or None if disabled
+    '''
+    if not dispatcher_conf.get('enabled', True):
+        return None
+    spool = dispatcher_conf.get('spool', os.path.join(election_folder, 'spool'))
+    try:
+        os.makedirs(spool, exist_ok=True)
+    except:
+        spool = None
+    return Dispatcher(spool,
+                      dispatcher_conf.get('queue_size', 1000),
+                      dispatcher_conf.get('timeout', 10),
+                      dispatcher_conf.get('batch_delay', 1.0),
+                      dispatcher_conf.get('retry_interval', 300),
+                      dispatcher_conf.get('max_attempts', 20),
+                      dispatcher_conf.get('telegram_url'),
+                      credentials)
@@ -0,0 +1,313 @@
+import glob
+import json
+import os
+import re
+import sys
+import threading
+import time
+import argparse
+import utils
+
+ELECTION_FILE = re.compile(r'^(\d+)\.json$')
+
+
+class JsonElectionStore:
+    '''
+    Election state in <election_folder>/<election id>.json files, one wallet per folder
+    '''
+
+    def __init__(self, folder):
+        self.folder = folder
+        self.lock = threading.Lock()
+
+    def _filename(self, election_id):
+        return os.path.join(self.folder, '%d.json' % election_id)
+
+    def location(self, wallet, election_id):
+        return self._filename(election_id)
+
+    def get(self, wallet, election_id):
+        '''
+        :return: election object or None
+        '''
+        try:
+            with open(self._filename(election_id), 'r') as f:
+                return json.load(f)
+        except:
+            return None
+
+    def create(self, wallet, election_obj):
+        return utils.save_atomic(self._filename(election_obj['election_id']), json.dumps(election_obj, indent=4))
+
+    def transition(self, wallet, election_id, state, **changes):
+        '''
+        Sets new state and changed fields of the election object
+        :return: success
+        '''
+        with self.lock:
+            election_obj = self.get(wallet, election_id)
+            if election_obj is None:
+                return False
+            election_obj.update(changes)
+            election_obj['state'] = state
+            return utils.save_atomic(self._filename(election_id), json.dumps(election_obj, indent=4))
+
+    def elections(self, wallet=None):
+        '''
+        :return: election objects ordered by election id
+        '''
+        result = []
+        for fn in sorted(glob.glob(os.path.join(self.folder, '*.json'))):
+            if ELECTION_FILE.match(os.path.basename(fn)) is None:
+                continue
+            try:
+                with open(fn, 'r') as f:
+                    election_obj = json.load(f)
+                if 'election_id' in election_obj and 'state' in election_obj:
+                    result.append(election_obj)
+            except:
+                continue
+        return sorted(result, key=lambda e: e['election_id'])
+
+    def latest(self, wallet):
+        elections = self.elections(wallet)
+        return elections[-1] if len(elections) > 0 else None
+
+    def history(self, wallet=None, election_id=None):
+        '''
+        JSON files keep only the last state
+        :return: list of (wallet, election_id, from_state, state, time)
+        '''
+        return [(wallet, e['election_id'], None, e['state'], None) for e in self.elections(wallet)
+                if election_id is None or e['election_id'] == election_id]
+
+    def close(self):
+        pass
+
+
+class SqliteElectionStore:
+    '''
+    Election state of many wallets in one SQLite database in WAL mode.
+    A state change updates one row and appends one history row in one transaction
+    '''
+    SCHEMA = [
+        'CREATE TABLE IF NOT EXISTS elections (wallet TEXT NOT NULL, election_id INTEGER NOT NULL, '
+        'state TEXT NOT NULL, data TEXT NOT NULL, updated REAL NOT NULL, PRIMARY KEY (wallet, election_id))',
+        'CREATE INDEX IF NOT EXISTS elections_state ON elections (state, election_id)',
+        'CREATE TABLE IF NOT EXISTS transitions (id INTEGER PRIMARY KEY AUTOINCREMENT, wallet TEXT NOT NULL, '
+        'election_id INTEGER NOT NULL, from_state TEXT, state TEXT NOT NULL, time REAL NOT NULL)',
+        'CREATE INDEX IF NOT EXISTS transitions_election ON transitions (wallet, election_id)',
+    ]
+
+    def __init__(self, filename):
+        import sqlite3
+        self.filename = filename
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(filename, timeout=30, check_same_thread=False, isolation_level=None)
+        self.db.execute('PRAGMA journal_mode=WAL')
+        self.db.execute('PRAGMA synchronous=NORMAL')
+        for s in self.SCHEMA:
+            self.db.execute(s)
+
+    def location(self, wallet, election_id):
+        return '%s (%s, %d)' % (self.filename, wallet, election_id)
+
+    def _get(self, wallet, election_id):
+        row = self.db.execute('SELECT state, data FROM elections WHERE wallet = ? AND election_id = ?',
+                              (wallet, election_id)).fetchone()
+        if row is None:
+            return None
+        election_obj = json.loads(row[1])
+        election_obj['state'] = row[0]
+        return election_obj
+
+    def get(self, wallet, election_id):
+        with self.lock:
+            return self._get(wallet, election_id)
+
+    def _insert(self, wallet, election_obj, from_state=None):
+        now = time.time()
+        self.db.execute('INSERT INTO elections (wallet, election_id, state, data, updated) VALUES (?, ?, ?, ?, ?)',
+                        (wallet, election_obj['election_id'], election_obj['state'], json.dumps(election_obj), now))
+        self.db.execute('INSERT INTO transitions (wallet, election_id, from_state, state, time) VALUES (?, ?, ?, ?, ?)',
+                        (wallet, election_obj['election_id'], from_state, election_obj['state'], now))
+
+    def create(self, wallet, election_obj):
+        with self.lock:
+            try:
+                self.db.execute('BEGIN IMMEDIATE')
+                self._insert(wallet, election_obj)
+                self.db.execute('COMMIT')
+                return True
+            except:
+                # BEGIN may fail itself, e.g. when the database is locked
+                if self.db.in_transaction:
+                    self.db.execute('ROLLBACK')
+                return False
+
+    def transition(self, wallet, election_id, state, **changes):
+        with self.lock:
+            try:
+                self.db.execute('BEGIN IMMEDIATE')
+                election_obj = self._get(wallet, election_id)
+                if election_obj is None:
+                    raise ValueError('No election %d' % election_id)
+                from_state = election_obj['state']
+                now = time.time()
+                if len(changes) > 0:
+                    election_obj.update(changes)
+                    election_obj['state'] = state
+                    self.db.execute('UPDATE elections SET state = ?, data = ?, updated = ? WHERE wallet = ? AND election_id = ?',
+                                    (state, json.dumps(election_obj), now, wallet, election_id))
+                else:
+                    self.db.execute('UPDATE elections SET state = ?, updated = ? WHERE wallet = ? AND election_id = ?',
+                                    (state, now, wallet, election_id))
+                self.db.execute('INSERT INTO transitions (wallet, election_id, from_state, state, time) VALUES (?, ?, ?, ?, ?)',
+                                (wallet, election_id, from_state, state, now))
+                self.db.execute('COMMIT')
+                return True
+            except:
+                if self.db.in_transaction:
+                    self.db.execute('ROLLBACK')
+                return False
+
+    def _objects(self, rows):
+        result = []
+        for state, data in rows:
+            election_obj = json.loads(data)
+            election_obj['state'] = state
+            result.append(election_obj)
+        return result
+
+    def elections(self, wallet=None):
+        with self.lock:
+            if wallet is None:
+                rows = self.db.execute('SELECT state, data FROM elections ORDER BY election_id').fetchall()
+            else:
+                rows = self.db.execute('SELECT state, data FROM elections WHERE wallet = ? ORDER BY election_id',
+                                       (wallet,)).fetchall()
+        return self._objects(rows)
+
+    def latest(self, wallet):
+        with self.lock:
+            if wallet is None:
+                rows = self.db.execute('SELECT state, data FROM elections ORDER BY election_id DESC LIMIT 1').fetchall()
+            else:
+                rows = self.db.execute('SELECT state, data FROM elections WHERE wallet = ? ORDER BY election_id DESC LIMIT 1',
+                                       (wallet,)).fetchall()
+        elections = self._objects(rows)
+        return elections[0] if len(elections) > 0 else None
+
+    def history(self, wallet=None, election_id=None):
+        query = 'SELECT wallet, election_id, from_state, state, time FROM transitions'
+        where = []
+        params = []
+        if wallet is not None:
+            where.append('wallet = ?')
+            params.append(wallet)
+        if election_id is not None:
+            where.append('election_id = ?')
+            params.append(election_id)
+        if len(where) > 0:
+            query += ' WHERE ' + ' AND '.join(where)
+        with self.lock:
+            return self.db.execute(query + ' ORDER BY id', params).fetchall()
+
+    def import_json(self, wallet, folder, printl=print):
+        '''
+        Copies election files of the folder which are not in the store yet, files which cannot be imported are reported
+        :return: (number of imported elections, number of failed files)
+        '''
+        if not wallet:
+            raise ValueError('No wallet address')
+        imported = 0
+        failed = 0
+        for fn in sorted(glob.glob(os.path.join(folder, '*.json'))):
+            if ELECTION_FILE.match(os.path.basename(fn)) is None:
+                continue
+            try:
+                with open(fn, 'r') as f:
+                    election_obj = json.load(f)
+                if 'election_id' not in election_obj or 'state' not in election_obj:
+                    raise ValueError('not an election state')
+                with self.lock:
+                    self.db.execute('BEGIN IMMEDIATE')
+                    try:
+                        if self._get(wallet, election_obj['election_id']) is None:
+                            self._insert(wallet, election_obj, 'imported')
+                            imported += 1
+                        self.db.execute('COMMIT')
+                    except:
+                        if self.db.in_transaction:
+                            self.db.execute('ROLLBACK')
+                        raise
+            except Exception as e:
+                printl('Cannot import %s: %s' % (fn, str(e)))
+                failed += 1
+        return imported, failed
+
+    def close(self):
+        with self.lock:
+            self.db.close()
+
+
+_stores = {}
+_stores_lock = threading.Lock()
+
+
+def store_from_config(store_conf, election_folder):
+    '''
+    Election store configured by "store" config section, SQLite stores of the same file are shared
+    '''
+    if store_conf.get('type', 'json') != 'sqlite':
+        return JsonElectionStore(election_folder)
+    filename = store_conf.get('file', os.path.join(election_folder, 'elections.db'))
+    with _stores_lock:
+        if filename not in _stores:
+            _stores[filename] = SqliteElectionStore(filename)
+        return _stores[filename]
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Election state history')
+    parser.add_argument('command', choices=['history', 'latest', 'import'])
+    parser.add_argument('-c', '--config', default='config.json', help='config file')
+    parser.add_argument('-e', '--election', type=int, help='election id')
+    parser.add_argument('--all', action='store_true', help='all wallets of the store')
+    args = parser.parse_args()
+
+    try:
+        with open(args.config, 'r') as f:
+            config = json.load(f)
+    except Exception as e:
+        print('Cannot load %s: %s' % (args.config, str(e)))
+        sys.exit(1)
+    # wallet address may be in <keysdir>/<hostname>.addr, it is resolved as autoreg.py does
+    path_conf, user_conf, notify_conf, email_conf = utils.check_config(config, True)
+    if path_conf is None:
+        print('Bad config %s' % args.config)
+        sys.exit(1)
+    if not user_conf.get('msig_addr'):
+        print('No wallet address in %s' % args.config)
+        sys.exit(1)
+    wallet = None if args.all else user_conf['msig_addr']
+    election_folder = path_conf['election_folder']
+    store = store_from_config(config.get('store', {}), election_folder)
+
+    if args.command == 'import':
+        if not isinstance(store, SqliteElectionStore):
+            print('Import needs "store": {"type": "sqlite"} in config')
+            sys.exit(1)
+        imported, failed = store.import_json(user_conf['msig_addr'], election_folder)
+        print('Imported %d elections from %s, %d files failed' % (imported, election_folder, failed))
+        store.close()
+        sys.exit(1 if failed > 0 else 0)
+    elif args.command == 'latest':
+        election_obj = store.latest(wallet)
+        if election_obj is not None:
+            print('%d %s' % (election_obj['election_id'], election_obj['state']))
+    else:
+        for w, election_id, from_state, state, tm in store.history(wallet, args.election):
+            when = time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(tm)) if tm is not None else '-'
+            print('%s %s %d %s -> %s' % (when, w or '-', election_id, from_state or '-', state))
+    store.close()
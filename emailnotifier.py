@@ -3,17 +3,42 @@ from email.mime.text import MIMEText
 from email.mime.multipart import MIMEMultipart
 
 class EmailNotifier:
-    def __init__(self, login, password, smtp_server, smtp_port):
+    TIMEOUT = 30
+
+    def __init__(self, login, password, smtp_server, smtp_port, timeout=TIMEOUT, starttls=True, keep_alive=False):
+        '''
+        :param keep_alive: keep SMTP session open for next messages until close()
+        '''
         self.login = login
         self.password = password
         self.smtp_server = smtp_server
         self.smtp_port = smtp_port
+        self.timeout = timeout
+        self.starttls = starttls
+        self.keep_alive = keep_alive
+        self.server = None
 
-    def send(self, address, message, subject='TON validator node notification'):
-        server = smtplib.SMTP(self.smtp_server, self.smtp_port)
-        server.starttls()
-        server.login(self.login, self.password)
+    def _connect(self):
+        server = smtplib.SMTP(self.smtp_server, self.smtp_port, timeout=self.timeout)
+        try:
+            if self.starttls:
+                server.starttls()
+            server.login(self.login, self.password)
+        except:
+            server.close()
+            raise
+        self.server = server
 
+    def close(self):
+        if self.server is None:
+            return
+        try:
+            self.server.quit()
+        except:
+            self.server.close()
+        self.server = None
+
+    def send(self, address, message, subject='TON validator node notification'):
         msg = MIMEMultipart()
         msg['From'] = self.login
         msg['To'] = address
@@ -26,7 +51,19 @@ class EmailNotifier:
 
         sms = msg.as_string()
 
-        server.sendmail(self.login, address, sms)
+        reused = self.server is not None
+        if not reused:
+            self._connect()
+        try:
+            self.server.sendmail(self.login, address, sms)
+        except (smtplib.SMTPServerDisconnected, OSError):
+            # kept session may be closed by server
+            self.close()
+            if not reused:
+                raise
+            self._connect()
+            self.server.sendmail(self.login, address, sms)
 
-        # lastly quit the server
-        server.quit()
+        if not self.keep_alive:
+            # lastly quit the server
+            self.close()
@@ -1,7 +1,52 @@
 import os
 import subprocess
 import json
-import tempfile
+import procstream
+import retry
+import metrics
+import tracing
+import threading
+import queue
+import atexit
+import time
+
+
+def anonymous_output(name):
+    '''
+    Output file for a child process which is never on disk: memfd if supported, pipe otherwise.
+    The pipe is read after the child has finished, so output must fit in the pipe buffer
+    :return: (fd to read, fd to pass to the child)
+    '''
+    if hasattr(os, 'memfd_create'):
+        try:
+            fd = os.memfd_create(name)
+            return fd, fd
+        except OSError:
+            pass
+    return os.pipe()
+
+
+def read_anonymous_output(r, w):
+    '''
+    Reads everything written to anonymous_output and closes it
+    '''
+    try:
+        if r == w:
+            os.lseek(r, 0, os.SEEK_SET)
+        else:
+            os.close(w)
+            w = r
+        data = b''
+        while True:
+            chunk = os.read(r, 65536)
+            if not chunk:
+                return data
+            data += chunk
+    finally:
+        os.close(r)
+        if w != r:
+            os.close(w)
+
 
 class Fift:
     TIMEOUT = 60
@@ -10,28 +55,27 @@ class Fift:
         self.program_path = program_path
         self.includes = includes
 
-    def _evaluate(self, args):
+    def _evaluate(self, args, pass_fds=()):
         '''
         Run fift
         :param args:
+        :param pass_fds: file descriptors inherited by fift
         :return: return value and stdout
         '''
+        timeout = retry.timeout(self.TIMEOUT)
+        start = time.time()
+        timed_out = False
+        params = [self.program_path, '-I', self.includes] + args
         try:
-            params = [self.program_path, '-I', self.includes] + args
-            out = subprocess.check_output(params, timeout=self.TIMEOUT).decode("utf-8")
-            retcode = 0
-        except subprocess.CalledProcessError as e:
-            retcode = e.returncode
-            out = 'Cmd: %s (TIMEOUT %d)\n' % (params, self.TIMEOUT)
-            out += e.output.decode("utf-8")
-        except subprocess.TimeoutExpired as e:
-            retcode = 2
-            out = 'Cmd: %s (TIMEOUT %d)\n' % (params, self.TIMEOUT)
-            out += e.output.decode("utf-8")
+            retcode, out, timed_out = procstream.run(params, timeout, pass_fds=pass_fds)
+            if retcode != 0:
+                out = 'Cmd: %s (TIMEOUT %d)\n' % (params, timeout) + out
         except Exception as e:
             retcode = 1
-            out = 'Cmd: %s (TIMEOUT %d)\n' % (params, self.TIMEOUT)
+            out = 'Cmd: %s (TIMEOUT %d)\n' % (params, timeout)
             out += str(e)
+        metrics.external_call('fift', args, start, retcode, timed_out)
+        tracing.external_call('fift', args, start, retcode)
         return retcode, out
 
     def run(self, contract, *args):
@@ -39,5 +83,195 @@ class Fift:
         retcode, out = self._evaluate(a)
         return retcode == 0, out
 
-    def get_tempfile_name(self, id):
-        return os.path.join(tempfile.gettempdir(), next(tempfile._get_candidate_names()) + "_" + id)
+    def run_output(self, contract, *args):
+        '''
+        Runs script which saves result to the file given by last argument,
+        the file is /dev/fd/N of anonymous_output
+        :return: (success, saved bytes or error text)
+        '''
+        r, w = anonymous_output(os.path.basename(contract))
+        retcode, out = self._evaluate(['-s', contract] + list(args) + ['/dev/fd/%d' % w], (w,))
+        try:
+            data = read_anonymous_output(r, w)
+        except Exception as e:
+            return False, str(e)
+        if retcode != 0:
+            return False, out
+        return True, data
+
+
+class FiftServer(Fift):
+    '''
+    One interactive fift process with preloaded libraries, scripts are included over stdin
+    with command line words $0, $#, $1.. defined for every run. Saved files are written to a pipe
+    '''
+    # Fift.fif is loaded by fift itself
+    PRELOAD = ('Asm.fif', 'TonUtil.fif')
+
+    def __init__(self, program_path, includes):
+        super().__init__(program_path, includes)
+        self.process = None
+        self.lines = None
+        self.output = None
+        self.args_defined = 0
+        self.counter = 0
+        self.lock = threading.Lock()
+        atexit.register(self.stop)
+
+    def _read(self, process, lines):
+        for l in iter(process.stdout.readline, b''):
+            lines.put(l.decode("utf-8", "replace"))
+        lines.put(None)
+
+    def _wait(self, marker, timeout):
+        '''
+        Collects output lines until marker line
+        :return: retcode (2 on timeout, 1 if fift exited) and collected output
+        '''
+        deadline = time.time() + timeout
+        out = ''
+        while True:
+            try:
+                l = self.lines.get(timeout=max(deadline - time.time(), 0))
+            except queue.Empty:
+                return 2, out + 'Timed out\n'
+            if l is None:
+                return 1, out
+            if marker in l:
+                return 0, out
+            # interactive mode prints ok after every line
+            if l.strip() != 'ok':
+                out += l
+
+    def _send(self, text):
+        self.process.stdin.write((text + '\n').encode("utf-8"))
+        self.process.stdin.flush()
+
+    def _drain(self):
+        data = b''
+        while True:
+            try:
+                chunk = os.read(self.output[0], 65536)
+            except BlockingIOError:
+                return data
+            if not chunk:
+                return data
+            data += chunk
+
+    def alive(self):
+        return self.process is not None and self.process.poll() is None
+
+    def start(self):
+        '''
+        Starts fift and loads libraries
+        '''
+        self.stop()
+        timeout = retry.timeout(self.TIMEOUT)
+        self.output = os.pipe()
+        os.set_blocking(self.output[0], False)
+        params = [self.program_path, '-I', self.includes, '-i']
+        try:
+            self.process = subprocess.Popen(params, stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+                                            stderr=subprocess.STDOUT, pass_fds=(self.output[1],))
+        except Exception as e:
+            self.stop()
+            return 1, 'Cmd: %s (TIMEOUT %d)\n%s' % (params, timeout, str(e))
+        self.lines = queue.Queue()
+        threading.Thread(target=self._read, args=(self.process, self.lines), daemon=True).start()
+        self.args_defined = 0
+        preload = ' '.join('"%s" include' % l for l in self.PRELOAD)
+        loaded = ' '.join('over "%s" $= or' % l for l in ('Fift.fif',) + self.PRELOAD)
+        # include skips preloaded libraries, forget? removes command line words of previous run
+        self._send('%s { dup (def?) { (forget) } { drop } cond } : forget? '
+                   '{ false %s { drop } { include } cond } : include ."<<<ready>>>" cr' % (preload, loaded))
+        retcode, out = self._wait('<<<ready>>>', timeout)
+        if retcode != 0:
+            self.stop()
+            return retcode, 'Cmd: %s (TIMEOUT %d)\n%s' % (params, timeout, out)
+        return 0, out
+
+    def stop(self):
+        if self.process is not None:
+            try:
+                if self.process.poll() is None:
+                    self.process.stdin.write(b'bye\n')
+                    self.process.stdin.close()
+                    self.process.wait(timeout=1)
+            except Exception:
+                pass
+            if self.process.poll() is None:
+                self.process.kill()
+                self.process.wait()
+            self.process = None
+        if self.output is not None:
+            for fd in self.output:
+                os.close(fd)
+            self.output = None
+
+    def _evaluate_script(self, contract, args):
+        '''
+        Includes script with command line words set to args
+        :return: return value, stdout
+        '''
+        for a in [contract] + args:
+            if '"' in a or '\n' in a:
+                return 1, 'Bad fift argument %s' % a
+        if not self.alive():
+            retcode, out = self.start()
+            if retcode != 0:
+                return retcode, out
+        timeout = retry.timeout(self.TIMEOUT)
+        self.counter += 1
+        ok = '<<<ok %d>>>' % self.counter
+        done = '<<<done %d>>>' % self.counter
+        words = ' '.join('"$%d" forget?' % n for n in range(1, self.args_defined + 1))
+        words += ' "%s" constant $0 %d constant $# { drop } : :$1..n ' % (contract, len(args))
+        words += ' '.join('"%s" constant $%d' % (a, n + 1) for n, a in enumerate(args))
+        self.args_defined = len(args)
+        try:
+            self._drain()
+            # an error in the script skips the rest of the first line
+            self._send('%s "%s" include ."%s" cr' % (words, contract, ok))
+            self._send('."%s" cr' % done)
+        except Exception as e:
+            self.stop()
+            return 1, 'Cmd: %s %s (TIMEOUT %d)\n%s' % (contract, args, timeout, str(e))
+        retcode, out = self._wait(done, timeout)
+        if retcode != 0:
+            # fift exited (halt in script) or hung, next run starts a new one
+            self.stop()
+            return retcode, 'Cmd: %s %s (TIMEOUT %d)\n%s' % (contract, args, timeout, out)
+        if ok not in out:
+            return 1, 'Cmd: %s %s (TIMEOUT %d)\n%s' % (contract, args, timeout, out)
+        return 0, out.replace(ok, '')
+
+    def run(self, contract, *args):
+        with self.lock:
+            start = time.time()
+            retcode, out = self._evaluate_script(contract, list(args))
+            metrics.external_call('fift', ['-s', contract], start, retcode, retcode == 2)
+            tracing.external_call('fift', ['-s', contract], start, retcode)
+        return retcode == 0, out
+
+    def run_output(self, contract, *args):
+        with self.lock:
+            if not self.alive():
+                retcode, out = self.start()
+                if retcode != 0:
+                    return False, out
+            start = time.time()
+            retcode, out = self._evaluate_script(contract, list(args) + ['/dev/fd/%d' % self.output[1]])
+            metrics.external_call('fift', ['-s', contract], start, retcode, retcode == 2)
+            tracing.external_call('fift', ['-s', contract], start, retcode)
+            if retcode != 0:
+                return False, out
+            return True, self._drain()
+
+
+def fift_from_config(path_conf, payload_conf):
+    '''
+    Selects Fift or FiftServer by "fift_server" option of "payload" config section
+    '''
+    if payload_conf.get('fift_server', False):
+        return FiftServer(path_conf['fift'], path_conf['fift_includes'])
+    return Fift(path_conf['fift'], path_conf['fift_includes'])
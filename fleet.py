@@ -0,0 +1,148 @@
+from tonoscliwrapper import TonosCli
+from tonoscache import TonosCache, CachedTonosCli
+from asynctonoscli import AsyncTonosCli, async_for_backend, run_sync
+from graphqlclient import backend_from_config
+from vecwrapper import ValidatorEngineConsole
+from fiftwrapper import fift_from_config
+from payloads import payloads_from_config
+from electionstore import store_from_config
+from dispatcher import dispatcher_from_config
+from dedupe import dedupe_from_config
+from concurrent.futures import ThreadPoolExecutor
+import asyncio
+import json
+import os
+import sys
+import argparse
+import utils
+import retry
+import metrics
+import tracing
+import autoreg
+from autoreg import printl
+from version import VERSION
+
+
+def load_config(config_file):
+    try:
+        with open(config_file, 'r') as f:
+            return json.load(f)
+    except Exception as e:
+        printl('Cannot load %s: %s' % (config_file, str(e)))
+        return None
+
+
+async def prefetch_shared(at):
+    '''
+    Fetches chain data used by all wallets into the shared cache
+    '''
+    results = await asyncio.gather(at.getconfig(1), at.getconfig(15), at.getconfig(16), at.getconfig(17))
+    res, out = results[0]
+    if not res:
+        print(out)
+        return False
+    res, out = await at.runget('-1:' + out, 'active_election_id')
+    if not res:
+        print(out)
+        return False
+    return True
+
+
+def make_printl(name):
+    def wallet_printl(*args):
+        printl('[%s]' % name, *args)
+    return wallet_printl
+
+
+def run_wallet(name, config, cache, concurrency):
+    '''
+    Registration pass for one wallet of the fleet
+    :return: exit code
+    '''
+    wallet_printl = make_printl(name)
+    path_conf, user_conf, notify_conf, email_conf = utils.check_config(config)
+    if path_conf is None:
+        wallet_printl('Bad config')
+        return 1
+
+    backend = backend_from_config(TonosCli(path_conf['tonos-cli']), config.get('backend', {}))
+    t = CachedTonosCli(backend, cache)
+    at = async_for_backend(t, backend, path_conf['tonos-cli'], concurrency, cache)
+    v = ValidatorEngineConsole(path_conf['validator-engine-console'],
+                               path_conf['client_key'],
+                               path_conf['server_pub_key'],
+                               path_conf['server_url'],
+                               config.get('console', {}).get('sessions', 0))
+    payload_conf = config.get('payload', {})
+    payloads = payloads_from_config(fift_from_config(path_conf, payload_conf), path_conf, payload_conf)
+    store = store_from_config(config.get('store', {}), path_conf['election_folder'])
+    try:
+        with retry.deadline_scope(retry.run_deadline()), tracing.span('register', wallet=user_conf['msig_addr'], config=name):
+            return autoreg.register(t, at, v, payloads, store, path_conf, user_conf, notify_conf, email_conf, wallet_printl)
+    finally:
+        utils.flush_digests(notify_conf, email_conf)
+        v.close()
+
+
+if __name__ == '__main__':
+    printl('TON Autoreg fleet version %s started with args %s' % (VERSION, sys.argv))
+
+    parser = argparse.ArgumentParser(description='Registration of many validator wallets in TON elections')
+    parser.add_argument('config', nargs='?', default='config.fleet.json', help='fleet config file')
+    parser.add_argument('--trace', help='append spans of wallet registrations and external calls to JSON lines file')
+    parser.add_argument('--chrome-trace', help='write spans to file in Chrome trace event format')
+    args = parser.parse_args()
+
+    if args.trace or args.chrome_trace:
+        tracing.configure(args.trace, args.chrome_trace)
+
+    printl('Using %s' % args.config)
+    fleet_conf = load_config(args.config)
+    if fleet_conf is None:
+        exit(1)
+
+    wallets = []
+    for n, item in enumerate(fleet_conf.get('configs', [])):
+        if isinstance(item, str):
+            wallets.append((os.path.splitext(os.path.basename(item))[0], load_config(item)))
+        else:
+            wallets.append((item.get('name', 'wallet%d' % n), item))
+    if len(wallets) == 0 or any(config is None for name, config in wallets):
+        printl('No wallet configs')
+        exit(1)
+
+    retry.configure(fleet_conf.get('retry', {}))
+    election_folder = wallets[0][1].get('path', {}).get('election_folder', './')
+    metrics.configure(fleet_conf.get('metrics', {}), election_folder)
+    credentials = [(config.get('notifications', {}), config.get('email', {})) for name, config in wallets]
+    utils.install_dispatcher(dispatcher_from_config(fleet_conf.get('dispatcher', {}), election_folder, credentials))
+    utils.install_dedupe(dedupe_from_config(fleet_conf.get('dedupe', {}), election_folder))
+    concurrency = fleet_conf.get('tonos-cli', {}).get('concurrency', AsyncTonosCli.CONCURRENCY)
+    cache_conf = fleet_conf.get('cache', {})
+    cache = TonosCache(cache_conf.get('file'), cache_conf.get('ttl'))
+
+    printl('Fetching shared chain data')
+    first = wallets[0][1]
+    tonos_cli = first.get('path', {}).get('tonos-cli', 'tonos-cli')
+    backend = backend_from_config(TonosCli(tonos_cli), first.get('backend', {}))
+    at = async_for_backend(CachedTonosCli(backend, cache), backend, tonos_cli, concurrency, cache)
+    if not run_sync(prefetch_shared(at)):
+        printl('Cannot fetch shared chain data')
+        exit(1)
+
+    results = {}
+    with ThreadPoolExecutor(max_workers=fleet_conf.get('workers', 4)) as executor:
+        futures = [(name, executor.submit(run_wallet, name, config, cache, concurrency)) for name, config in wallets]
+        for name, future in futures:
+            try:
+                results[name] = future.result()
+            except Exception as e:
+                printl('[%s] Failed: %s' % (name, str(e)))
+                results[name] = 1
+
+    printl('Results: %s' % results)
+    for name, res in results.items():
+        metrics.run_finished('fleet', res)
+    metrics.flush()
+    printl('Cache stats: %s' % cache.stats())
+    exit(0 if all(res == 0 for res in results.values()) else 1)
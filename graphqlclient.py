@@ -0,0 +1,103 @@
+import retry
+
+
+class GraphQLTonosCli:
+    '''
+    Read backend with TonosCli method signatures which queries DApp server GraphQL endpoint
+    over pooled keep-alive connections. Get-methods and contract calls need TVM and are passed to tonos-cli
+    '''
+    TIMEOUT = 30
+
+    # config param fields with the same names and formats as tonos-cli getconfig output
+    CONFIG_FIELDS = {
+        1: None,
+        15: 'validators_elected_for elections_start_before elections_end_before stake_held_for',
+        16: 'max_validators max_main_validators min_validators',
+        17: 'min_stake(format: DEC) max_stake(format: DEC) min_total_stake(format: DEC) max_stake_factor',
+        34: 'utime_since utime_until total main total_weight(format: DEC)',
+    }
+    ACCOUNT_ACTIVE = 1
+
+    def __init__(self, url, fallback, pool_size=4):
+        '''
+        :param url: GraphQL endpoint, e.g. https://main.ton.dev/graphql
+        :param fallback: TonosCli for methods which cannot be done with GraphQL
+        :param pool_size: max number of kept connections
+        '''
+        self.url = url
+        self.fallback = fallback
+        import requests
+        from requests.adapters import HTTPAdapter
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+
+    def __getattr__(self, name):
+        return getattr(self.fallback, name)
+
+    def _query(self, query, variables=None):
+        '''
+        :return: (success, data or error text)
+        '''
+        timeout = retry.timeout(self.TIMEOUT)
+        try:
+            r = self.session.post(self.url, json={'query': query, 'variables': variables or {}}, timeout=timeout)
+            r.raise_for_status()
+            obj = r.json()
+        except Exception as e:
+            return False, 'Query: %s (TIMEOUT %d)\n%s' % (query, timeout, str(e))
+        if 'errors' in obj or 'data' not in obj:
+            return False, 'Query: %s\nErrors: %s' % (query, obj.get('errors'))
+        return True, obj['data']
+
+    def getconfig(self, index):
+        '''
+        Get global config from the last key block
+        :param index: index if config
+        :return: (success, obj)
+        '''
+        if index not in self.CONFIG_FIELDS:
+            return self.fallback.getconfig(index)
+        fields = self.CONFIG_FIELDS[index]
+        param = 'p%d' % index if fields is None else 'p%d { %s }' % (index, fields)
+        query = 'query { blocks(filter: {workchain_id: {eq: -1}, key_block: {eq: true}}, ' \
+                'orderBy: [{path: "seq_no", direction: DESC}], limit: 1) { master { config { %s } } } }' % param
+        res, data = self._query(query)
+        if not res:
+            return False, data
+        try:
+            obj = data['blocks'][0]['master']['config']['p%d' % index]
+            if obj is None:
+                raise ValueError('no p%d in config' % index)
+            return True, obj
+        except Exception as e:
+            return False, 'Output parsing error: ' + str(e) + '\nQuery output: ' + str(data)
+
+    def account(self, addr):
+        query = 'query($addr: String) { accounts(filter: {id: {eq: $addr}}) { acc_type balance(format: DEC) } }'
+        res, data = self._query(query, {'addr': addr})
+        if not res:
+            return False, data
+        res = {
+            'active': False,
+            'balance': 0
+        }
+        try:
+            if len(data['accounts']) > 0:
+                acc = data['accounts'][0]
+                res['active'] = acc['acc_type'] == self.ACCOUNT_ACTIVE
+                res['balance'] = int(acc['balance'])
+            return True, res
+        except Exception as e:
+            return False, 'Output parsing error: ' + str(e) + '\nQuery output: ' + str(data)
+
+
+def backend_from_config(t, backend_conf):
+    '''
+    Selects read backend by "backend" config section
+    :param t: TonosCli
+    '''
+    if backend_conf.get('type', 'tonos-cli') == 'graphql':
+        return GraphQLTonosCli(backend_conf['url'], t, backend_conf.get('pool_size', 4))
+    return t
@@ -0,0 +1,232 @@
+import fcntl
+import json
+import os
+import threading
+import tempfile
+import time
+
+# latency buckets of external calls, seconds
+BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 320.0)
+
+METRICS = {
+    'tonautoreg_external_calls_total': ('counter', 'External program calls by tool, command and exit code'),
+    'tonautoreg_external_call_duration_seconds': ('histogram', 'Duration of external program calls'),
+    'tonautoreg_external_call_timeouts_total': ('counter', 'External program calls killed by timeout'),
+    'tonautoreg_registrations_total': ('counter', 'Outcomes of registration attempts'),
+    'tonautoreg_time_to_registration_seconds': ('gauge', 'Seconds from elections start to registration found in participant list'),
+    'tonautoreg_runs_total': ('counter', 'Finished runs by script and exit code'),
+    'tonautoreg_last_run_timestamp_seconds': ('gauge', 'Time of the last finished run'),
+}
+
+
+class Registry:
+    '''
+    Counters, gauges and histograms in Prometheus text format.
+    Counters can be accumulated across runs in a JSON state file, so textfile of cron runs keeps growing
+    '''
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        # (sample name, sorted labels) -> value
+        self.values = {}
+        # changes not saved to state file yet: counters as increments, gauges as values
+        self.counters = {}
+        self.gauges = {}
+
+    @staticmethod
+    def _key(name, labels):
+        return name, tuple(sorted(labels.items()))
+
+    def inc(self, name, labels, value=1):
+        key = self._key(name, labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + value
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def set(self, name, labels, value):
+        key = self._key(name, labels)
+        with self.lock:
+            self.values[key] = value
+            self.gauges[key] = value
+
+    def observe(self, name, labels, value, buckets=BUCKETS):
+        for b in buckets:
+            self.inc(name + '_bucket', dict(labels, le=str(b)), 1 if value <= b else 0)
+        self.inc(name + '_bucket', dict(labels, le='+Inf'))
+        self.inc(name + '_sum', labels, value)
+        self.inc(name + '_count', labels)
+
+    def merge(self, filename):
+        '''
+        Adds unsaved changes to state file and takes totals from it
+        '''
+        with open(filename + '.lock', 'a') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                with open(filename, 'r') as f:
+                    state = {(s[0], tuple(tuple(l) for l in s[1])): s[2] for s in json.load(f)}
+            except:
+                state = {}
+            with self.lock:
+                for key, value in self.counters.items():
+                    state[key] = state.get(key, 0) + value
+                state.update(self.gauges)
+                self.counters = {}
+                self.gauges = {}
+                self.values = state
+            _save(filename, json.dumps([[k[0], k[1], v] for k, v in state.items()]))
+
+    @staticmethod
+    def _order(sample):
+        (name, labels), value = sample
+        # histogram buckets in ascending order
+        return [l for l in labels if l[0] != 'le'], name, [float(v) for k, v in labels if k == 'le']
+
+    def render(self):
+        '''
+        :return: metrics in Prometheus text exposition format
+        '''
+        with self.lock:
+            values = dict(self.values)
+        lines = []
+        for metric, (kind, help) in sorted(METRICS.items()):
+            samples = sorted(((k, v) for k, v in values.items()
+                              if k[0] == metric or (kind == 'histogram' and k[0].rsplit('_', 1)[0] == metric)),
+                             key=self._order)
+            if len(samples) == 0:
+                continue
+            lines.append('# HELP %s %s' % (metric, help))
+            lines.append('# TYPE %s %s' % (metric, kind))
+            for (name, labels), value in samples:
+                text = ','.join('%s="%s"' % (k, str(v).replace('\\', '\\\\').replace('"', '\\"')) for k, v in labels)
+                lines.append('%s{%s} %s' % (name, text, repr(float(value)) if isinstance(value, float) else value))
+        return '\n'.join(lines) + '\n'
+
+
+def _save(filename, data):
+    '''
+    Atomic write readable by node_exporter running as another user
+    '''
+    with tempfile.NamedTemporaryFile('w', dir=os.path.dirname(os.path.abspath(filename)), delete=False) as tf:
+        tf.write(data)
+        tempname = tf.name
+    os.chmod(tempname, 0o644)
+    os.rename(tempname, filename)
+
+
+REGISTRY = Registry()
+_conf = {}
+
+
+def command_name(tool, args):
+    '''
+    Subcommand label of external call, e.g. "runget active_election_id" or "getconfig 15"
+    '''
+    if len(args) == 0:
+        return ''
+    if tool == 'tonos-cli':
+        if args[0] in ('run', 'call') and len(args) > 4:
+            return '%s %s' % (args[0], args[4])
+        if args[0] == 'runget' and len(args) > 2:
+            return 'runget %s' % args[2]
+        if args[0] == 'getconfig' and len(args) > 1:
+            return 'getconfig %s' % args[1]
+        return args[0]
+    if tool == 'fift':
+        return os.path.basename(args[1]) if args[0] == '-s' and len(args) > 1 else args[0]
+    if tool == 'validator-engine-console':
+        return args[0].split(' ')[0] if len(args) == 1 else 'batch'
+    return args[0]
+
+
+def external_call(tool, args, start, retcode, timed_out=False):
+    '''
+    Records call of tonos-cli, validator-engine-console or fift
+    :param args: command line arguments of the call
+    :param start: time.time() before the call
+    '''
+    try:
+        labels = {'tool': tool, 'command': command_name(tool, args)}
+        REGISTRY.inc('tonautoreg_external_calls_total', dict(labels, exit_code=str(retcode)))
+        REGISTRY.observe('tonautoreg_external_call_duration_seconds', labels, time.time() - start)
+        if timed_out:
+            REGISTRY.inc('tonautoreg_external_call_timeouts_total', labels)
+    except:
+        pass
+
+
+def registration(wallet, outcome, election_obj=None):
+    '''
+    Records outcome of registration attempt, "registered" also sets time to registration of the election
+    '''
+    REGISTRY.inc('tonautoreg_registrations_total', {'wallet': wallet, 'outcome': outcome})
+    if outcome == 'registered' and election_obj is not None and 'elections_start_tm' in election_obj:
+        REGISTRY.set('tonautoreg_time_to_registration_seconds',
+                     {'wallet': wallet, 'election_id': str(election_obj['election_id'])},
+                     max(time.time() - election_obj['elections_start_tm'], 0))
+
+
+def run_finished(script, exit_code):
+    REGISTRY.inc('tonautoreg_runs_total', {'script': script, 'exit_code': str(exit_code)})
+    REGISTRY.set('tonautoreg_last_run_timestamp_seconds', {'script': script}, time.time())
+
+
+def configure(metrics_conf, election_folder):
+    '''
+    Sets export from "metrics" config section
+    '''
+    _conf.clear()
+    _conf.update(metrics_conf)
+    _conf.setdefault('state', os.path.join(election_folder, 'metrics.json'))
+
+
+def flush():
+    '''
+    Saves counters to state file and writes textfile for node_exporter if "textfile" is set
+    '''
+    if not _conf.get('textfile'):
+        return
+    try:
+        REGISTRY.merge(_conf['state'])
+        _save(_conf['textfile'], REGISTRY.render())
+    except Exception as e:
+        print('Cannot write metrics to %s: %s' % (_conf['textfile'], str(e)))
+
+
+def serve():
+    '''
+    Starts /metrics HTTP endpoint if "port" is set, for daemon and watch modes
+    :return: server or None
+    '''
+    if not _conf.get('port'):
+        return None
+    # http.server is loaded only by long running modes
+    from http.server import HTTPServer, BaseHTTPRequestHandler
+    from socketserver import ThreadingMixIn
+
+    class MetricsServer(ThreadingMixIn, HTTPServer):
+        daemon_threads = True
+
+    class MetricsHandler(BaseHTTPRequestHandler):
+
+        def do_GET(self):
+            if self.path.split('?')[0] != '/metrics':
+                self.send_error(404)
+                return
+            body = REGISTRY.render().encode('utf-8')
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    try:
+        server = MetricsServer((_conf.get('address', '127.0.0.1'), _conf['port']), MetricsHandler)
+    except Exception as e:
+        print('Cannot start metrics server: %s' % str(e))
+        return None
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
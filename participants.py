@@ -0,0 +1,133 @@
+import hashlib
+import json
+import os
+import re
+import threading
+import utils
+
+TOKEN = re.compile(r'\s*(?:(\[)|(\])|(,)|"((?:[^"\\]|\\.)*)"|(null)|(true|false)|(-?\d+(?:\.\d+)?(?:[eE][+-]?\d+)?))')
+
+
+def loads_lists(text):
+    '''
+    Non-recursive parser of json arrays of strings, numbers, booleans and nulls.
+    Nesting depth is not limited, unlike json.loads
+    '''
+    stack = [[]]
+    pos = 0
+    end = len(text.rstrip())
+    while pos < end:
+        m = TOKEN.match(text, pos)
+        if m is None:
+            raise ValueError('Unexpected symbol at %d' % pos)
+        pos = m.end()
+        open_, close, comma, string, null, boolean, number = m.groups()
+        if open_:
+            stack.append([])
+        elif close:
+            if len(stack) < 2:
+                raise ValueError('Unexpected ] at %d' % pos)
+            l = stack.pop()
+            stack[-1].append(l)
+        elif comma:
+            continue
+        elif string is not None:
+            stack[-1].append(json.loads('"%s"' % string) if '\\' in string else string)
+        elif null:
+            stack[-1].append(None)
+        elif boolean:
+            stack[-1].append(boolean == 'true')
+        else:
+            stack[-1].append(json.loads(number))
+    if len(stack) != 1 or len(stack[0]) != 1:
+        raise ValueError('Unbalanced brackets')
+    return stack[0][0]
+
+
+def participant_index(obj):
+    '''
+    Converts participant_list result [[[pubkey, stake], [[pubkey, stake], ... null]]] to {pubkey: stake}
+    '''
+    index = {}
+    node = obj[0]
+    while node is not None:
+        participant, node = node[0], node[1]
+        index[int(participant[0], 0)] = int(participant[1], 0)
+    return index
+
+
+def extended_participants(obj):
+    '''
+    Converts participant_list_extended result [elect_at, elect_close, min_stake, total_stake,
+    [[pubkey, [stake, max_factor, addr, adnl_addr]], ... null], failed, finished] to {pubkey: (stake, max_factor)}
+    '''
+    index = {}
+    node = obj[4]
+    while node is not None:
+        participant, node = node[0], node[1]
+        index[int(participant[0], 0)] = (int(participant[1][0], 0), int(participant[1][1], 0))
+    return index
+
+
+class ParticipantSnapshots:
+    '''
+    participant_list indexes stored per election with hash of the list,
+    the list is parsed again only if it has changed
+    '''
+
+    def __init__(self, folder=None):
+        '''
+        :param folder: folder for participants_<election id>.json files, None keeps snapshots in memory
+        '''
+        self.folder = folder
+        self.lock = threading.Lock()
+        self.memory = {}
+
+    def _filename(self, election_id):
+        return os.path.join(self.folder, 'participants_%d.json' % election_id)
+
+    def _load(self, election_id, digest):
+        try:
+            with open(self._filename(election_id), 'r') as f:
+                snapshot = json.load(f)
+            if snapshot['hash'] == digest:
+                return {int(k, 16): v for k, v in snapshot['index'].items()}
+        except:
+            pass
+        return None
+
+    def index(self, election_id, text):
+        '''
+        :param text: raw participant_list result
+        :return: {pubkey int: stake int}
+        '''
+        digest = hashlib.sha256(text.encode("utf-8")).hexdigest()
+        with self.lock:
+            snapshot = self.memory.get(election_id)
+            if snapshot is not None and snapshot[0] == digest:
+                return snapshot[1]
+
+        index = None
+        if self.folder is not None and election_id is not None:
+            index = self._load(election_id, digest)
+        if index is None:
+            index = participant_index(loads_lists(text))
+            if self.folder is not None and election_id is not None:
+                data = {'hash': digest, 'index': {'%064x' % k: v for k, v in index.items()}}
+                utils.save_atomic(self._filename(election_id), json.dumps(data))
+
+        with self.lock:
+            self.memory[election_id] = (digest, index)
+        return index
+
+
+_snapshots = {}
+
+
+def snapshots(folder=None):
+    '''
+    Shared ParticipantSnapshots of the folder
+    '''
+    if folder not in _snapshots:
+        _snapshots[folder] = ParticipantSnapshots(folder)
+    return _snapshots[folder]
@@ -0,0 +1,66 @@
+import boc
+
+
+class FiftPayloads:
+    '''
+    Election and recover stake payloads made by fift scripts
+    '''
+
+    def __init__(self, fift, path_conf):
+        self.fift = fift
+        self.path_conf = path_conf
+
+    def _run(self, script, *args):
+        return self.fift.run_output(self.path_conf[script], *args)
+
+    def election_request(self, wallet_addr, election_id, max_factor, adnl_addr):
+        '''
+        :return: (success, bytes to sign)
+        '''
+        return self._run('validator-elect-req', wallet_addr, str(election_id), str(max_factor), adnl_addr)
+
+    def election_query(self, wallet_addr, election_id, max_factor, adnl_addr, public_key, signature):
+        '''
+        :return: (success, BOC of signed election request)
+        '''
+        return self._run('validator-elect-signed', wallet_addr, str(election_id), str(max_factor), adnl_addr, public_key, signature)
+
+    def recover_query(self):
+        '''
+        :return: (success, BOC of recover stake request)
+        '''
+        return self._run('recover-stake')
+
+
+class NativePayloads:
+    '''
+    The same payloads serialized in-process by boc module
+    '''
+
+    def election_request(self, wallet_addr, election_id, max_factor, adnl_addr):
+        try:
+            return True, boc.validator_elect_req(wallet_addr, election_id, str(max_factor), adnl_addr)
+        except Exception as e:
+            return False, str(e)
+
+    def election_query(self, wallet_addr, election_id, max_factor, adnl_addr, public_key, signature):
+        try:
+            return True, boc.validator_elect_signed(wallet_addr, election_id, str(max_factor), adnl_addr, public_key, signature)
+        except Exception as e:
+            return False, str(e)
+
+    def recover_query(self):
+        try:
+            return True, boc.recover_stake()
+        except Exception as e:
+            return False, str(e)
+
+
+def payloads_from_config(fift, path_conf, payload_conf):
+    '''
+    Selects payload builder by "payload" config section
+    :param fift: Fift or FiftServer
+    '''
+    if payload_conf.get('builder', 'fift') == 'native':
+        return NativePayloads()
+    return FiftPayloads(fift, path_conf)
@@ -0,0 +1,217 @@
+import os
+import re
+import selectors
+import subprocess
+import time
+
+# output kept in memory, the program is stopped when it prints more
+MAX_OUTPUT = 16 * 1024 * 1024
+# output kept for error messages
+TAIL_SIZE = 16 * 1024
+CHUNK = 65536
+
+# return codes of stopped programs, 2 is the timeout code of all wrappers
+TIMEOUT = 2
+OVERFLOW = 3
+
+_JSON_TOKEN = re.compile(rb'["\[\]{}\n]')
+_STRING_TOKEN = re.compile(rb'["\\]')
+
+
+class JsonAfter:
+    '''
+    Finds the end of JSON value printed after marker, e.g. "Result: " of tonos-cli or "Config p15: "
+    '''
+
+    def __init__(self, marker):
+        self.marker = marker.encode('utf-8')
+        self.pos = 0
+        self.found = False
+        self.depth = 0
+        self.string = False
+        # scalar value started at depth 0
+        self.scalar = False
+
+    def __call__(self, data):
+        '''
+        :param data: output read so far
+        :return: end of the value in data or None if it has not arrived yet
+        '''
+        if not self.found:
+            i = data.find(self.marker, max(self.pos - len(self.marker) + 1, 0))
+            if i < 0:
+                self.pos = len(data)
+                return None
+            self.found = True
+            self.pos = i + len(self.marker)
+        while self.pos < len(data):
+            if self.string:
+                m = _STRING_TOKEN.search(data, self.pos)
+                if m is None:
+                    self.pos = len(data)
+                    return None
+                if m.group() == b'\\':
+                    if m.end() >= len(data):
+                        # escaped character has not arrived yet
+                        self.pos = m.start()
+                        return None
+                    self.pos = m.end() + 1
+                    continue
+                self.pos = m.end()
+                self.string = False
+                if self.depth == 0:
+                    return self.pos
+                continue
+            if self.depth == 0 and not self.scalar:
+                c = data[self.pos:self.pos + 1]
+                if c.isspace():
+                    self.pos += 1
+                    continue
+                if c not in (b'"', b'[', b'{'):
+                    self.scalar = True
+            m = _JSON_TOKEN.search(data, self.pos)
+            if m is None:
+                self.pos = len(data)
+                return None
+            self.pos = m.end()
+            c = m.group()
+            if c == b'"':
+                self.string = True
+            elif c in (b'[', b'{'):
+                self.depth += 1
+            elif c in (b']', b'}'):
+                self.depth -= 1
+                if self.depth == 0:
+                    return self.pos
+            elif self.depth == 0 and self.scalar:
+                # number, true, false or null ends with the line
+                return self.pos
+        return None
+
+
+class Lines:
+    '''
+    Feeds complete lines to check(line) until it returns 0, e.g. result checker of console commands
+    '''
+
+    def __init__(self, check):
+        self.check = check
+        self.pos = 0
+
+    def __call__(self, data):
+        while True:
+            i = data.find(b'\n', self.pos)
+            if i < 0:
+                return None
+            line = bytes(data[self.pos:i + 1]).decode('utf-8', errors='replace')
+            self.pos = i + 1
+            if self.check(line) == 0:
+                return self.pos
+
+
+class OutputReader:
+    '''
+    Collects output of a program chunk by chunk up to max size,
+    tells when the needed part has arrived and keeps the tail for error messages
+    '''
+
+    def __init__(self, done=None, max_output=MAX_OUTPUT, tail_size=TAIL_SIZE):
+        '''
+        :param done: function(data) returning end of the needed output in data or None, None reads until EOF
+        '''
+        self.done = done
+        self.max_output = max_output
+        self.tail_size = tail_size
+        self.data = bytearray()
+        self.end = None
+        self.overflow = False
+
+    def feed(self, chunk):
+        '''
+        :return: True if the rest of output is not needed
+        '''
+        if len(self.data) + len(chunk) > self.max_output:
+            self.data += chunk[:self.max_output - len(self.data)]
+            self.overflow = True
+            return True
+        self.data += chunk
+        if self.done is not None:
+            self.end = self.done(self.data)
+        return self.end is not None
+
+    def output(self):
+        data = self.data if self.end is None else self.data[:self.end]
+        return bytes(data).decode('utf-8', errors='replace')
+
+    def tail(self):
+        '''
+        End of output for error messages
+        '''
+        text = bytes(self.data[-self.tail_size:]).decode('utf-8', errors='replace')
+        if len(self.data) > self.tail_size:
+            text = '... %d bytes skipped ...\n' % (len(self.data) - self.tail_size) + text
+        if self.overflow:
+            text = 'Output exceeds %d bytes\n' % self.max_output + text
+        return text
+
+    def result(self, retcode, timed_out=False):
+        '''
+        :return: (retcode, output, timed_out) where output is the tail if the program failed or was stopped
+        '''
+        if self.end is not None:
+            return 0, self.output(), False
+        if self.overflow:
+            return OVERFLOW, self.tail(), False
+        if timed_out:
+            return TIMEOUT, 'Timed out\n' + self.tail(), True
+        if retcode != 0:
+            return retcode, self.tail(), False
+        return 0, self.output(), False
+
+
+def _stop(process):
+    if process.poll() is None:
+        process.kill()
+    process.wait()
+
+
+def run(params, timeout, done=None, max_output=MAX_OUTPUT, pass_fds=()):
+    '''
+    Runs program and reads its stdout as it arrives.
+    The program is killed on timeout, when output exceeds max_output and as soon as done finds the needed output,
+    so done must be given only for commands without side effects
+    :param done: function(data) returning end of the needed output or None, e.g. JsonAfter('Result: ')
+    :return: (retcode, output, timed_out): retcode is TIMEOUT or OVERFLOW if the program was stopped,
+             output is cut at the end of the needed part, on errors only the tail is kept
+    '''
+    reader = OutputReader(done, max_output)
+    deadline = time.time() + timeout
+    process = subprocess.Popen(params, stdout=subprocess.PIPE, pass_fds=pass_fds)
+    try:
+        fd = process.stdout.fileno()
+        with selectors.DefaultSelector() as selector:
+            selector.register(fd, selectors.EVENT_READ)
+            while True:
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    _stop(process)
+                    return reader.result(TIMEOUT, True)
+                if len(selector.select(remaining)) == 0:
+                    continue
+                chunk = os.read(fd, CHUNK)
+                if not chunk or reader.feed(chunk):
+                    break
+        if reader.end is not None or reader.overflow:
+            _stop(process)
+            return reader.result(process.returncode)
+        try:
+            process.wait(max(deadline - time.time(), 0.01))
+        except subprocess.TimeoutExpired:
+            _stop(process)
+            return reader.result(TIMEOUT, True)
+        return reader.result(process.returncode)
+    except BaseException:
+        _stop(process)
+        raise
+    finally:
+        process.stdout.close()
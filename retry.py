@@ -0,0 +1,175 @@
+import random
+import re
+import threading
+import time
+from contextlib import contextmanager
+
+PERMANENT = 'permanent'
+TRANSIENT = 'transient'
+
+# errors which will not disappear on retry
+PERMANENT_PATTERNS = [re.compile(p, re.IGNORECASE) for p in [
+    r'failed to (load|read) key',
+    r'invalid (key|seed|phrase|mnemonic|signature|address|abi)',
+    r'not enough (balance|tokens)',
+    r'insufficient (balance|funds)',
+    r'account (not found|does not exist)',
+    r'\babi\b.*(not found|error)',
+    # SafeMultisig errors: not a custodian, no transaction, already confirmed, low value...
+    r'exit.?code"?:?\s*1[0-9][0-9]\b',
+]]
+
+# errors worth to retry even if permanent patterns matched
+TRANSIENT_PATTERNS = [re.compile(p, re.IGNORECASE) for p in [
+    r'\btimeout\b|timed out',
+    r'message expired',
+    r'connection (refused|reset|error)',
+    r'network|temporarily|unavailable',
+]]
+
+_local = threading.local()
+
+
+class Deadline:
+    '''
+    Moment when the whole run must be finished
+    '''
+
+    def __init__(self, seconds):
+        self.expire = time.time() + seconds
+
+    def remaining(self):
+        return self.expire - time.time()
+
+    def expired(self):
+        return self.remaining() <= 0
+
+
+@contextmanager
+def deadline_scope(deadline):
+    '''
+    Limits timeouts of external calls made in this thread by deadline
+    '''
+    previous = getattr(_local, 'deadline', None)
+    _local.deadline = deadline
+    try:
+        yield deadline
+    finally:
+        _local.deadline = previous
+
+
+def current_deadline():
+    return getattr(_local, 'deadline', None)
+
+
+def timeout(default):
+    '''
+    Timeout for external call limited by the deadline of this thread
+    '''
+    deadline = current_deadline()
+    if deadline is None:
+        return default
+    return max(min(default, deadline.remaining()), 0.01)
+
+
+def classify(out):
+    '''
+    Tells permanent errors from transient ones by output of failed call
+    :return: PERMANENT or TRANSIENT
+    '''
+    # skip command line of wrappers error message
+    out = re.sub(r'^Cmd: .*\n', '', str(out))
+    if any(p.search(out) for p in TRANSIENT_PATTERNS):
+        return TRANSIENT
+    if any(p.search(out) for p in PERMANENT_PATTERNS):
+        return PERMANENT
+    return TRANSIENT
+
+
+class RetryPolicy:
+    '''
+    Exponential backoff with jitter limited by number of tries and deadline
+    '''
+
+    def __init__(self, tries=30, base_delay=1.0, max_delay=60.0, jitter=0.5, deadline=None):
+        '''
+        :param deadline: Deadline, by default the deadline of current thread
+        '''
+        self.tries = tries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.jitter = jitter
+        self.deadline = deadline
+
+    def delay(self, n):
+        d = min(self.max_delay, self.base_delay * (2 ** n))
+        return d * (1 - self.jitter * random.random())
+
+    def run(self, call, succeeded=lambda res, out: res, printl=print):
+        '''
+        Calls call(n) until succeeded(res, out), permanent error, tries or deadline are exhausted
+        :param call: function(try number) returning (res, out)
+        :return: (success, out of last try)
+        '''
+        deadline = self.deadline or current_deadline()
+        res, out = False, 'No tries'
+        for n in range(self.tries):
+            if deadline is not None and deadline.expired():
+                printl('Deadline exceeded')
+                break
+            res, out = call(n)
+            if succeeded(res, out):
+                return True, out
+            if classify(out) == PERMANENT:
+                printl('Permanent error, not retrying')
+                break
+            if n + 1 == self.tries:
+                break
+            d = self.delay(n)
+            if deadline is not None and deadline.remaining() < d:
+                printl('Deadline exceeded')
+                break
+            time.sleep(d)
+        return False, out
+
+
+# defaults of RetryPolicy set from "retry" config section
+_defaults = {
+    'base_delay': 1.0,
+    'max_delay': 60.0,
+    'jitter': 0.5,
+    'deadline': 1800,
+    'transaction_deadline': 600,
+}
+
+
+def configure(retry_conf):
+    for k in _defaults:
+        if k in retry_conf:
+            _defaults[k] = retry_conf[k]
+
+
+def policy(tries):
+    '''
+    RetryPolicy with configured delays and deadline of current thread
+    '''
+    return RetryPolicy(tries, _defaults['base_delay'], _defaults['max_delay'], _defaults['jitter'])
+
+
+def run_deadline():
+    '''
+    New deadline for one run
+    '''
+    return Deadline(_defaults['deadline'])
+
+
+def transaction_deadline(parent=None):
+    '''
+    Deadline for one of transactions sent in parallel, not later than the deadline of the run
+    :param parent: Deadline of the run, by default the deadline of current thread
+    '''
+    deadline = Deadline(_defaults['transaction_deadline'])
+    parent = parent or current_deadline()
+    if parent is not None:
+        deadline.expire = min(deadline.expire, parent.expire)
+    return deadline
@@ -0,0 +1,110 @@
+import heapq
+import time
+
+
+class TimerHeap:
+    '''
+    Timers ordered by wake up time
+    '''
+
+    def __init__(self):
+        self.heap = []
+        self.counter = 0
+
+    def push(self, when, name):
+        self.counter += 1
+        heapq.heappush(self.heap, (when, self.counter, name))
+
+    def clear(self):
+        self.heap = []
+
+    def next_time(self):
+        if len(self.heap) == 0:
+            return None
+        return self.heap[0][0]
+
+    def pop(self):
+        '''
+        Sleeps until the earliest timer, timers due at the same time are merged
+        :return: (when, names)
+        '''
+        when, n, name = heapq.heappop(self.heap)
+        names = [name]
+        while len(self.heap) > 0 and self.heap[0][0] <= when:
+            names.append(heapq.heappop(self.heap)[2])
+        delay = when - time.time()
+        if delay > 0:
+            time.sleep(delay)
+        return when, names
+
+
+def plan_wakeups(now, active_election_id, config15, config34, registered, poll_interval, idle_interval):
+    '''
+    Computes moments when something can happen in elections
+    :param active_election_id: id of active election or 0
+    :param config15: {'elections_start_before', 'elections_end_before', 'validators_elected_for', 'stake_held_for'}
+    :param config34: current validator set {'utime_since', 'utime_until', ...}
+    :param registered: True if we are already registered in active election
+    :return: list of (time, name)
+    '''
+    wakeups = [(now + idle_interval, 'heartbeat')]
+    if active_election_id != 0:
+        elections_end = active_election_id - config15['elections_end_before']
+        if registered and elections_end > now:
+            wakeups.append((elections_end, 'elections end'))
+        else:
+            # registration window or elections are being finished by elector
+            wakeups.append((now + poll_interval, 'election poll'))
+        return wakeups
+
+    # next elections start before the end of current validation round
+    elections_start = config34['utime_until'] - config15['elections_start_before']
+    if elections_start > now:
+        wakeups.append((elections_start, 'elections start'))
+    elif now < elections_start + poll_interval or config34['utime_until'] <= now:
+        # elector announces elections on the next tick, new validator set is about to be seen
+        wakeups.append((now + poll_interval, 'election poll'))
+    else:
+        # elections of this round are over, next ones are planned from the next validator set
+        wakeups.append((config34['utime_until'], 'validation round end'))
+    return wakeups
+
+
+def plan_stake_recovery(now, elections, poll_interval):
+    '''
+    Moments when frozen stakes of saved elections can be returned
+    :param elections: saved election objects
+    :return: list of (time, name)
+    '''
+    wakeups = []
+    for election_obj in elections:
+        unfreeze_tm = election_obj.get('stake_held_for_tm')
+        if unfreeze_tm is None:
+            continue
+        if unfreeze_tm + poll_interval > now:
+            wakeups.append((unfreeze_tm + poll_interval, 'stake recovery %d' % election_obj['election_id']))
+    return wakeups
+
+
+def idle_until(now, config15, config34, elections):
+    '''
+    End of idle time of a run which found no elections, reward and pending transactions
+    :param elections: saved election objects
+    :return: time of the next elections start or frozen stake return
+    '''
+    until = config34['utime_until'] - config15['elections_start_before']
+    for when, name in plan_stake_recovery(now, elections, 0):
+        until = min(until, when)
+    return max(until, now)
+
+
+def watch_interval(now, active_election_id, config15, config34, fast_interval, slow_interval):
+    '''
+    Poll interval of transactions watcher: fast while elections are open or about to open, slow otherwise
+    :return: seconds
+    '''
+    if active_election_id != 0 and now < active_election_id - config15['elections_end_before']:
+        return fast_interval
+    if config34['utime_until'] - config15['elections_start_before'] <= now + slow_interval:
+        return fast_interval
+    return slow_interval
@@ -0,0 +1,108 @@
+import numpy as np
+
+# stakes tried between min stake and our balance, besides stakes just above other participants
+CANDIDATES = 64
+FACTOR_STEP = 0.25
+
+
+def elect(stakes, factors, max_validators, min_validators, min_total_stake):
+    '''
+    Selection of validators by elector try_elect: the number of validators with the largest total effective stake,
+    effective stake of a validator is min(stake, max_factor * min stake of elected)
+    :param stakes: stakes in decreasing order, nanotons
+    :param factors: max factors of participants limited by max_stake_factor, e.g. 3.0
+    :return: (number of elected validators, min stake of elected, total effective stake) or (0, 0, 0) if elections fail
+    '''
+    n = min(len(stakes), max_validators)
+    min_validators = max(min_validators, 1)
+    if n < min_validators:
+        return 0, 0, 0
+    s = stakes[:n]
+    f = factors[:n]
+    # participant i is limited by f[i] * s[j] for j >= k[i], the first j where s[j] < s[i] / f[i]
+    k = np.searchsorted(-s, -s / f, side='right')
+    uncapped = np.cumsum(np.bincount(np.arange(n), s, n + 1) - np.bincount(k, s, n + 1))[:n]
+    capped = np.cumsum(np.bincount(k, f, n + 1))[:n]
+    totals = uncapped + s * capped
+    j = min_validators - 1 + int(np.argmax(totals[min_validators - 1:]))
+    if totals[j] < min_total_stake:
+        return 0, 0, 0
+    return j + 1, s[j], totals[j]
+
+
+class StakePlanner:
+    '''
+    Finds stake and max factor which give the largest effective stake against current participants of elections
+    '''
+
+    def __init__(self, participants, config16, config17):
+        '''
+        :param participants: list of (stake, max_factor) of other participants, max_factor as in elector, 65536 is 1.0
+        :param config16: {'max_validators', 'min_validators', ...}
+        :param config17: {'max_stake', 'min_stake', 'min_total_stake', 'max_stake_factor'}
+        '''
+        self.max_validators = int(config16['max_validators'])
+        self.min_validators = int(config16['min_validators'])
+        self.max_stake = int(config17['max_stake'])
+        self.min_total_stake = int(config17['min_total_stake'])
+        self.max_stake_factor = int(config17['max_stake_factor']) / 65536.0
+        stakes = np.minimum(np.array([p[0] for p in participants], dtype=np.float64), self.max_stake)
+        factors = np.minimum(np.array([p[1] for p in participants], dtype=np.float64) / 65536.0, self.max_stake_factor)
+        order = np.argsort(-stakes, kind='stable')
+        self.stakes = stakes[order]
+        self.factors = factors[order]
+
+    def evaluate(self, stake, factor):
+        '''
+        Elections with our stake added after other participants with the same stake, as the latest one
+        :return: (our effective stake, number of elected validators, min stake of elected)
+        '''
+        pos = int(np.searchsorted(-self.stakes, -stake, side='right'))
+        stakes = np.insert(self.stakes, pos, stake)
+        factors = np.insert(self.factors, pos, factor)
+        count, min_elected, total = elect(stakes, factors, self.max_validators, self.min_validators, self.min_total_stake)
+        if pos >= count:
+            return 0, count, min_elected
+        return min(stake, factor * min_elected), count, min_elected
+
+    def candidates(self, min_stake, max_stake):
+        '''
+        Stakes worth trying: the bounds, stakes above other participants and an even grid between the bounds
+        '''
+        # 1 token above, float stakes have no nanoton precision
+        above = np.minimum(self.stakes[(self.stakes >= min_stake) & (self.stakes < max_stake)] + 1000000000, max_stake)
+        stakes = np.unique(np.concatenate([above, np.linspace(min_stake, max_stake, CANDIDATES)]))
+        if len(stakes) > CANDIDATES:
+            stakes = stakes[np.linspace(0, len(stakes) - 1, CANDIDATES).astype(int)]
+        return np.unique(np.concatenate([[min_stake, max_stake], stakes]))
+
+    def plan(self, min_stake, max_stake, max_factor):
+        '''
+        :param min_stake: least stake to send, nanotons
+        :param max_stake: stake limit by our balance, nanotons
+        :param max_factor: factor limit of our config
+        :return: {'stake', 'factor', 'effective', 'validators', 'min_elected'} or None if no stake is elected.
+                 Of equal effective stakes the smallest stake is taken, with the largest factor
+                 to keep the effective stake if min stake of elected goes down
+        '''
+        max_stake = min(max_stake, self.max_stake)
+        max_factor = max(min(max_factor, self.max_stake_factor), 1.0)
+        if max_stake < min_stake:
+            return None
+        factors = np.unique(np.append(np.arange(1.0, max_factor, FACTOR_STEP), max_factor))[::-1]
+        best = None
+        best_effective = 0
+        for stake in self.candidates(min_stake, max_stake):
+            for factor in factors:
+                effective, count, min_elected = self.evaluate(stake, factor)
+                if effective > best_effective:
+                    best_effective = effective
+                    best = {'stake': int(stake), 'factor': float(factor), 'effective': int(effective),
+                            'validators': count, 'min_elected': int(min_elected)}
+        if best is not None and best['stake'] > best['effective'] + 1 and best['effective'] + 1 >= min_stake:
+            # stake above max factor limit is returned anyway, the limit is enough
+            stake = best['effective'] + 1
+            effective, count, min_elected = self.evaluate(stake, best['factor'])
+            if effective >= best_effective:
+                best.update({'stake': stake, 'effective': int(effective), 'validators': count, 'min_elected': int(min_elected)})
+        return best
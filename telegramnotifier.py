@@ -1,15 +1,26 @@
 import requests
 
 class TelegramNotifier:
-    def __init__(self, token, chat_ids):
+    URL = 'https://api.telegram.org'
+    TIMEOUT = 30
+
+    def __init__(self, token, chat_ids, session=None, timeout=TIMEOUT, url=None):
+        '''
+        :param session: requests.Session to reuse connections, None makes a new connection for every message
+        '''
         self.token = token
         self.chat_ids = chat_ids
+        self.session = session
+        self.timeout = timeout
+        self.url = url or self.URL
 
     def send(self, message):
+        post = requests.post if self.session is None else self.session.post
         for cid in self.chat_ids:
             payload = {
                 'chat_id': cid,
                 'text': message,
                 'parse_mode': 'HTML'
             }
-            res = requests.post("https://api.telegram.org/bot%s/sendMessage" % self.token, data=payload).content
+            res = post("%s/bot%s/sendMessage" % (self.url, self.token), data=payload, timeout=self.timeout)
+            res.raise_for_status()
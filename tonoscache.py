@@ -0,0 +1,207 @@
+import json
+import os
+import threading
+import time
+import utils
+
+
+class TonosCache:
+    '''
+    Two-tier cache of tonos-cli read results: in-process memo and json file on disk
+    '''
+    # key prefix: (ttl in seconds, saved to disk, dropped when active election changes)
+    POLICY = {
+        'getconfig:1': (86400, True, False),
+        'getconfig:15': (86400, True, True),
+        'getconfig:16': (86400, True, True),
+        'getconfig:17': (86400, True, True),
+        # current validator set switches after the election ends, it is never read from a previous run
+        'getconfig:34': (60, False, True),
+        'account': (60, False, False),
+        'runget:active_election_id': (30, False, False),
+        'runget:compute_returned_stake': (300, False, True),
+        'run:getTransactions': (30, False, False),
+        'run:getCustodians': (3600, True, False),
+    }
+
+    def __init__(self, filename=None, ttl=None):
+        '''
+        :param filename: json file for persistent entries, None keeps everything in memory
+        :param ttl: overrides of POLICY ttl by key prefix
+        '''
+        self.filename = filename
+        self.policy = dict(self.POLICY)
+        for k, v in (ttl or {}).items():
+            if k in self.policy:
+                self.policy[k] = (v,) + self.policy[k][1:]
+        self.lock = threading.RLock()
+        self.memory = {}
+        self.disk = {'election_id': None, 'entries': {}}
+        self.counters = {'memory_hits': 0, 'disk_hits': 0, 'misses': 0}
+        if filename is not None:
+            try:
+                with open(filename, 'r') as f:
+                    self.disk = json.load(f)
+            except:
+                pass
+
+    def _policy(self, key):
+        for prefix, policy in self.policy.items():
+            if key == prefix or key.startswith(prefix + ':'):
+                return policy
+        return None
+
+    def _save(self):
+        if self.filename is not None:
+            utils.save_atomic(self.filename, json.dumps(self.disk))
+
+    def get(self, key):
+        '''
+        :return: (found, value)
+        '''
+        now = time.time()
+        with self.lock:
+            entry = self.memory.get(key)
+            if entry is not None and entry['expire'] > now:
+                self.counters['memory_hits'] += 1
+                return True, entry['value']
+            entry = self.disk['entries'].get(key)
+            if entry is not None and entry['expire'] > now:
+                self.counters['disk_hits'] += 1
+                self.memory[key] = entry
+                return True, entry['value']
+            self.counters['misses'] += 1
+            return False, None
+
+    def put(self, key, value):
+        policy = self._policy(key)
+        if policy is None:
+            return
+        ttl, persistent, election_scoped = policy
+        entry = {'value': value, 'expire': time.time() + ttl, 'election_scoped': election_scoped}
+        with self.lock:
+            self.memory[key] = entry
+            if persistent:
+                self.disk['entries'][key] = entry
+                self._save()
+
+    def invalidate(self, *substrings):
+        '''
+        Drops entries whose key contains any of substrings
+        '''
+        with self.lock:
+            for storage in (self.memory, self.disk['entries']):
+                for key in [k for k in storage if any(s in k for s in substrings)]:
+                    del storage[key]
+            self._save()
+
+    def set_election(self, election_id):
+        '''
+        Drops election scoped entries if active election changed
+        '''
+        with self.lock:
+            if self.disk.get('election_id') == election_id:
+                return
+            self.disk['election_id'] = election_id
+            for storage in (self.memory, self.disk['entries']):
+                for key in [k for k, v in storage.items() if v['election_scoped']]:
+                    del storage[key]
+            self._save()
+
+    def stats(self):
+        with self.lock:
+            return dict(self.counters)
+
+
+def config_key(index):
+    return 'getconfig:%d' % index
+
+
+def account_key(addr):
+    return 'account:%s' % addr
+
+
+def runget_key(addr, method, *params):
+    return ':'.join(['runget', method, addr] + list(params))
+
+
+def run_key(addr, method):
+    return 'run:%s:%s' % (method, addr)
+
+
+def update_election(cache, method, out):
+    '''
+    Passes fresh active_election_id result to cache
+    '''
+    if method != 'active_election_id':
+        return
+    try:
+        cache.set_election(int(out[0], 0))
+    except:
+        pass
+
+
+class CachedTonosCli:
+    '''
+    TonosCli with cached read methods, other methods are passed to backend
+    '''
+
+    def __init__(self, backend, cache):
+        self.backend = backend
+        self.cache = cache
+
+    def __getattr__(self, name):
+        return getattr(self.backend, name)
+
+    def _cached(self, key, method, *args):
+        found, value = self.cache.get(key)
+        if found:
+            return True, value
+        res, out = method(*args)
+        if res:
+            self.cache.put(key, out)
+        return res, out
+
+    def getconfig(self, index):
+        return self._cached(config_key(index), self.backend.getconfig, index)
+
+    def account(self, addr):
+        return self._cached(account_key(addr), self.backend.account, addr)
+
+    def runget(self, addr, method, *params):
+        res, out = self._cached(runget_key(addr, method, *params), self.backend.runget, addr, method, *params)
+        if res:
+            update_election(self.cache, method, out)
+        return res, out
+
+    def getTransactions(self, addr, abi):
+        return self._cached(run_key(addr, 'getTransactions'), self.backend.getTransactions, addr, abi)
+
+    def getCustodians(self, addr, abi):
+        return self._cached(run_key(addr, 'getCustodians'), self.backend.getCustodians, addr, abi)
+
+    def _invalidate_wallet(self, addr):
+        self.cache.invalidate(account_key(addr), run_key(addr, 'getTransactions'), 'compute_returned_stake')
+
+    def transfer(self, src, dst, amount, bounce, all, payload, abi, sign):
+        try:
+            return self.backend.transfer(src, dst, amount, bounce, all, payload, abi, sign)
+        finally:
+            self._invalidate_wallet(src)
+
+    def confirmTransaction(self, src, trans_id, abi, sign):
+        try:
+            return self.backend.confirmTransaction(src, trans_id, abi, sign)
+        finally:
+            self._invalidate_wallet(src)
+
+
+def cached_from_config(t, cache_conf, election_folder):
+    '''
+    Wraps TonosCli with cache configured by "cache" config section
+    :return: (tonos-cli, cache or None)
+    '''
+    if not cache_conf.get('enabled', True):
+        return t, None
+    cache = TonosCache(cache_conf.get('file', os.path.join(election_folder, 'tonos-cache.json')), cache_conf.get('ttl'))
+    return CachedTonosCli(t, cache), cache
@@ -1,6 +1,10 @@
 import os
-import subprocess
 import json
+import time
+import procstream
+import retry
+import metrics
+import tracing
 
 class TonosCli:
     TIMEOUT = 320
@@ -11,37 +15,30 @@ class TonosCli:
     def get_int(self, string):
         return int(string, 0)
 
-    def _evaluate(self, args):
+    def _evaluate(self, args, done=None):
         '''
         Run tonos-cli program
         :param args: args to tonos-cli
+        :param done: end of needed output for read only commands, see procstream.run
         :return: return value and stdout of tonos-cli
         '''
+        timeout = retry.timeout(self.TIMEOUT)
+        start = time.time()
+        timed_out = False
+        params = [self.program_path] + args
         try:
-            params = [self.program_path] + args
-            out = subprocess.check_output(params, timeout=self.TIMEOUT).decode("utf-8")
-            retcode = 0
-        except subprocess.CalledProcessError as e:
-            retcode = e.returncode
-            out = 'Cmd: %s (TIMEOUT %d)\n' % (params, self.TIMEOUT)
-            out += e.output.decode("utf-8")
-        except subprocess.TimeoutExpired as e:
-            retcode = 2
-            out = 'Cmd: %s (TIMEOUT %d)\n' % (params, self.TIMEOUT)
-            out += e.output.decode("utf-8")
+            retcode, out, timed_out = procstream.run(params, timeout, done)
+            if retcode != 0:
+                out = 'Cmd: %s (TIMEOUT %d)\n' % (params, timeout) + out
         except Exception as e:
             retcode = -1
-            out = 'Cmd: %s (TIMEOUT %d)\n' % (params, self.TIMEOUT)
+            out = 'Cmd: %s (TIMEOUT %d)\n' % (params, timeout)
             out += str(e)
+        metrics.external_call('tonos-cli', args, start, retcode, timed_out)
+        tracing.external_call('tonos-cli', args, start, retcode)
         return retcode, out
 
-    def getconfig(self, index):
-        '''
-        Get global config
-        :param index: index if config
-        :return: (success, obj)
-        '''
-        retcode, out = self._evaluate(['getconfig', str(index)])
+    def _parse_config(self, index, retcode, out):
         if retcode != 0:
             return False, out
         try:
@@ -52,8 +49,7 @@ class TonosCli:
         except Exception as e:
             return False, 'Output parsing error: ' + str(e) + '\nCmd output: ' + out
 
-    def account(self, addr):
-        retcode, out = self._evaluate(['account', addr])
+    def _parse_account(self, retcode, out):
         if retcode != 0:
             return False, out
         res = {
@@ -71,13 +67,15 @@ class TonosCli:
         except Exception as e:
             return False, 'Output parsing error: ' + str(e) + '\nCmd output: ' + out
 
-    def runget(self, addr, method, *params):
+    def _parse_result(self, retcode, out, empty_result=False):
         '''
-        tonos-cli runget <address> <method> [<params>...]
+        Parses "Result: " json of runget, run and call
+        :param empty_result: succeeded output without "Result:" is {}
         '''
-        retcode, out = self._evaluate(['runget', addr, method] + list(params))
         if retcode != 0 or not 'Succe' in out:
             return False, out
+        if empty_result and not 'Result:' in out:
+            return True, {}
         try:
             ms = 'Result: '
             substr = out[out.find(ms)+len(ms):]
@@ -86,45 +84,59 @@ class TonosCli:
         except Exception as e:
             return False, 'Output parsing error: ' + str(e) + '\nCmd output: ' + out
 
+    def _abi_args(self, command, addr, method, abi, sign, params):
+        p = [command, '--abi', abi, addr, method] + list(params)
+        if sign is not None:
+            p += ['--sign', sign]
+        return p
+
+    def getconfig(self, index):
+        '''
+        Get global config
+        :param index: index if config
+        :return: (success, obj)
+        '''
+        retcode, out = self._evaluate(['getconfig', str(index)], procstream.JsonAfter('Config p%d: ' % index))
+        return self._parse_config(index, retcode, out)
+
+    def _balance_line(self):
+        return procstream.Lines(lambda l: 0 if l.startswith('balance:') else None)
+
+    def account(self, addr):
+        retcode, out = self._evaluate(['account', addr], self._balance_line())
+        return self._parse_account(retcode, out)
+
+    def runget(self, addr, method, *params):
+        '''
+        tonos-cli runget <address> <method> [<params>...]
+        '''
+        retcode, out = self._evaluate(['runget', addr, method] + list(params), procstream.JsonAfter('Result: '))
+        return self._parse_result(retcode, out)
+
+    def runget_raw(self, addr, method, *params):
+        '''
+        tonos-cli runget without parsing of the result
+        :return: (success, text after "Result: ")
+        '''
+        retcode, out = self._evaluate(['runget', addr, method] + list(params), procstream.JsonAfter('Result: '))
+        if retcode != 0 or not 'Succe' in out or not 'Result: ' in out:
+            return False, out
+        ms = 'Result: '
+        return True, out[out.find(ms)+len(ms):]
+
     def call(self, addr, method, abi, sign, *params):
         '''
         tonos-cli call --abi contract.abi.json --sign contract_keys.json <raw_address> methodName {<method_args>}
         '''
-        p = ['call', '--abi', abi, addr, method] + list(params)
-        if sign is not None:
-            p += ['--sign', sign]
-        retcode, out = self._evaluate(p)
-        if retcode != 0 or not 'Succe' in out:
-            return False, out
-        if 'Succe' in out and not 'Result:' in out:
-            return True, {}
-        try:
-            ms = 'Result: '
-            substr = out[out.find(ms)+len(ms):]
-            obj = json.loads(substr)
-            return True, obj
-        except Exception as e:
-            return False, 'Output parsing error: ' + str(e) + '\nCmd output: ' + out
+        retcode, out = self._evaluate(self._abi_args('call', addr, method, abi, sign, params))
+        return self._parse_result(retcode, out, True)
 
     def run(self, addr, method, abi, sign, *params):
         '''
         tonos-cli run [--abi <abi_file>] <address> <method> <params>
         '''
-        p = ['run', '--abi', abi, addr, method] + list(params)
-        if sign is not None:
-            p += ['--sign', sign]
-        retcode, out = self._evaluate(p)
-        if retcode != 0 or not 'Succe' in out:
-            return False, out
-        if 'Succe' in out and not 'Result:' in out:
-            return True, {}
-        try:
-            ms = 'Result: '
-            substr = out[out.find(ms)+len(ms):]
-            obj = json.loads(substr)
-            return True, obj
-        except Exception as e:
-            return False, 'Output parsing error: ' + str(e) + '\nCmd output: ' + out
+        retcode, out = self._evaluate(self._abi_args('run', addr, method, abi, sign, params), procstream.JsonAfter('Result: '))
+        return self._parse_result(retcode, out, True)
 
     def transfer(self, src, dst, amount, bounce, all, payload, abi, sign):
         '''
@@ -0,0 +1,164 @@
+import atexit
+import itertools
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+import metrics
+
+# finished spans kept for Chrome trace of long running daemon
+MAX_EVENTS = 100000
+
+_local = threading.local()
+_lock = threading.Lock()
+_ids = itertools.count(1)
+_events = []
+_conf = {'jsonl': None, 'chrome': None}
+
+
+class Span:
+    '''
+    Timed phase of a run, spans of a thread are nested
+    '''
+
+    def __init__(self, name, attrs, parent, is_phase=False):
+        self.id = next(_ids)
+        self.name = name
+        self.attrs = attrs
+        self.parent = parent.id if parent is not None else None
+        self.is_phase = is_phase
+        self.thread = threading.get_ident()
+        self.start = time.time()
+        self.end = None
+
+    def set(self, **attrs):
+        self.attrs.update(attrs)
+
+
+def configure(jsonl=None, chrome=None):
+    '''
+    Enables tracing
+    :param jsonl: file to append finished spans as JSON lines
+    :param chrome: file to write all spans in Chrome trace event format, see chrome://tracing
+    '''
+    _conf['jsonl'] = open(jsonl, 'a') if jsonl else None
+    _conf['chrome'] = chrome
+    if chrome:
+        atexit.register(flush)
+
+
+def enabled():
+    return _conf['jsonl'] is not None or _conf['chrome'] is not None
+
+
+def _stack():
+    if not hasattr(_local, 'stack'):
+        _local.stack = []
+    return _local.stack
+
+
+def _emit(s):
+    event = {'id': s.id, 'parent': s.parent, 'name': s.name, 'thread': s.thread,
+             'start': s.start, 'end': s.end, 'duration': s.end - s.start, 'attrs': s.attrs}
+    with _lock:
+        if _conf['jsonl'] is not None:
+            _conf['jsonl'].write(json.dumps(event, default=str) + '\n')
+            _conf['jsonl'].flush()
+        if _conf['chrome'] is not None:
+            _events.append(event)
+            if len(_events) > MAX_EVENTS:
+                del _events[:len(_events) - MAX_EVENTS]
+
+
+def _start(name, attrs, is_phase=False):
+    stack = _stack()
+    s = Span(name, attrs, stack[-1] if len(stack) > 0 else None, is_phase)
+    stack.append(s)
+    return s
+
+
+def _finish(s):
+    stack = _stack()
+    # open phases of the span end with it
+    while len(stack) > 0 and stack[-1] is not s:
+        _finish(stack[-1])
+    if len(stack) > 0:
+        stack.pop()
+    s.end = time.time()
+    _emit(s)
+
+
+@contextmanager
+def span(name, **attrs):
+    '''
+    Traces the block as a child of the current span of this thread
+    '''
+    if not enabled():
+        yield None
+        return
+    s = _start(name, attrs)
+    try:
+        yield s
+    except BaseException as e:
+        s.set(error=str(e))
+        raise
+    finally:
+        _finish(s)
+
+
+def phase(name, **attrs):
+    '''
+    Ends the previous phase of the current span and starts the next one, the last phase ends with the span
+    '''
+    if not enabled():
+        return
+    stack = _stack()
+    if len(stack) > 0 and stack[-1].is_phase:
+        _finish(stack[-1])
+    _start(name, attrs, True)
+
+
+def annotate(**attrs):
+    '''
+    Adds attributes to the current span
+    '''
+    stack = _stack()
+    if len(stack) > 0:
+        stack[-1].set(**attrs)
+
+
+def external_call(tool, args, start, retcode):
+    '''
+    Records finished call of tonos-cli, validator-engine-console or fift as a child span
+    '''
+    if not enabled():
+        return
+    stack = _stack()
+    s = Span('%s %s' % (tool, metrics.command_name(tool, args)), {'tool': tool, 'retcode': retcode},
+             stack[-1] if len(stack) > 0 else None)
+    s.start = start
+    s.end = time.time()
+    _emit(s)
+
+
+def flush():
+    '''
+    Writes Chrome trace of all finished spans
+    '''
+    if _conf['chrome'] is None:
+        return
+    with _lock:
+        events = list(_events)
+    pid = os.getpid()
+    trace = {
+        'displayTimeUnit': 'ms',
+        'traceEvents': [{'name': e['name'], 'cat': e['attrs'].get('tool', 'phase'), 'ph': 'X',
+                         'ts': int(e['start'] * 1000000), 'dur': int(e['duration'] * 1000000),
+                         'pid': pid, 'tid': e['thread'], 'args': e['attrs']} for e in events]
+    }
+    try:
+        with open(_conf['chrome'], 'w') as f:
+            json.dump(trace, f, default=str)
+    except Exception as e:
+        print('Cannot write trace to %s: %s' % (_conf['chrome'], str(e)))
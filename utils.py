@@ -1,7 +1,7 @@
 import os
 import base64
-from emailnotifier import EmailNotifier
-from telegramnotifier import TelegramNotifier
+import retry
+import participants
 
 def get_elector_address(t):
     # Elector address
@@ -12,14 +12,10 @@ def get_elector_address(t):
     elector_addr = '-1:' + out
     return elector_addr
 
-def get_awaiting_transactions(t, msig_addr, dest, abi):
+def filter_transactions(out, dest):
     '''
-    Get transactions list
+    Get ids of transactions to dest from getTransactions result
     '''
-    res, out = t.getTransactions(msig_addr, abi)
-    if not res:
-        print(out)
-        return None
     transactions = []
     try:
         for i in out['transactions']:
@@ -30,61 +26,147 @@ def get_awaiting_transactions(t, msig_addr, dest, abi):
 
     return transactions
 
-def confirm_transactions_to_elector(t, msig_addr, keyfile, abi, try_num=30, printl=print):
-    elector_addr = get_elector_address(t)
-    if elector_addr is None:
-        return [], []
+def get_awaiting_transactions(t, msig_addr, dest, abi):
+    '''
+    Get transactions list
+    '''
+    res, out = t.getTransactions(msig_addr, abi)
+    if not res:
+        print(out)
+        return None
+    return filter_transactions(out, dest)
+
+async def _fetch_run_state(at, msig_addr, abi):
+    import asyncio
+    (res, out), (res_trans, out_trans) = await asyncio.gather(at.getconfig(1), at.getTransactions(msig_addr, abi))
+    state = {
+        'elector_addr': '-1:' + out if res else None,
+        'transactions': None,
+        'returned_stake': (False, 'No elector address'),
+        'active_election_id': (False, 'No elector address')
+    }
+    if not res:
+        print(out)
+        return state
+    if res_trans:
+        state['transactions'] = filter_transactions(out_trans, state['elector_addr'])
+    else:
+        print(out_trans)
+    if state['transactions'] is None or len(state['transactions']) > 0:
+        # register ends the run on pending transactions or when they are not known
+        state['returned_stake'] = state['active_election_id'] = (False, 'Not fetched, pending transactions')
+        return state
+
+    msig_addr_hex = '0x' + msig_addr[3:]
+    queries = [at.runget(state['elector_addr'], 'compute_returned_stake', msig_addr_hex),
+               at.runget(state['elector_addr'], 'active_election_id')]
+    if at.cache is not None:
+        # warm up the cache for balance checks
+        queries.append(at.account(msig_addr))
+    results = await asyncio.gather(*queries)
+    state['returned_stake'], state['active_election_id'] = results[0], results[1]
+    return state
+
+def fetch_run_state(at, msig_addr, abi):
+    '''
+    Runs independent start of run queries concurrently
+    :param at: AsyncTonosCli
+    :return: {'elector_addr': addr or None, 'transactions': list or None,
+              'returned_stake': runget result, 'active_election_id': runget result}
+    '''
+    from asynctonoscli import run_sync
+    return run_sync(_fetch_run_state(at, msig_addr, abi))
 
-    # проверим, есть ли транзакции к электору в ожидании подтверждения
-    transactions = get_awaiting_transactions(t, msig_addr, elector_addr, abi)
-    if transactions is None:
-        return [], []
+def confirm_wallets_to_elector(t, wallets, abi, try_num=30, printl=print, elector_addr=None, skip=(), workers=4):
+    '''
+    Confirms transactions to elector of many wallets. Elector address is looked up once,
+    transactions of all wallets are listed and confirmed in parallel, every transaction has its own deadline
+    :param wallets: list of (msig_addr, keyfile)
+    :param elector_addr: known elector address, None gets it from config
+    :param skip: (msig_addr, id) of transactions already confirmed by this custodian
+    :param workers: number of tonos-cli calls made at once
+    :return: {msig_addr: (confirmed ids, unconfirmed ids)}
+    '''
+    from concurrent.futures import ThreadPoolExecutor
+    results = {msig_addr: ([], []) for msig_addr, keyfile in wallets}
+    if elector_addr is None:
+        elector_addr = get_elector_address(t)
+    if elector_addr is None:
+        return results
 
-    if len(transactions) == 0:
-        return [], []
+    run_deadline = retry.current_deadline()
 
-    printl('Found unconfirmed transactions: %s' % str(transactions))
+    def list_wallet(msig_addr):
+        with retry.deadline_scope(run_deadline):
+            return get_awaiting_transactions(t, msig_addr, elector_addr, abi)
 
-    confirmed = []
-    unconfirmed = []
+    def confirm_one(item):
+        msig_addr, keyfile, i = item
 
-    for i in transactions:
-        for n in range(try_num):
+        def confirm(n):
             printl('Try %d Confirming %s' % (n+1, i))
             res, out = t.confirmTransaction(msig_addr, i, abi, keyfile)
-            if res:
-                printl('Success')
-                confirmed.append(i)
-                break
-            else:
-                printl(out)
-        if i not in confirmed:
-            printl('Failed')
-            unconfirmed.append(i)
-
-    return confirmed, unconfirmed
-
-
-def request_reward(t, fift, recover_script, msig_addr, elector_addr, abi, keyfile, try_num=30):
-    fn = fift.get_tempfile_name('recover-query.boc')
-    res, out = fift.run(recover_script, fn)
+            printl('Success %s' % i if res else out)
+            return res, out
+
+        try:
+            with retry.deadline_scope(retry.transaction_deadline(run_deadline)):
+                res, out = retry.policy(try_num).run(confirm, printl=printl)
+        except Exception as e:
+            res, out = False, str(e)
+        if not res:
+            printl('Failed %s' % i)
+        return res
+
+    def pool_map(function, items):
+        if len(items) == 1:
+            return [function(items[0])]
+        with ThreadPoolExecutor(max_workers=max(min(workers, len(items)), 1)) as executor:
+            return list(executor.map(function, items))
+
+    # проверим, есть ли транзакции к электору в ожидании подтверждения
+    items = []
+    for (msig_addr, keyfile), transactions in zip(wallets, pool_map(list_wallet, [w[0] for w in wallets])):
+        if transactions is None:
+            continue
+        transactions = [i for i in transactions if (msig_addr, i) not in skip]
+        if len(transactions) > 0:
+            printl('Found unconfirmed transactions of %s: %s' % (msig_addr, str(transactions)))
+        items += [(msig_addr, keyfile, i) for i in transactions]
+    if len(items) == 0:
+        return results
+
+    for (msig_addr, keyfile, i), res in zip(items, pool_map(confirm_one, items)):
+        results[msig_addr][0 if res else 1].append(i)
+    return results
+
+def confirm_transactions_to_elector(t, msig_addr, keyfile, abi, try_num=30, printl=print, elector_addr=None, skip=(), workers=4):
+    '''
+    Confirms transactions to elector of one wallet
+    :param skip: ids of transactions already confirmed by this custodian
+    :return: (confirmed ids, unconfirmed ids) in order of transactions list
+    '''
+    return confirm_wallets_to_elector(t, [(msig_addr, keyfile)], abi, try_num, printl, elector_addr,
+                                      set((msig_addr, i) for i in skip), workers)[msig_addr]
+
+
+def request_reward(t, payloads, msig_addr, elector_addr, abi, keyfile, try_num=30):
+    res, out = payloads.recover_query()
     if not res:
         print(out)
         return None
-    try:
-        with open(fn, 'rb') as f:
-            recover_request = base64.b64encode(f.read()).decode("utf-8")
-        os.remove(fn)
-    except:
-        return None
+    recover_request = base64.b64encode(out).decode("utf-8")
 
-    for n in range(try_num):
+    def send(n):
         res, out = t.transfer(msig_addr, elector_addr, 1000000000, True, False, recover_request, abi, keyfile)
         if not res or 'transId' not in out:
             print(out)
-            continue
-        return out['transId']
-    return None
+        return res, out
+
+    res, out = retry.policy(try_num).run(send, lambda res, out: res and 'transId' in out)
+    if not res:
+        return None
+    return out['transId']
 
 import tempfile
 
@@ -98,65 +180,108 @@ def save_atomic(filename, data):
     except:
         return False
 
-def notify_custodians(custodians, msg, notify_conf, email_conf):
-    for c in custodians:
-        if c in notify_conf:
-            nn = notify_conf[c]
-            if nn['type'] == 'telegram':
-                try:
-                    telegram = TelegramNotifier(nn['params']['token'], nn['params']['chat_ids'])
-                    telegram.send(msg)
-                except:
-                    pass
-            elif nn['type'] == 'email':
-                try:
-                    email = EmailNotifier(email_conf['login'], email_conf['password'], email_conf['smtp'],
-                                          email_conf['port'])
-                    email.send(nn['params']['address'], msg)
-                except:
-                    pass
-
-def notify_owner(msg, notify_conf, email_conf):
-    if not 'owner' in notify_conf:
-        return
-    nn = notify_conf['owner']
-    if not 'type' in nn:
+_dispatcher = None
+
+
+def install_dispatcher(dispatcher):
+    '''
+    Notifications are queued to dispatcher instead of being sent by the caller, None sends them directly
+    '''
+    global _dispatcher
+    _dispatcher = dispatcher
+
+
+def send_notification(nn, msg, email_conf):
+    if _dispatcher is not None:
+        _dispatcher.submit(nn, msg, email_conf)
         return
+    # notifiers are imported on first message, runs without notifications don't load requests and smtplib
     if nn['type'] == 'telegram':
         try:
+            from telegramnotifier import TelegramNotifier
             telegram = TelegramNotifier(nn['params']['token'], nn['params']['chat_ids'])
             telegram.send(msg)
         except:
             pass
     elif nn['type'] == 'email':
         try:
+            from emailnotifier import EmailNotifier
             email = EmailNotifier(email_conf['login'], email_conf['password'], email_conf['smtp'],
-                                  email_conf['port'])
+                                  email_conf['port'], starttls=email_conf.get('starttls', True))
             email.send(nn['params']['address'], msg)
         except:
             pass
 
+_dedupe = None
 
-def check_participant_list(t, elector_addr, public_key):
-    res, out = t.runget(elector_addr, 'participant_list')
+
+def install_dedupe(dedupe):
+    '''
+    Notifications of the same event are filtered by dedupe, None sends every notification
+    '''
+    global _dedupe
+    _dedupe = dedupe
+
+
+def _deduped(nn, event, msg):
+    if _dedupe is None:
+        return [msg]
+    try:
+        return _dedupe.filter(nn, event, msg)
+    except Exception as e:
+        print('Notification dedupe failed: %s' % str(e))
+        return [msg]
+
+
+def flush_digests(notify_conf, email_conf, force=False):
+    '''
+    Sends digests with finished window to recipients of notify_conf
+    '''
+    if _dedupe is None:
+        return
+    for nn, msg in _dedupe.flush(notify_conf, force):
+        send_notification(nn, msg, email_conf)
+
+def notify_custodians(custodians, msg, notify_conf, email_conf, event=None):
+    '''
+    :param event: (message class, wallet, election id) for dedupe or None
+    '''
+    for c in custodians:
+        if c in notify_conf:
+            for text in _deduped(notify_conf[c], event, msg):
+                send_notification(notify_conf[c], text, email_conf)
+
+def notify_owner(msg, notify_conf, email_conf, event=None):
+    '''
+    :param event: (message class, wallet, election id) for dedupe or None
+    '''
+    if not 'owner' in notify_conf:
+        return
+    nn = notify_conf['owner']
+    if not 'type' in nn:
+        return
+    for text in _deduped(nn, event, msg):
+        send_notification(nn, text, email_conf)
+
+
+def check_participant_list(t, elector_addr, public_key, election_id=None, folder=None):
+    '''
+    Get stake of public key from participant_list
+    :param election_id: active election id for participant list snapshots
+    :param folder: folder for snapshots files
+    :return: stake, 0 if not found or None on error
+    '''
+    res, out = t.runget_raw(elector_addr, 'participant_list')
     if not res:
         print(out)
         return None
     try:
-        node = out[0]
-        while True:
-            participant = node[0]
-            addr_int = int(participant[0], 0)
-            if addr_int == public_key:
-                stake = int(participant[1], 0)
-                return stake
-            if node[1] is None:
-                break
-            node = node[1]
+        index = participants.snapshots(folder).index(election_id, out)
     except Exception as e:
-        pass
+        print('Cannot parse participant list: %s' % str(e))
+        return None
 
-    return 0
+    return index.get(public_key, 0)
 
 def get_custodians(t, addr, abi):
     res, out = t.getCustodians(addr, abi)
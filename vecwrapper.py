@@ -1,16 +1,215 @@
 import os
 import subprocess
 import json
+import procstream
+import retry
+import metrics
+import tracing
+import threading
+import queue
+import atexit
+import time
+
+
+class ConsoleSession:
+    '''
+    One interactive validator-engine-console process, commands are sent over stdin
+    '''
+    READY_MARKER = 'conn ready'
+
+    def __init__(self, params, timeout):
+        self.params = params
+        self.timeout = timeout
+        self.process = None
+        self.lines = None
+
+    def _read(self, process, lines):
+        for l in iter(process.stdout.readline, b''):
+            lines.put(l.decode("utf-8"))
+        lines.put(None)
+
+    def _wait(self, done):
+        '''
+        Collects output lines until done(line) returns a retcode
+        :return: retcode (2 on timeout, 1 if console exited) and collected output
+        '''
+        deadline = time.time() + retry.timeout(self.timeout)
+        out = ''
+        while True:
+            try:
+                l = self.lines.get(timeout=max(deadline - time.time(), 0))
+            except queue.Empty:
+                return 2, out + 'Timed out\n'
+            if l is None:
+                return 1, out
+            out += l
+            retcode = done(l)
+            if retcode is not None:
+                return retcode, out
+
+    def alive(self):
+        return self.process is not None and self.process.poll() is None
+
+    def start(self):
+        '''
+        Starts console and waits for connection to the node
+        '''
+        self.stop()
+        try:
+            self.process = subprocess.Popen(self.params, stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+        except Exception as e:
+            self.process = None
+            return 1, str(e)
+        self.lines = queue.Queue()
+        threading.Thread(target=self._read, args=(self.process, self.lines), daemon=True).start()
+        retcode, out = self._wait(lambda l: 0 if self.READY_MARKER in l else None)
+        if retcode != 0:
+            self.stop()
+        return retcode, out
+
+    def stop(self):
+        if self.process is None:
+            return
+        try:
+            if self.process.poll() is None:
+                self.process.stdin.write(b'quit\n')
+                self.process.stdin.close()
+                self.process.wait(timeout=1)
+        except Exception:
+            pass
+        if self.process.poll() is None:
+            self.process.kill()
+            self.process.wait()
+        self.process = None
+
+    def execute(self, command, done):
+        '''
+        Sends one command and collects its output
+        :param done: function(line) returning retcode when the command output is complete, None otherwise
+        :return: retcode and output of the command
+        '''
+        start = time.time()
+        retcode, out = self._execute(command, done)
+        metrics.external_call('validator-engine-console', [command], start, retcode, retcode == 2)
+        tracing.external_call('validator-engine-console', [command], start, retcode)
+        return retcode, out
+
+    def _execute(self, command, done):
+        if not self.alive():
+            retcode, out = self.start()
+            if retcode != 0:
+                return retcode, out
+        try:
+            self.process.stdin.write((command + '\n').encode("utf-8"))
+            self.process.stdin.flush()
+        except Exception as e:
+            self.stop()
+            return 1, str(e)
+        retcode, out = self._wait(done)
+        if retcode != 0:
+            # output stream of this console is no longer in sync with our commands
+            self.stop()
+        return retcode, out
+
+
+class ConsoleSessionPool:
+    '''
+    Pool of persistent console sessions, dead sessions are restarted on next use
+    '''
+
+    def __init__(self, params, size, timeout):
+        self.sessions = [ConsoleSession(params, timeout) for i in range(size)]
+        self.idle = queue.Queue()
+        for s in self.sessions:
+            self.idle.put(s)
+        atexit.register(self.close)
+
+    def acquire(self):
+        return self.idle.get()
+
+    def release(self, session):
+        self.idle.put(session)
+
+    def execute(self, command, done):
+        session = self.acquire()
+        try:
+            return session.execute(command, done)
+        finally:
+            self.release(session)
+
+    def close(self):
+        for s in self.sessions:
+            s.stop()
+
 
 class ValidatorEngineConsole:
     TIMEOUT = 60
 
-    def __init__(self, program_path, client_key, server_key, server_addr):
+    # session mode: output line which completes a command and number of times it appears
+    RESULT_MARKERS = {
+        'getconfig': ('--------', 2),
+        'newkey': ('created new key', 1),
+        'exportpub': ('got public key', 1),
+        'sign': ('got signature', 1),
+    }
+    DEFAULT_RESULT_MARKER = ('success', 1)
+    # beginning of the line the console prints for a failed command after the prompt, in any case,
+    # e.g. "Failed addpermkey query: [Error : 651 : ...]"; log lines and results may contain these words anywhere else
+    ERROR_MARKERS = ('failed', 'error')
+    PROMPT = '> '
+    # commands without side effects, one-shot console is stopped as soon as their result has arrived
+    READ_ONLY = ('getconfig', 'exportpub', 'sign')
+
+    def __init__(self, program_path, client_key, server_key, server_addr, sessions=0):
+        '''
+        :param sessions: number of persistent console sessions, 0 runs new console for each command
+        '''
         self.program_path = program_path
         self.client_key = client_key
         self.server_key = server_key
         self.server_addr = server_addr
+        self.pool = None
+        if sessions > 0:
+            self.pool = ConsoleSessionPool(self._params([]), sessions, self.TIMEOUT)
+
+    def _params(self, args):
+        a = []
+        for i in args:
+            a.append('-c')
+            a.append(i)
+        return [self.program_path] + ['-k', self.client_key, '-p', self.server_key, '-a', self.server_addr] + a
+
+    def _is_error(self, line):
+        while line.startswith(self.PROMPT):
+            line = line[len(self.PROMPT):]
+        return line.lower().startswith(self.ERROR_MARKERS)
+
+    def _result_checker(self, command):
+        '''
+        Builds function which detects end of command output in session mode
+        '''
+        marker, count = self.RESULT_MARKERS.get(command.split(' ')[0], self.DEFAULT_RESULT_MARKER)
+        seen = [0]
 
+        def done(line):
+            if marker in line:
+                seen[0] += 1
+                if seen[0] >= count:
+                    return 0
+            elif seen[0] == 0 and self._is_error(line):
+                return 1
+            return None
+        return done
+
+    def _evaluate_session(self, command):
+        retcode, out = self.pool.execute(command, self._result_checker(command))
+        if retcode != 0:
+            out = 'Cmd: %s (TIMEOUT %d)\n' % (command, self.TIMEOUT) + out
+        return retcode, out
+
+    def close(self):
+        if self.pool is not None:
+            self.pool.close()
 
     def _evaluate(self, args):
         '''
@@ -18,28 +217,149 @@ class ValidatorEngineConsole:
         :param args:
         :return: return value and stdout
         '''
+        if self.pool is not None and len(args) == 1:
+            return self._evaluate_session(args[0])
+        timeout = retry.timeout(self.TIMEOUT)
+        start = time.time()
+        timed_out = False
+        done = None
+        if len(args) == 1 and args[0].split(' ')[0] in self.READ_ONLY:
+            done = procstream.Lines(self._result_checker(args[0]))
+        params = self._params(args) + ['-c', 'quit']
         try:
-            a = []
-            for i in args:
-                a.append('-c')
-                a.append(i)
-            params = [self.program_path] + ['-k', self.client_key, '-p', self.server_key, '-a', self.server_addr] + a + ['-c', 'quit']
-            out = subprocess.check_output(params, timeout=self.TIMEOUT).decode("utf-8")
-            retcode = 0
-        except subprocess.CalledProcessError as e:
-            retcode = e.returncode
-            out = 'Cmd: %s (TIMEOUT %d)\n' % (params, self.TIMEOUT)
-            out += e.output.decode("utf-8")
-        except subprocess.TimeoutExpired as e:
-            retcode = 2
-            out = 'Cmd: %s (TIMEOUT %d)\n' % (params, self.TIMEOUT)
-            out += e.output.decode("utf-8")
+            retcode, out, timed_out = procstream.run(params, timeout, done)
+            if retcode != 0:
+                out = 'Cmd: %s (TIMEOUT %d)\n' % (params, timeout) + out
         except Exception as e:
             retcode = 1
-            out = 'Cmd: %s (TIMEOUT %d)\n' % (params, self.TIMEOUT)
+            out = 'Cmd: %s (TIMEOUT %d)\n' % (params, timeout)
             out += str(e)
+        metrics.external_call('validator-engine-console', args, start, retcode, timed_out)
+        tracing.external_call('validator-engine-console', args, start, retcode)
         return retcode, out
 
+    def _split_output(self, commands, retcode, out):
+        '''
+        Splits output of one console process with several commands
+        :return: list of (retcode, output) of every command, retcode is None for commands without
+                 own result in the output, they were passed to the console and may have been applied
+        '''
+        lines = out.splitlines(True)
+        for n, l in enumerate(lines):
+            if ConsoleSession.READY_MARKER in l:
+                lines = lines[n+1:]
+                break
+        results = []
+        buf = ''
+        failed = False
+        for l in lines:
+            if len(results) == len(commands):
+                break
+            if buf == '':
+                done = self._result_checker(commands[len(results)])
+            buf += l
+            r = done(l)
+            if r is not None:
+                results.append((r, buf))
+                buf = ''
+                if r != 0:
+                    failed = True
+                    break
+        if not failed and len(results) < len(commands) and retcode != 0:
+            results.append((retcode, buf))
+        # output after a failure is not attributed to the next commands
+        results += [(None, 'Cmd: %s (UNKNOWN)\nNo result of the command in console output\n' % c) for c in commands[len(results):]]
+        return results
+
+    def _evaluate_batch(self, commands):
+        if self.pool is None:
+            retcode, out = self._evaluate(commands)
+            return self._split_output(commands, retcode, out)
+        results = []
+        session = self.pool.acquire()
+        try:
+            for c in commands:
+                retcode, out = session.execute(c, self._result_checker(c))
+                if retcode != 0:
+                    out = 'Cmd: %s (TIMEOUT %d)\n' % (c, self.TIMEOUT) + out
+                results.append((retcode, out))
+                if retcode != 0:
+                    break
+        finally:
+            self.pool.release(session)
+        return results
+
+    def run_batch(self, commands, stop_on_error=True):
+        '''
+        Runs several commands in one console process, a command passed to a console is never run again
+        :param stop_on_error: if False commands not sent to the session after failed one are run next
+        :return: list of (success, output), success is None for commands passed to one-shot console
+                 without own result in its output, they may have been applied
+        '''
+        results = []
+        while len(results) < len(commands):
+            batch = self._evaluate_batch(commands[len(results):])
+            if len(batch) == 0:
+                batch = [(1, 'No output for command %s' % commands[len(results)])]
+            results += [(None if retcode is None else retcode == 0, out) for retcode, out in batch]
+            if stop_on_error and not results[-1][0]:
+                break
+        return results
+
+    def configure_validator(self, permkey, adnl_key, election_id, expire):
+        '''
+        Adds permanent key, temp key, ADNL addr and validator addr in one console process.
+        Removes added keys and keys of commands with unknown result if some of commands failed
+        :return: True if node configured
+        '''
+        plan = [
+            ('addpermkey %s %d %d' % (permkey, election_id, expire), 'delpermkey %s' % permkey),
+            ('addtempkey %s %s %d' % (permkey, permkey, expire), 'deltempkey %s %s' % (permkey, permkey)),
+            ('addadnl %s 0' % adnl_key, 'deladnl %s' % adnl_key),
+            ('addvalidatoraddr %s %s %d' % (permkey, adnl_key, expire), 'delvalidatoraddr %s %s' % (permkey, adnl_key)),
+        ]
+        results = self.run_batch([c for c, undo in plan])
+        if len(results) == len(plan) and all(res for res, out in results):
+            return True
+        print([out for res, out in results if res is not True][0])
+
+        rollback = [plan[n][1] for n, (res, out) in enumerate(results) if res is not False]
+        rollback.reverse()
+        for res, out in self._delete(rollback):
+            if not res:
+                print(out)
+        return False
+
+    def _delete(self, commands):
+        '''
+        Runs delete commands until each of them has a result. A repeated deletion changes nothing,
+        so deletions with unknown result are sent again
+        :return: list of (success, output)
+        '''
+        results = []
+        while len(results) < len(commands):
+            batch = self.run_batch(commands[len(results):], False)
+            known = 0
+            while known < len(batch) and batch[known][0] is not None:
+                known += 1
+            # no result at all is a failure of the first command
+            results += batch[:known] or [(False, batch[0][1])]
+        return results
+
+    def delete_validator(self, permkey, temp_keys, adnl_addrs):
+        '''
+        Force deletes validator ADNL addrs, temp keys and permanent key in one console process
+        :return: True if all keys deleted
+        '''
+        commands = ['delvalidatoraddr %s %s' % (permkey, i) for i in adnl_addrs] + \
+                   ['deltempkey %s %s' % (permkey, i) for i in temp_keys] + \
+                   ['delpermkey %s' % permkey]
+        results = self._delete(commands)
+        for res, out in results:
+            if not res:
+                print(out)
+        return all(res for res, out in results)
+
     def getconfig(self):
         '''
         downloads current config
@@ -88,10 +408,13 @@ class ValidatorEngineConsole:
     def sign(self, key, data):
         '''
         signs bytestring with privkey
+        :param data: bytes or hex string
         '''
+        if isinstance(data, bytes):
+            data = data.hex().upper()
         retcode, out = self._evaluate(['sign ' + key + ' ' + data])
         if retcode != 0:
-            return False
+            return False, out
         try:
             ms = 'got signature '
             sign = out[out.find(ms) + len(ms):-1]